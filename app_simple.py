@@ -1,16 +1,21 @@
 import os
+import hmac
 import logging
 import json
-from flask import Flask, render_template, session, request, jsonify, redirect, url_for
+from flask import Flask, Response, render_template, session, request, jsonify, redirect, url_for, stream_with_context
 from datetime import datetime
 import uuid
 from utils.ai_chat_handler import AIChatHandler
-from utils.database_restaurant_api import DatabaseRestaurantAPI
-from utils.simple_chat_storage import SimpleChatStorage
+from utils.action_handler import ActionHandler
+from utils.database_restaurant_api import DatabaseRestaurantAPI, count_queries, query_stats
+from utils.catalog_cache import catalog_cache
+from utils.chat_storage_backends import create_chat_storage
+from utils.conversation_store import create_conversation_store
+from utils.conversation_state import ConversationState
 from config import Config
 # Remove SQLAlchemy models - using Supabase directly
 from config_supabase import supabase
-from auth import auth_bp, login_required
+from auth import auth_bp, login_required, password_hasher
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -29,7 +34,82 @@ app.register_blueprint(auth_bp)
 # Initialize handlers
 chat_handler = AIChatHandler()
 restaurant_api = DatabaseRestaurantAPI()
-chat_storage = SimpleChatStorage()
+# Card buttons and quick replies answered from the catalog, without the AI
+action_handler = ActionHandler(restaurant_api, chat_handler.fallback_handler)
+chat_storage = create_chat_storage()
+
+# Recent messages per chat kept server-side for the chat handler; the
+# session cookie only carries the chat id
+conversation_store = create_conversation_store()
+
+# Messages loaded per page when opening a chat or scrolling back
+HISTORY_PAGE_SIZE = int(os.environ.get('CHAT_HISTORY_PAGE_SIZE', 20))
+
+def get_conversation(chat_id, user_email):
+    """Get the recent messages of a chat, loading them from chat storage if the store misses"""
+    if not chat_id:
+        return []
+    
+    messages = conversation_store.get(chat_id)
+    if messages is None:
+        page = chat_storage.get_chat_messages_page(chat_id, user_email, limit=conversation_store.window)
+        messages = chat_storage.convert_session_messages(page['messages'])
+        conversation_store.set(chat_id, messages)
+    return messages
+
+def get_conversation_state(chat_id, user_email, history, message_content):
+    """Get a chat's slot state updated with a new user message
+    
+    Only the new message is matched. The state lives with the chat session
+    in chat storage, with the conversation store as a cache in front; it is
+    only rebuilt from the conversation window for chats saved before
+    sessions kept their state.
+    """
+    state = conversation_store.get_state(chat_id) if chat_id else None
+    if state is None and chat_id and user_email:
+        stored = chat_storage.get_session_state(chat_id, user_email)
+        if stored is not None:
+            state = ConversationState.from_dict(stored)
+    if state is None:
+        return ConversationState.from_messages(history)
+    return state.update(message_content)
+
+def start_chat_turn(chat_id, user_email, message_content):
+    """Create the user message, load the chat's history and state and save the message
+    
+    Returns (user_message, history, state) for the chat handler.
+    """
+    user_message = {
+        'id': str(uuid.uuid4()),
+        'type': 'user',
+        'content': message_content,
+        'timestamp': datetime.now().isoformat(),
+        'message_type': 'text'
+    }
+    
+    # Recent conversation from the server-side store
+    history = get_conversation(chat_id, user_email) + [user_message]
+    state = get_conversation_state(chat_id, user_email, history, message_content)
+    
+    # Save user message to database
+    if chat_id and user_email:
+        chat_storage.save_message(chat_id, user_email, 'user', message_content, user_message)
+    return user_message, history, state
+
+def finish_chat_turn(chat_id, user_email, user_message, bot_response, state):
+    """Save the bot response, the updated conversation window and the state with the session"""
+    if chat_id and user_email:
+        chat_storage.save_message(chat_id, user_email, 'bot', bot_response['content'], bot_response)
+        chat_storage.set_session_state(chat_id, user_email, state.to_dict())
+        conversation_store.append(chat_id, [user_message, bot_response])
+        conversation_store.set_state(chat_id, state)
+
+def run_chat_turn(message_content, history, state=None):
+    """Get the bot response for a message, logging how many restaurant queries it took"""
+    with count_queries() as queries:
+        bot_response = chat_handler.process_message(message_content, history, state)
+    logging.info(f"Chat turn issued {queries['queries']} restaurant queries")
+    return bot_response
 
 # Supabase setup - tables created manually via SQL schema
 try:
@@ -50,7 +130,6 @@ def index():
         # Create new chat session
         chat_id = chat_storage.create_chat_session(user_email)
         session['current_chat_id'] = chat_id
-        session['chat_history'] = []
         
         # Add personalized welcome message
         user_name = session.get('user_name', 'there')
@@ -65,14 +144,7 @@ def index():
         # Save welcome message to database
         if chat_id:
             chat_storage.save_message(chat_id, user_email, 'bot', welcome_message['content'], welcome_message)
-        
-        session['chat_history'] = [welcome_message]
-    else:
-        # Load existing chat history from database
-        chat_id = session['current_chat_id']
-        if chat_id:
-            messages = chat_storage.get_chat_messages(chat_id, user_email)
-            session['chat_history'] = chat_storage.convert_session_messages(messages)
+            conversation_store.set(chat_id, [welcome_message])
     
     return render_template('index_simple.html')
 
@@ -93,53 +165,81 @@ def send_message():
         if not message_content:
             return jsonify({'error': 'Empty message'}), 400
         
-        # Create user message
-        user_message = {
-            'id': str(uuid.uuid4()),
-            'type': 'user',
-            'content': message_content,
-            'timestamp': datetime.now().isoformat(),
-            'message_type': 'text'
-        }
-        
-        # Save user message to database
-        chat_id = session.get('current_chat_id')
-        user_email = session.get('user_id', '')
-        if chat_id and user_email:
-            chat_storage.save_message(chat_id, user_email, 'user', message_content, user_message)
-        
-        # Add to session history
-        if 'chat_history' not in session:
-            session['chat_history'] = []
-        
-        session['chat_history'].append(user_message)
-        session.modified = True
-        
-        # Process message and get bot response
-        bot_response = chat_handler.process_message(message_content, session['chat_history'])
-        
-        # Save bot response to database
-        if chat_id and user_email:
-            chat_storage.save_message(chat_id, user_email, 'bot', bot_response['content'], bot_response)
-        
-        # Add bot response to session history
-        session['chat_history'].append(bot_response)
-        session.modified = True
-        
-        return jsonify({
-            'user_message': user_message,
-            'bot_response': bot_response
-        })
-        
+        return send_message_internal(message_content)
+    
     except Exception as e:
         logging.error(f"Error processing message: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def format_sse(event, data):
+    """Format one Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/send_message/stream', methods=['POST'])
+@login_required
+def send_message_stream():
+    """Handle message sending, streaming the bot response as Server-Sent Events
+    
+    Emits a ``user_message`` event, ``token`` events with the reply text as
+    the AI generates it, then a ``done`` event with the complete bot
+    response (cards and quick replies included). A failure once the stream
+    has started is sent as an ``error`` event.
+    """
+    data = request.get_json(silent=True) or {}
+    message_content = data.get('message', '').strip()
+    
+    if not message_content:
+        return jsonify({'error': 'Empty message'}), 400
+    
+    chat_id = session.get('current_chat_id')
+    user_email = session.get('user_id', '')
+    try:
+        user_message, history, state = start_chat_turn(chat_id, user_email, message_content)
+    except Exception as e:
+        logging.error(f"Error processing message: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+    
+    def generate():
+        try:
+            yield format_sse('user_message', user_message)
+            
+            with count_queries() as queries:
+                for event, payload in chat_handler.stream_message(message_content, history, state):
+                    if event == 'token':
+                        yield format_sse('token', {'text': payload})
+                        continue
+                    
+                    # Save bot response before telling the client we are done
+                    finish_chat_turn(chat_id, user_email, user_message, payload, state)
+                    yield format_sse('done', payload)
+            
+            logging.info(f"Chat turn issued {queries['queries']} restaurant queries")
+        
+        except Exception as e:
+            logging.error(f"Error streaming message: {e}")
+            yield format_sse('error', {'error': 'Internal server error'})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/get_history', methods=['GET'])
 @login_required
 def get_history():
-    """Get chat history"""
-    return jsonify(session.get('chat_history', []))
+    """Get the latest page of the current chat's history"""
+    chat_id = session.get('current_chat_id')
+    if not chat_id:
+        return jsonify([])
+    
+    page = chat_storage.get_chat_messages_page(chat_id, session.get('user_id', ''), limit=HISTORY_PAGE_SIZE)
+    response = jsonify(chat_storage.convert_session_messages(page['messages']))
+    
+    # Cursor for the page before the loaded history, if there is one
+    if page['next_cursor']:
+        response.headers['X-History-Cursor'] = page['next_cursor']
+    return response
 
 @app.route('/api/quick_reply', methods=['POST'])
 @login_required
@@ -154,11 +254,51 @@ def quick_reply():
             return send_message_internal(reply_text)
         
         return jsonify({'error': 'Empty reply'}), 400
-        
+    
     except Exception as e:
         logging.error(f"Error processing quick reply: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/action', methods=['POST'])
+@login_required
+def handle_action():
+    """Handle a card button or quick reply by its action id
+    
+    Known actions (``book_<id>``, ``menu_<id>``, ``directions_<id>``,
+    ``more_restaurants``, ``booking``, cuisines, ...) are answered straight
+    from the catalog; anything else is sent on as the button's text.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        action = data.get('action', '').strip()
+        reply_text = data.get('text', '').strip()
+        
+        if not action:
+            if reply_text:
+                return send_message_internal(reply_text)
+            return jsonify({'error': 'Empty action'}), 400
+        
+        chat_id = session.get('current_chat_id')
+        user_email = session.get('user_id', '')
+        content = reply_text or action.replace('_', ' ')
+        
+        # Labels like "Italian" or "New York" still fill the chat's slots
+        user_message, history, state = start_chat_turn(chat_id, user_email, content)
+        
+        bot_response = action_handler.dispatch(action, state)
+        if bot_response is None:
+            bot_response = run_chat_turn(content, history, state)
+        finish_chat_turn(chat_id, user_email, user_message, bot_response, state)
+        
+        return jsonify({
+            'user_message': user_message,
+            'bot_response': bot_response
+        })
+    
+    except Exception as e:
+        logging.error(f"Error handling action: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/new-chat', methods=['POST'])
 @login_required
 def new_chat():
@@ -176,7 +316,6 @@ def new_chat():
         if new_chat_id:
             # Update session with new chat ID
             session['current_chat_id'] = new_chat_id
-            session['chat_history'] = []
             
             # Add welcome message to new chat
             user_name = session.get('user_name', 'there')
@@ -190,7 +329,7 @@ def new_chat():
             
             # Save welcome message
             chat_storage.save_message(new_chat_id, user_email, 'bot', welcome_message['content'], welcome_message)
-            session['chat_history'] = [welcome_message]
+            conversation_store.set(new_chat_id, [welcome_message])
             
             return jsonify({
                 'success': True,
@@ -203,7 +342,7 @@ def new_chat():
                 'success': False,
                 'error': 'Failed to create new chat session'
             })
-        
+    
     except Exception as e:
         logging.error(f"New chat error: {str(e)}")
         return jsonify({
@@ -215,37 +354,11 @@ def send_message_internal(message_content):
     """Internal method to process messages"""
     user_email = session.get('user_id', '')
     chat_id = session.get('current_chat_id')
-    
-    # Create user message
-    user_message = {
-        'id': str(uuid.uuid4()),
-        'type': 'user',
-        'content': message_content,
-        'timestamp': datetime.now().isoformat(),
-        'message_type': 'text'
-    }
-    
-    # Add to chat history
-    if 'chat_history' not in session:
-        session['chat_history'] = []
-    
-    session['chat_history'].append(user_message)
-    session.modified = True
-    
-    # Save user message to storage
-    if chat_id:
-        chat_storage.save_message(chat_id, user_email, 'user', message_content, user_message)
+    user_message, history, state = start_chat_turn(chat_id, user_email, message_content)
     
     # Process message and get bot response
-    bot_response = chat_handler.process_message(message_content, session['chat_history'])
-    
-    # Add bot response to history
-    session['chat_history'].append(bot_response)
-    session.modified = True
-    
-    # Save bot response to storage
-    if chat_id:
-        chat_storage.save_message(chat_id, user_email, 'bot', bot_response['content'], bot_response)
+    bot_response = run_chat_turn(message_content, history, state)
+    finish_chat_turn(chat_id, user_email, user_message, bot_response, state)
     
     return jsonify({
         'user_message': user_message,
@@ -264,7 +377,7 @@ def get_chat_history():
             'success': True,
             'chat_sessions': chat_sessions
         })
-        
+    
     except Exception as e:
         logging.error(f"Error fetching chat history: {e}")
         return jsonify({
@@ -293,17 +406,18 @@ def load_chat(chat_id):
         if 'current_chat_id' in session:
             chat_storage.end_chat_session(session['current_chat_id'], user_email)
         
-        # Load messages from selected chat
-        messages = chat_storage.get_chat_messages(chat_id, user_email)
+        # Load the latest page of messages from selected chat
+        page = chat_storage.get_chat_messages_page(chat_id, user_email, limit=HISTORY_PAGE_SIZE)
         session['current_chat_id'] = chat_id
-        session['chat_history'] = chat_storage.convert_session_messages(messages)
         
         return jsonify({
             'success': True,
-            'messages': session['chat_history'],
-            'chat_id': chat_id
+            'messages': chat_storage.convert_session_messages(page['messages']),
+            'chat_id': chat_id,
+            'next_cursor': page['next_cursor'],
+            'has_more': page['has_more']
         })
-        
+    
     except Exception as e:
         logging.error(f"Error loading chat: {e}")
         return jsonify({
@@ -311,6 +425,39 @@ def load_chat(chat_id):
             'error': 'Failed to load chat'
         }), 500
 
+@app.route('/api/chat-messages', methods=['GET'])
+@login_required
+def get_chat_messages_page():
+    """Get a page of older messages for scroll-back, the current chat by default"""
+    try:
+        user_email = session.get('user_id', '')
+        chat_id = request.args.get('chat_id') or session.get('current_chat_id')
+        before = request.args.get('before')
+        limit = min(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 100)
+        
+        if not chat_id or limit < 1:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid request'
+            }), 400
+        
+        page = chat_storage.get_chat_messages_page(chat_id, user_email, limit=limit, before=before)
+        
+        return jsonify({
+            'success': True,
+            'messages': chat_storage.convert_session_messages(page['messages']),
+            'chat_id': chat_id,
+            'next_cursor': page['next_cursor'],
+            'has_more': page['has_more']
+        })
+    
+    except Exception as e:
+        logging.error(f"Error fetching chat messages: {e}")
+        return jsonify({
+            'success': False,
+            'error': 'Failed to fetch messages'
+        }), 500
+
 @app.route('/api/delete-chat/<chat_id>', methods=['DELETE'])
 @login_required
 def delete_chat(chat_id):
@@ -325,7 +472,7 @@ def delete_chat(chat_id):
             # If this was the current chat, clear session
             if session.get('current_chat_id') == chat_id:
                 session.pop('current_chat_id', None)
-                session['chat_history'] = []
+            conversation_store.delete(chat_id)
             
             return jsonify({
                 'success': True,
@@ -336,7 +483,7 @@ def delete_chat(chat_id):
                 'success': False,
                 'error': 'Failed to delete chat'
             }), 400
-            
+    
     except Exception as e:
         logging.error(f"Error deleting chat: {e}")
         return jsonify({
@@ -344,6 +491,45 @@ def delete_chat(chat_id):
             'error': 'Failed to delete chat'
         }), 500
 
+@app.route('/api/metrics', methods=['GET'])
+@login_required
+def metrics():
+    """Counters for monitoring the chat backend"""
+    return jsonify({
+        'restaurant_queries': dict(query_stats),
+        'catalog_cache': catalog_cache.stats(),
+        'llm_cache': chat_handler.response_cache.stats(),
+        'routing': chat_handler.route_stats(),
+        'restaurant_turns': chat_handler.timing_stats(),
+        'conversation_store': conversation_store.stats(),
+        'llm': chat_handler.llm.stats(),
+        'llm_singleflight': chat_handler.inflight.stats(),
+        'actions': action_handler.stats(),
+        'password_hashing': password_hasher.stats(),
+        'chat_writer': chat_storage.write_stats() if hasattr(chat_storage, 'write_stats') else None
+    })
+
+@app.route('/api/catalog/invalidate', methods=['POST'])
+def invalidate_catalog():
+    """Drop cached restaurant data after it is edited, e.g. from a database webhook
+    
+    Only enabled when CATALOG_INVALIDATE_TOKEN is set; callers send it in the
+    X-Catalog-Token header.
+    """
+    token = os.environ.get('CATALOG_INVALIDATE_TOKEN')
+    if not token:
+        return jsonify({'error': 'Not found'}), 404
+    if not hmac.compare_digest(request.headers.get('X-Catalog-Token', ''), token):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind')
+    if kind not in (None, 'restaurants', 'availability'):
+        return jsonify({'error': 'Unknown kind'}), 400
+    
+    dropped = catalog_cache.invalidate(kind)
+    return jsonify({'success': True, 'invalidated': dropped})
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
@@ -0,0 +1,172 @@
+"""
+DineDesk ASGI Entry Point
+Chat turns are served on the event loop, every other route by the Flask app
+
+A chat turn spends most of its time waiting on Groq. Here the two chat
+endpoints run as coroutines on the async Groq client, so one worker keeps
+many turns in flight instead of one per thread; storage and catalog calls,
+which are local or cached, run on threads. Requests without a logged-in
+session, and all other routes, are passed to Flask unchanged.
+
+Usage: uvicorn asgi:application --workers 4
+"""
+
+import asyncio
+import json
+import logging
+from itsdangerous import BadSignature
+from werkzeug.http import parse_cookie
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    raise ImportError("The ASGI entry point needs asgiref and uvicorn (pip install asgiref uvicorn)")
+
+from app_simple import app, chat_handler, start_chat_turn, finish_chat_turn, format_sse
+from utils.database_restaurant_api import count_queries
+
+flask_app = WsgiToAsgi(app)
+
+def load_session(scope):
+    """Read the Flask session from the request's cookie, empty if it is missing or invalid"""
+    headers = dict(scope['headers'])
+    cookies = parse_cookie(headers.get(b'cookie', b'').decode('latin-1'))
+    cookie = cookies.get(app.config['SESSION_COOKIE_NAME'])
+    serializer = app.session_interface.get_signing_serializer(app)
+    if not cookie or serializer is None:
+        return {}
+    
+    try:
+        return serializer.loads(cookie, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+async def read_json(receive):
+    """Read the request body as JSON, None if it is not valid JSON"""
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    
+    try:
+        return json.loads(body or b'{}')
+    except ValueError:
+        return None
+
+async def send_json(send, status, data):
+    body = json.dumps(data).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def send_message(receive, send, session):
+    """Async version of app_simple.send_message"""
+    try:
+        data = await read_json(receive)
+        message_content = (data or {}).get('message', '').strip()
+        
+        if not message_content:
+            return await send_json(send, 400, {'error': 'Empty message'})
+        
+        chat_id = session.get('current_chat_id')
+        user_email = session.get('user_id', '')
+        user_message, history, state = await asyncio.to_thread(start_chat_turn, chat_id, user_email, message_content)
+        
+        # Process message and get bot response
+        with count_queries() as queries:
+            bot_response = await chat_handler.aprocess_message(message_content, history, state)
+        logging.info(f"Chat turn issued {queries['queries']} restaurant queries")
+        await asyncio.to_thread(finish_chat_turn, chat_id, user_email, user_message, bot_response, state)
+        
+        await send_json(send, 200, {
+            'user_message': user_message,
+            'bot_response': bot_response
+        })
+    
+    except Exception as e:
+        logging.error(f"Error processing message: {e}")
+        await send_json(send, 500, {'error': 'Internal server error'})
+
+async def send_message_stream(receive, send, session):
+    """Async version of app_simple.send_message_stream"""
+    try:
+        data = await read_json(receive)
+        message_content = (data or {}).get('message', '').strip()
+        
+        if not message_content:
+            return await send_json(send, 400, {'error': 'Empty message'})
+        
+        chat_id = session.get('current_chat_id')
+        user_email = session.get('user_id', '')
+        user_message, history, state = await asyncio.to_thread(start_chat_turn, chat_id, user_email, message_content)
+    
+    except Exception as e:
+        logging.error(f"Error processing message: {e}")
+        return await send_json(send, 500, {'error': 'Internal server error'})
+    
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no')
+        ]
+    })
+    
+    async def emit(event, data):
+        await send({'type': 'http.response.body', 'body': format_sse(event, data).encode(), 'more_body': True})
+    
+    try:
+        await emit('user_message', user_message)
+        with count_queries() as queries:
+            async for event, payload in chat_handler.astream_message(message_content, history, state):
+                if event == 'token':
+                    await emit('token', {'text': payload})
+                    continue
+                
+                # Save bot response before telling the client we are done
+                await asyncio.to_thread(finish_chat_turn, chat_id, user_email, user_message, payload, state)
+                await emit('done', payload)
+        
+        logging.info(f"Chat turn issued {queries['queries']} restaurant queries")
+    
+    except Exception as e:
+        # The 200 is already sent, so the client is told in the stream
+        logging.error(f"Error streaming message: {e}")
+        await emit('error', {'error': 'Internal server error'})
+    await send({'type': 'http.response.body', 'body': b''})
+
+# Routes served here instead of by Flask (POST only, logged-in users only)
+ASYNC_ROUTES = {
+    '/api/send_message': send_message,
+    '/api/send_message/stream': send_message_stream
+}
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    """ASGI app: chat turns are handled here, everything else by Flask"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    
+    handler = ASYNC_ROUTES.get(scope['path']) if scope['type'] == 'http' and scope['method'] == 'POST' else None
+    if handler is not None:
+        session = load_session(scope)
+        if 'user_id' in session:
+            return await handler(receive, send, session)
+    
+    # Flask applies login_required and answers every other route
+    await flask_app(scope, receive, send)
\ No newline at end of file
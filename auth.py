@@ -1,29 +1,15 @@
-import json
-import os
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from werkzeug.security import generate_password_hash, check_password_hash
 import re
+from utils.user_directory import create_user_directory
+from utils.password_hasher import create_password_hasher, PasswordHasherBusy
 
 auth_bp = Blueprint('auth', __name__)
 
-# JSON file for storing user data
-USERS_FILE = 'users.json'
+# User accounts, indexed by email (users.json by default, see USER_DIRECTORY)
+user_directory = create_user_directory()
 
-def load_users():
-    """Load users from JSON file"""
-    if not os.path.exists(USERS_FILE):
-        return {"users": []}
-    
-    try:
-        with open(USERS_FILE, 'r') as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return {"users": []}
-
-def save_users(users_data):
-    """Save users to JSON file"""
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users_data, f, indent=2)
+# Password hashing, calibrated to this machine and run off the request thread
+password_hasher = create_password_hasher()
 
 def validate_email(email):
     """Validate email format"""
@@ -32,8 +18,7 @@ def validate_email(email):
 
 def user_exists(email):
     """Check if user with email already exists"""
-    users_data = load_users()
-    return any(user['email'].lower() == email.lower() for user in users_data['users'])
+    return user_directory.exists(email)
 
 @auth_bp.route('/signup', methods=['GET', 'POST'])
 def signup():
@@ -73,14 +58,21 @@ def signup():
             return render_template('auth/signup.html', name=name, email=email)
         
         # Create new user
-        users_data = load_users()
+        try:
+            password_hash = password_hasher.hash(password)
+        except PasswordHasherBusy:
+            flash('We are busy right now, please try again in a moment', 'error')
+            return render_template('auth/signup.html', name=name, email=email), 503
+        
         new_user = {
             'name': name,
             'email': email,
-            'password': password  # Plain text as requested for now
+            'password': password_hash
         }
-        users_data['users'].append(new_user)
-        save_users(users_data)
+        if not user_directory.add(new_user):
+            # Someone signed up with this email since the check above
+            flash('An account with this email already exists', 'error')
+            return render_template('auth/signup.html', name=name, email=email)
         
         flash('Account created successfully! Please log in.', 'success')
         return redirect(url_for('auth.login'))
@@ -100,12 +92,23 @@ def login():
             return render_template('auth/login.html', email=email)
         
         # Check credentials
-        users_data = load_users()
-        user = None
-        for u in users_data['users']:
-            if u['email'].lower() == email and u['password'] == password:
-                user = u
-                break
+        user = user_directory.get(email)
+        try:
+            if user:
+                valid, new_hash = password_hasher.verify(user['password'], password)
+            else:
+                # Hash anyway, so unknown emails take as long as wrong passwords
+                password_hasher.verify(password_hasher.dummy_hash, password)
+        except PasswordHasherBusy:
+            flash('We are busy right now, please try again in a moment', 'error')
+            return render_template('auth/login.html', email=email), 503
+        
+        if user:
+            if not valid:
+                user = None
+            elif new_hash:
+                # Stored as plaintext or at an older cost, upgrade it now we know the password
+                user_directory.update_password(user['email'], new_hash)
         
         if user:
             # Set session
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Load test for the chat endpoint under concurrent users
+
+Logs in once, then keeps --concurrency chat turns in flight against
+/api/send_message (or the streaming endpoint with --stream) until
+--requests turns have completed, and reports throughput and latency
+percentiles. Run it against each serving mode with the same worker count to
+compare them:
+    
+    gunicorn -w 4 app_simple:app
+    uvicorn asgi:application --workers 4
+
+Usage: python -m benchmarks.chat_load_test --email you@example.com --password ... [--url http://localhost:5000] [--concurrency 50] [--requests 500] [--stream]
+"""
+
+import argparse
+import asyncio
+import itertools
+import sys
+import time
+
+import httpx
+
+MESSAGES = [
+    "Find Italian restaurants in Manhattan",
+    "What's good for dinner tonight?",
+    "Book a table for 4 at 7pm",
+    "Any vegetarian places nearby?",
+    "Show me the menu",
+    "I want sushi in Brooklyn"
+]
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+async def login(client, email, password):
+    """Log in and start a chat so turns are saved like a real user's"""
+    response = await client.post('/login', data={'email': email, 'password': password})
+    if not client.cookies:
+        sys.exit(f"Login failed ({response.status_code}), check --email and --password")
+    await client.get('/')
+
+async def chat_turn(client, message, stream):
+    if not stream:
+        response = await client.post('/api/send_message', json={'message': message})
+        response.raise_for_status()
+        return None
+    
+    # Time to first token is what the user notices on the streaming endpoint
+    first_token = None
+    started = time.perf_counter()
+    async with client.stream('POST', '/api/send_message/stream', json={'message': message}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if first_token is None and line == 'event: token':
+                first_token = time.perf_counter() - started
+    return first_token
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        await login(client, args.email, args.password)
+        
+        messages = itertools.cycle(MESSAGES)
+        remaining = iter(range(args.requests))
+        latencies, first_tokens, errors = [], [], 0
+        
+        async def user():
+            nonlocal errors
+            for _ in remaining:
+                started = time.perf_counter()
+                try:
+                    first_token = await chat_turn(client, next(messages), args.stream)
+                except httpx.HTTPError as e:
+                    errors += 1
+                    print(f"Request failed: {e!r}")
+                    continue
+                latencies.append(time.perf_counter() - started)
+                if first_token is not None:
+                    first_tokens.append(first_token)
+        
+        started = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+    
+    latencies.sort()
+    first_tokens.sort()
+    print(f"{args.url} - {args.concurrency} concurrent users, {args.requests} turns{' (streaming)' if args.stream else ''}")
+    print(f"  throughput: {len(latencies) / elapsed:.1f} turns/s over {elapsed:.1f}s, {errors} errors")
+    if latencies:
+        print("  latency: p50 {:.0f}ms  p95 {:.0f}ms  p99 {:.0f}ms  max {:.0f}ms".format(
+            *(percentile(latencies, f) * 1000 for f in (0.5, 0.95, 0.99)), latencies[-1] * 1000))
+    if first_tokens:
+        print("  first token: p50 {:.0f}ms  p95 {:.0f}ms  p99 {:.0f}ms".format(
+            *(percentile(first_tokens, f) * 1000 for f in (0.5, 0.95, 0.99))))
+    return 1 if errors else 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--email', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--stream', action='store_true', help="use /api/send_message/stream and report time to first token")
+    args = parser.parse_args()
+    
+    sys.exit(asyncio.run(run(args)))
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
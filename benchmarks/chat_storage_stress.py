@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Stress check for SimpleChatStorage under parallel writers
+
+Several processes (standing in for gunicorn workers), each with a few
+threads, save messages into one shared chat session while readers list
+sessions and load history. Afterwards a fresh storage instance verifies that
+no message was lost or corrupted and that the metadata and index counts
+match the log.
+
+Usage: python -m benchmarks.chat_storage_stress [--workers 4] [--threads 2] [--messages 50]
+"""
+
+import argparse
+import json
+import multiprocessing
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from utils.simple_chat_storage import SimpleChatStorage
+
+USER_EMAIL = 'stress@example.com'
+
+def run_worker(chat_dir, chat_id, worker_no, threads, messages, flush_interval):
+    """Save messages from several threads while other threads read history"""
+    storage = SimpleChatStorage(chat_dir=chat_dir, flush_interval=flush_interval)
+    stop_reading = threading.Event()
+    
+    def write(thread_no):
+        for i in range(messages):
+            storage.save_message(chat_id, USER_EMAIL, 'user', f"w{worker_no}-t{thread_no}-m{i}")
+            if random.random() < 0.1:
+                time.sleep(random.random() / 100)
+    
+    def read():
+        while not stop_reading.is_set():
+            storage.get_user_chat_sessions(USER_EMAIL)
+            storage.get_chat_messages(chat_id, USER_EMAIL)
+    
+    reader = threading.Thread(target=read)
+    reader.start()
+    writers = [threading.Thread(target=write, args=(n,)) for n in range(threads)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    stop_reading.set()
+    reader.join()
+    storage.close()
+
+def verify(chat_dir, chat_id, expected):
+    """Check the log, metadata record and index of the shared session"""
+    storage = SimpleChatStorage(chat_dir=chat_dir, flush_interval=0)
+    errors = []
+    
+    log_path = storage.get_session_log_path(USER_EMAIL, chat_id)
+    with open(log_path, 'r', encoding='utf-8') as f:
+        lines = [line for line in f if line.strip()]
+    try:
+        contents = [json.loads(line)['content'] for line in lines]
+    except json.JSONDecodeError:
+        errors.append('corrupt line in message log')
+        contents = []
+    
+    if len(lines) != expected:
+        errors.append(f"log holds {len(lines)} messages, expected {expected}")
+    if len(set(contents)) != len(contents):
+        errors.append('duplicate messages in log')
+    
+    with open(storage.get_session_meta_path(USER_EMAIL, chat_id), 'r', encoding='utf-8') as f:
+        meta_count = json.load(f)['message_count']
+    if meta_count != expected:
+        errors.append(f"metadata counts {meta_count} messages, expected {expected}")
+    
+    sessions = {chat['id']: chat for chat in storage.get_user_chat_sessions(USER_EMAIL)}
+    index_count = sessions.get(chat_id, {}).get('message_count')
+    if index_count != expected:
+        errors.append(f"index counts {index_count} messages, expected {expected}")
+    
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=2)
+    parser.add_argument('--messages', type=int, default=50)
+    args = parser.parse_args()
+    
+    chat_dir = tempfile.mkdtemp(prefix='chat-stress-')
+    try:
+        chat_id = SimpleChatStorage(chat_dir=chat_dir, flush_interval=0).create_chat_session(USER_EMAIL)
+        
+        # Mix write-through and write-behind workers
+        started = time.perf_counter()
+        workers = [
+            multiprocessing.Process(
+                target=run_worker,
+                args=(chat_dir, chat_id, n, args.threads, args.messages, 0 if n % 2 == 0 else 0.05)
+            )
+            for n in range(args.workers)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        
+        expected = args.workers * args.threads * args.messages
+        errors = verify(chat_dir, chat_id, expected)
+    finally:
+        shutil.rmtree(chat_dir, ignore_errors=True)
+    
+    print(f"{expected} messages from {args.workers} workers x {args.threads} threads in {elapsed:.2f}s")
+    if errors:
+        for error in errors:
+            print(f"FAIL: {error}")
+        sys.exit(1)
+    print("OK: no lost or corrupted updates")
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
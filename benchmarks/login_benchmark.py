@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark for login latency under concurrent load
+
+Several client threads log in against a temporary user directory while a
+probe thread stands in for chat requests, timing a small piece of request
+work in a loop. Logins verify their password either through the bounded
+PasswordHasher pool or inline on the request thread (--inline), to show how
+much a login burst slows the rest of the app and what the login p99 costs.
+
+Usage: python -m benchmarks.login_benchmark [--clients 16] [--logins 20] [--workers 2] [--target-ms 50] [--inline]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+from werkzeug.security import check_password_hash
+
+from utils.password_hasher import PasswordHasher, PasswordHasherBusy
+from utils.user_directory import JsonUserDirectory
+
+PASSWORD = 'correct horse battery staple'
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else float('nan')
+
+def make_directory(path, users, password_hash):
+    """A users.json with ``users`` accounts sharing one password hash"""
+    with open(path, 'w') as f:
+        json.dump({'users': [
+            {'name': f"User {i}", 'email': f"user{i}@example.com", 'password': password_hash} for i in range(users)
+        ]}, f)
+    return JsonUserDirectory(path)
+
+def run(args):
+    hasher = PasswordHasher(iterations=args.iterations, target_ms=args.target_ms, workers=args.workers,
+                            max_pending=args.queue, timeout=args.timeout)
+    password_hash = hasher.hash(PASSWORD)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = make_directory(os.path.join(tmp, 'users.json'), args.users, password_hash)
+        
+        def login(email):
+            user = directory.get(email)
+            if args.inline:
+                return check_password_hash(user['password'], PASSWORD)
+            return hasher.verify(user['password'], PASSWORD)[0]
+        
+        latencies, busy, failures = [], [0], [0]
+        lock = threading.Lock()
+        
+        def client(client_no):
+            for i in range(args.logins):
+                started = time.perf_counter()
+                try:
+                    ok = login(f"user{(client_no * args.logins + i) % args.users}@example.com")
+                except PasswordHasherBusy:
+                    with lock:
+                        busy[0] += 1
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+                    failures[0] += not ok
+        
+        # Chat requests: a little CPU work each, they should not queue behind logins
+        probe_latencies = []
+        stop = threading.Event()
+        
+        def probe():
+            payload = {'messages': [{'content': 'Find Italian food in Manhattan', 'n': n} for n in range(50)]}
+            while not stop.is_set():
+                started = time.perf_counter()
+                json.loads(json.dumps(payload))
+                probe_latencies.append(time.perf_counter() - started)
+                time.sleep(0.005)
+        
+        probe_thread = threading.Thread(target=probe)
+        probe_thread.start()
+        time.sleep(0.2)
+        idle_probe = list(probe_latencies)
+        
+        started = time.perf_counter()
+        clients = [threading.Thread(target=client, args=(n,)) for n in range(args.clients)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        probe_thread.join()
+        loaded_probe = probe_latencies[len(idle_probe):]
+    
+    mode = 'inline' if args.inline else f"pool of {args.workers}"
+    print(f"{args.clients} clients x {args.logins} logins, {hasher.iterations} iterations, verification {mode}")
+    print(f"  logins: {len(latencies) / elapsed:.1f}/s, {busy[0]} busy, {failures[0]} failed")
+    print("  login latency: p50 {:.0f}ms  p95 {:.0f}ms  p99 {:.0f}ms".format(
+        *(percentile(latencies, f) * 1000 for f in (0.5, 0.95, 0.99))))
+    print("  chat probe p99: idle {:.2f}ms, during logins {:.2f}ms".format(
+        percentile(idle_probe, 0.99) * 1000, percentile(loaded_probe, 0.99) * 1000))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--logins', type=int, default=20, help="logins per client")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--queue', type=int, default=32)
+    parser.add_argument('--timeout', type=float, default=5)
+    parser.add_argument('--target-ms', type=float, default=50)
+    parser.add_argument('--iterations', type=int, default=None, help="skip calibration and use this many iterations")
+    parser.add_argument('--inline', action='store_true', help="verify on the client thread instead of the pool")
+    run(parser.parse_args())
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the shared message matcher
+
+Times the per-message keyword scans the chat handlers used to run (one
+substring search per keyword, repeated for every category) against the
+single compiled pass of utils.message_matcher, then replays a conversation
+the way a chat turn reads it (the new message several times, plus the recent
+history), and lists messages where the substring scan fired on part of a
+word.
+
+Usage: python -m benchmarks.matcher_benchmark [--rounds 2000]
+"""
+
+import argparse
+import re
+import time
+
+from utils.message_matcher import match_message, message_matcher
+
+HISTORY_WINDOW = 10
+
+SAMPLE_MESSAGES = [
+    "Book a table for 4 people tonight at 7pm",
+    "Can you find an Indian restaurant in Manhattan?",
+    "Is there anything good to eat near Seattle?",
+    "Show me the menu of the most popular Italian place",
+    "I want pizza delivered to Brooklyn",
+    "Any Japanese food in New York for lunch tomorrow?",
+    "We are a party of 6, do you have Mexican places?",
+    "I'm in Mumbai, where can I eat?",
+    "What can you do?",
+    "Hello there, thanks for the help yesterday",
+]
+
+LEGACY_KEYWORDS = {
+    'booking': ['book', 'table', 'reservation', 'reserve', 'seat'],
+    'search': ['restaurant', 'find', 'search', 'near', 'cuisine'],
+    'menu': ['menu', 'food', 'dish', 'eat', 'order', 'popular', 'recommend'],
+    'cuisine': ['italian', 'chinese', 'mexican', 'indian', 'american', 'japanese', 'thai', 'pizza', 'burger', 'pasta'],
+    'new_york': ['new york', 'ny', 'manhattan', 'brooklyn'],
+    'invalid': ['ahmedabad', 'mumbai', 'delhi', 'bangalore', 'chennai', 'kolkata', 'hyderabad', 'pune', 'india'],
+    'time': ['tonight', 'today', 'tomorrow', 'lunch', 'dinner', 'breakfast'],
+}
+
+def legacy_match(message):
+    """The substring scans the handlers ran before the shared matcher"""
+    message_lower = message.lower()
+    found = {category: [k for k in keywords if k in message_lower] for category, keywords in LEGACY_KEYWORDS.items()}
+    party_match = re.search(r'(\d+)\s*(people|person)', message_lower)
+    found['party_size'] = int(party_match.group(1)) if party_match else None
+    return found
+
+def time_per_message(func, rounds):
+    """Average microseconds per message over ``rounds`` passes of the samples"""
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for message in SAMPLE_MESSAGES:
+            func(message)
+    return (time.perf_counter() - started) / (rounds * len(SAMPLE_MESSAGES)) * 1e6
+
+def time_per_turn(func, rounds):
+    """Average microseconds per chat turn: the new message read three times plus the history window"""
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for i, message in enumerate(SAMPLE_MESSAGES):
+            for _ in range(3):
+                func(message)
+            for previous in SAMPLE_MESSAGES[max(0, i - HISTORY_WINDOW):i]:
+                func(previous)
+    return (time.perf_counter() - started) / (rounds * len(SAMPLE_MESSAGES)) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=2000)
+    args = parser.parse_args()
+    
+    legacy_us = time_per_message(legacy_match, args.rounds)
+    matcher_us = time_per_message(message_matcher.match, args.rounds)
+    print(f"substring scans: {legacy_us:.1f} us/message")
+    print(f"compiled pass:   {matcher_us:.1f} us/message ({legacy_us / matcher_us:.1f}x)")
+    
+    legacy_turn_us = time_per_turn(legacy_match, args.rounds)
+    matcher_turn_us = time_per_turn(match_message, args.rounds)
+    print(f"substring scans: {legacy_turn_us:.1f} us/turn")
+    print(f"shared matcher:  {matcher_turn_us:.1f} us/turn ({legacy_turn_us / matcher_turn_us:.1f}x)")
+    
+    print("\nSubstring hits on part of a word:")
+    for message in SAMPLE_MESSAGES:
+        words = set(re.findall(r"[a-z]+", message.lower()))
+        misfires = [
+            keyword
+            for keywords in LEGACY_KEYWORDS.values()
+            for keyword in keywords
+            if keyword in message.lower() and ' ' not in keyword and keyword not in words
+            and not any(word.startswith(keyword) and word[len(keyword):] in ('s', 'es', 'd', 'ed', 'ing') for word in words)
+        ]
+        if misfires:
+            print(f"  {message!r}: {', '.join(misfires)}")
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,71 @@
+-- DineDesk migration 0001: indexes for the hot query paths
+-- Run after supabase_schema.sql, in the Supabase SQL Editor or with
+--   psql "$DATABASE_URL" -f migrations/0001_hot_path_indexes.sql
+-- Check the plans with: python migrations/check_indexes.py
+--
+-- The schema only had primary keys, so every catalog and chat query below
+-- was a sequential scan. Each index matches one access pattern:
+--
+--   DatabaseRestaurantAPI.get_restaurants_by_cuisine / search_restaurants
+--     restaurants WHERE cuisine = ? AND is_active [AND rating >= ?]
+--   DatabaseRestaurantAPI.get_popular_restaurants
+--     restaurants WHERE is_active ORDER BY rating DESC
+--   DatabaseRestaurantAPI.get_restaurant_menu
+--     dishes WHERE restaurant_id = ? AND is_available
+--   DatabaseRestaurantAPI._get_availability
+--     availability_slots WHERE restaurant_id IN (...) AND date = ? AND is_available
+--   ChatStorage.get_user_chat_sessions
+--     chat_sessions WHERE user_email = ? ORDER BY last_activity DESC
+--   ChatStorage.get_chat_messages / get_chat_messages_page / update_session_activity
+--     chat_messages WHERE chat_session_id = ? [AND timestamp < ?] ORDER BY timestamp
+--
+-- Queries only ever read active restaurants and available dishes and slots,
+-- so those indexes are partial and skip the other rows.
+--
+-- On a large live database create the indexes one at a time with
+-- CREATE INDEX CONCURRENTLY (outside a transaction) to avoid blocking writes.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version VARCHAR(50) PRIMARY KEY,
+    applied_at TIMESTAMP DEFAULT NOW()
+);
+
+-- ChatStorage writes these columns; older databases created from
+-- supabase_schema.sql do not have them
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS user_email VARCHAR(120);
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS session_title VARCHAR(200);
+
+-- Restaurants of one cuisine, best rated first (also serves the rating filter)
+CREATE INDEX IF NOT EXISTS idx_restaurants_active_cuisine_rating
+    ON restaurants (cuisine, rating DESC)
+    WHERE is_active;
+
+-- Most popular restaurants across all cuisines
+CREATE INDEX IF NOT EXISTS idx_restaurants_active_rating
+    ON restaurants (rating DESC)
+    WHERE is_active;
+
+-- A restaurant's menu (also indexes the foreign key for cascading deletes)
+CREATE INDEX IF NOT EXISTS idx_dishes_restaurant_available
+    ON dishes (restaurant_id)
+    WHERE is_available;
+
+-- Today's open slots for the restaurants on screen
+CREATE INDEX IF NOT EXISTS idx_availability_slots_restaurant_date
+    ON availability_slots (restaurant_id, date)
+    WHERE is_available;
+
+-- A user's chats, most recent first
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_activity
+    ON chat_sessions (user_email, last_activity DESC);
+
+-- A chat's messages in order, and keyset pages walking back from a timestamp
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session_timestamp
+    ON chat_messages (chat_session_id, timestamp);
+
+INSERT INTO schema_migrations (version) VALUES ('0001_hot_path_indexes')
+    ON CONFLICT (version) DO NOTHING;
+
+COMMIT;
\ No newline at end of file
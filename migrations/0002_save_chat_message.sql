@@ -0,0 +1,56 @@
+-- DineDesk migration 0002: save a chat message and update its session in one call
+-- Run after 0001, in the Supabase SQL Editor or with
+--   psql "$DATABASE_URL" -f migrations/0002_save_chat_message.sql
+--
+-- ChatStorage.save_message used to insert the message, select every message
+-- id of the session to count them, then update the session: three round
+-- trips and a payload that grew with the chat. save_chat_message does the
+-- insert and bumps the session's message_count and last_activity in one
+-- transaction, so saving costs the same however long the chat is and the
+-- counter never misses a concurrent message. ChatStorage calls it through
+-- PostgREST as supabase.rpc('save_chat_message', {...}).
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION save_chat_message(
+    p_id VARCHAR,
+    p_chat_session_id VARCHAR,
+    p_message_type VARCHAR,
+    p_content TEXT,
+    p_message_data JSONB DEFAULT NULL,
+    p_timestamp TIMESTAMP DEFAULT NOW()
+)
+RETURNS chat_messages
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    saved chat_messages;
+BEGIN
+    INSERT INTO chat_messages (id, chat_session_id, message_type, content, message_data, timestamp)
+    VALUES (p_id, p_chat_session_id, p_message_type, p_content, p_message_data, p_timestamp)
+    RETURNING * INTO saved;
+
+    UPDATE chat_sessions
+    SET message_count = COALESCE(message_count, 0) + 1,
+        last_activity = GREATEST(COALESCE(last_activity, p_timestamp), p_timestamp)
+    WHERE id = p_chat_session_id;
+
+    RETURN saved;
+END;
+$$;
+
+-- Counters from here on are incremental, so start them from the true counts
+UPDATE chat_sessions s
+SET message_count = counts.messages
+FROM (
+    SELECT chat_session_id, COUNT(*) AS messages
+    FROM chat_messages
+    GROUP BY chat_session_id
+) counts
+WHERE counts.chat_session_id = s.id
+  AND s.message_count IS DISTINCT FROM counts.messages;
+
+INSERT INTO schema_migrations (version) VALUES ('0002_save_chat_message')
+    ON CONFLICT (version) DO NOTHING;
+
+COMMIT;
\ No newline at end of file
@@ -0,0 +1,64 @@
+-- DineDesk migration 0003: save a batch of chat messages in one call
+-- Run after 0002, in the Supabase SQL Editor or with
+--   psql "$DATABASE_URL" -f migrations/0003_save_chat_messages.sql
+--
+-- Chat messages are now queued by the app and written in batches
+-- (utils/message_writer.py). save_chat_messages inserts a whole batch in one
+-- statement and bumps each session's message_count and last_activity once.
+-- A batch may be replayed after a crash, so message ids already stored are
+-- skipped, as are messages whose session was deleted in the meantime.
+-- ChatStorage.save_messages calls it as
+-- supabase.rpc('save_chat_messages', {'p_messages': [...]}) and gets back
+-- the number of messages inserted.
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION save_chat_messages(p_messages JSONB)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    inserted INTEGER;
+BEGIN
+    WITH batch AS (
+        SELECT m.*
+        FROM jsonb_to_recordset(p_messages) AS m(
+            id VARCHAR,
+            chat_session_id VARCHAR,
+            message_type VARCHAR,
+            content TEXT,
+            message_data JSONB,
+            timestamp TIMESTAMP
+        )
+        JOIN chat_sessions s ON s.id = m.chat_session_id
+    ),
+    saved AS (
+        INSERT INTO chat_messages (id, chat_session_id, message_type, content, message_data, timestamp)
+        SELECT id, chat_session_id, message_type, content, message_data, COALESCE(timestamp, NOW())
+        FROM batch
+        ON CONFLICT (id) DO NOTHING
+        RETURNING chat_session_id, timestamp
+    ),
+    counts AS (
+        SELECT chat_session_id, COUNT(*) AS messages, MAX(timestamp) AS latest
+        FROM saved
+        GROUP BY chat_session_id
+    ),
+    bumped AS (
+        UPDATE chat_sessions s
+        SET message_count = COALESCE(s.message_count, 0) + counts.messages,
+            last_activity = GREATEST(COALESCE(s.last_activity, counts.latest), counts.latest)
+        FROM counts
+        WHERE s.id = counts.chat_session_id
+        RETURNING counts.messages
+    )
+    SELECT COALESCE(SUM(messages), 0) INTO inserted FROM bumped;
+
+    RETURN inserted;
+END;
+$$;
+
+INSERT INTO schema_migrations (version) VALUES ('0003_save_chat_messages')
+    ON CONFLICT (version) DO NOTHING;
+
+COMMIT;
\ No newline at end of file
@@ -0,0 +1,18 @@
+-- DineDesk migration 0004: keep each chat's conversation state with its session
+-- Run after 0003, in the Supabase SQL Editor or with
+--   psql "$DATABASE_URL" -f migrations/0004_chat_session_state.sql
+--
+-- The slots a user has filled in (location, cuisine, time, party size, ...)
+-- used to live only in the conversation store, a TTL cache. After it expired
+-- or the app restarted they were rebuilt from the last CONVERSATION_WINDOW
+-- messages, forgetting anything said earlier in a long chat. ChatStorage now
+-- stores them in chat_sessions.conversation_state after every turn.
+
+BEGIN;
+
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS conversation_state JSONB;
+
+INSERT INTO schema_migrations (version) VALUES ('0004_chat_session_state')
+    ON CONFLICT (version) DO NOTHING;
+
+COMMIT;
\ No newline at end of file
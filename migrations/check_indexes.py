@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+EXPLAIN check for the hot query paths against a local Postgres
+
+Builds the schema in a scratch Postgres schema (supabase_schema.sql, then
+every migration in this directory), fills it with enough synthetic
+restaurants, slots, chats and messages for the planner to care, and
+EXPLAINs the SQL behind each DatabaseRestaurantAPI and ChatStorage query.
+Each query should be answered by its index from migration 0001:
+    
+    OK       the planner picks the index
+    USABLE   the index works but a sequential scan is cheaper at this data
+             size (checked again with enable_seqscan off)
+    MISSING  the query cannot use the index - exits with status 1
+
+The scratch schema is dropped afterwards unless --keep is given.
+
+Usage: python migrations/check_indexes.py [--dsn postgresql://localhost/postgres] [--scale 1.0] [--keep]
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH_SCHEMA = 'dinedesk_index_check'
+
+CUISINES = ['italian', 'chinese', 'mexican', 'indian', 'japanese', 'american', 'thai', 'french',
+            'greek', 'korean', 'vietnamese', 'spanish', 'lebanese', 'ethiopian', 'turkish', 'brazilian']
+
+# Synthetic rows at --scale 1
+SEED_SQL = """
+INSERT INTO restaurants (name, address, city, state, postal_code, cuisine, price_level, rating, is_active,
+                         image_url, description, distance)
+SELECT 'Restaurant ' || n, n || ' Main St', 'New York', 'NY', '10001',
+       (%(cuisines)s)[1 + n %% array_length(%(cuisines)s, 1)],
+       repeat('$', 1 + n %% 4), round((2.5 + random() * 2.5)::numeric, 1), n %% 10 <> 0,
+       'https://example.com/' || n || '.jpg', 'Synthetic restaurant ' || n, (n %% 50) / 10.0 || ' miles'
+FROM generate_series(1, %(restaurants)s) AS n;
+
+INSERT INTO dishes (restaurant_id, name, price, category, is_available, image_url, is_popular)
+SELECT r.id, 'Dish ' || d, 5 + d %% 30, (ARRAY['appetizers', 'mains', 'desserts'])[1 + d %% 3],
+       d %% 7 <> 0, 'https://example.com/dish.jpg', d %% 5 = 0
+FROM restaurants r, generate_series(1, %(dishes_per_restaurant)s) AS d;
+
+INSERT INTO availability_slots (restaurant_id, time_slot, is_available, date)
+SELECT r.id, (5 + s / 2) || CASE WHEN s %% 2 = 0 THEN ':00 PM' ELSE ':30 PM' END, random() < 0.7,
+       CURRENT_DATE + day
+FROM restaurants r, generate_series(0, 8) AS s, generate_series(-%(days)s, %(days)s) AS day;
+
+INSERT INTO chat_sessions (id, session_id, user_email, session_title, started_at, last_activity, status)
+SELECT md5('session' || n), md5('session' || n), 'user' || (n %% %(users)s) || '@example.com', 'Chat ' || n,
+       NOW() - (n || ' minutes')::interval, NOW() - (n || ' minutes')::interval, 'active'
+FROM generate_series(1, %(sessions)s) AS n;
+
+INSERT INTO chat_messages (id, chat_session_id, message_type, content, timestamp)
+SELECT md5('message' || s.id || m), s.id, CASE WHEN m %% 2 = 0 THEN 'user' ELSE 'bot' END, 'Message ' || m,
+       s.started_at + (m || ' seconds')::interval
+FROM chat_sessions s, generate_series(1, %(messages_per_session)s) AS m;
+
+ANALYZE;
+"""
+
+# The SQL PostgREST runs for each query, with the index it should use
+CHECKS = [
+    ('restaurants by cuisine', 'idx_restaurants_active_cuisine_rating',
+     "SELECT * FROM restaurants WHERE cuisine = 'ethiopian' AND is_active = true LIMIT 8"),
+    ('search by cuisine and rating', 'idx_restaurants_active_cuisine_rating',
+     "SELECT * FROM restaurants WHERE is_active = true AND cuisine = 'ethiopian' AND rating >= 4.5 LIMIT 10"),
+    ('popular restaurants', 'idx_restaurants_active_rating',
+     "SELECT * FROM restaurants WHERE is_active = true ORDER BY rating DESC LIMIT 6"),
+    ('restaurant menu', 'idx_dishes_restaurant_available',
+     "SELECT * FROM dishes WHERE restaurant_id = 42 AND is_available = true"),
+    ('availability for cards', 'idx_availability_slots_restaurant_date',
+     "SELECT restaurant_id, time_slot, is_available FROM availability_slots "
+     "WHERE restaurant_id IN (3, 14, 15, 92, 65, 35) AND date = CURRENT_DATE AND is_available = true"),
+    ('user chat sessions', 'idx_chat_sessions_user_activity',
+     "SELECT * FROM chat_sessions WHERE user_email = 'user7@example.com' ORDER BY last_activity DESC LIMIT 50"),
+    ('chat messages', 'idx_chat_messages_session_timestamp',
+     "SELECT * FROM chat_messages WHERE chat_session_id = md5('session42') ORDER BY timestamp ASC"),
+    ('latest message page', 'idx_chat_messages_session_timestamp',
+     "SELECT * FROM chat_messages WHERE chat_session_id = md5('session42') ORDER BY timestamp DESC, id DESC LIMIT 21"),
+    ('earlier message page', 'idx_chat_messages_session_timestamp',
+     "SELECT * FROM chat_messages WHERE chat_session_id = md5('session42') "
+     "AND (timestamp < NOW() - interval '42 minutes' OR (timestamp = NOW() - interval '42 minutes' AND id < md5('x'))) "
+     "ORDER BY timestamp DESC, id DESC LIMIT 21"),
+    ('session message count', 'idx_chat_messages_session_timestamp',
+     "SELECT id FROM chat_messages WHERE chat_session_id = md5('session42')"),
+]
+
+INDEX_NODES = ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan')
+
+def plan_indexes(plan):
+    """(node type, index name) of every index node in an EXPLAIN (FORMAT JSON) plan"""
+    found = []
+    if plan.get('Node Type') in INDEX_NODES:
+        found.append((plan['Node Type'], plan.get('Index Name')))
+    for child in plan.get('Plans', []):
+        found.extend(plan_indexes(child))
+    return found
+
+def explain(cur, sql):
+    cur.execute('EXPLAIN (FORMAT JSON) ' + sql)
+    result = cur.fetchone()[0]
+    plan = (json.loads(result) if isinstance(result, str) else result)[0]['Plan']
+    return plan, plan_indexes(plan)
+
+def build_schema(cur, scale):
+    """Create the tables, apply the migrations and load synthetic data in the scratch schema"""
+    cur.execute(f'DROP SCHEMA IF EXISTS {SCRATCH_SCHEMA} CASCADE')
+    cur.execute(f'CREATE SCHEMA {SCRATCH_SCHEMA}')
+    cur.execute(f'SET search_path TO {SCRATCH_SCHEMA}')
+    
+    with open(os.path.join(ROOT, 'supabase_schema.sql')) as f:
+        cur.execute(f.read())
+    for path in sorted(glob.glob(os.path.join(ROOT, 'migrations', '[0-9]*.sql'))):
+        print(f"Applying {os.path.basename(path)}")
+        with open(path) as f:
+            cur.execute(f.read())
+    
+    cur.execute(SEED_SQL, {
+        'cuisines': CUISINES,
+        'restaurants': int(20000 * scale),
+        'dishes_per_restaurant': 12,
+        'days': 3,
+        'users': int(2000 * scale),
+        'sessions': int(20000 * scale),
+        'messages_per_session': 20
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default='postgresql://localhost/postgres', help="a local database; the check loads ~2M synthetic rows")
+    parser.add_argument('--scale', type=float, default=1.0, help="multiply the synthetic row counts")
+    parser.add_argument('--keep', action='store_true', help=f"keep the {SCRATCH_SCHEMA} schema afterwards")
+    args = parser.parse_args()
+    
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    missing = 0
+    try:
+        build_schema(cur, args.scale)
+        
+        for name, index, sql in CHECKS:
+            plan, indexes = explain(cur, sql)
+            if any(index_name == index for _, index_name in indexes):
+                status = 'OK'
+            else:
+                cur.execute('SET enable_seqscan = off')
+                _, forced = explain(cur, sql)
+                cur.execute('RESET enable_seqscan')
+                if any(index_name == index for _, index_name in forced):
+                    status = 'USABLE'
+                else:
+                    status = 'MISSING'
+                    missing += 1
+            
+            scans = ', '.join(f"{node} on {index_name}" for node, index_name in indexes) or plan['Node Type']
+            print(f"{status:8} {name:30} {scans} (cost {plan['Total Cost']:.0f})")
+    finally:
+        if not args.keep:
+            cur.execute(f'DROP SCHEMA IF EXISTS {SCRATCH_SCHEMA} CASCADE')
+        conn.close()
+    
+    if missing:
+        print(f"{missing} queries cannot use their index")
+    sys.exit(1 if missing else 0)
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
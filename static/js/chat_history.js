@@ -207,6 +207,9 @@ class ChatHistoryManager {
                 
                 // Scroll to bottom after all messages are loaded
                 setTimeout(() => {
+                    if (data.has_more) {
+                        this.showLoadEarlier(data.next_cursor);
+                    }
                     this.dineDesk.scrollToBottom();
                 }, data.messages.length * 100 + 200);
                 
@@ -220,6 +223,68 @@ class ChatHistoryManager {
         }
     }
     
+    showLoadEarlier(cursor) {
+        const messagesContainer = document.getElementById('messages-container');
+        let loadEarlier = document.getElementById('load-earlier');
+        
+        if (!loadEarlier) {
+            loadEarlier = document.createElement('div');
+            loadEarlier.id = 'load-earlier';
+            loadEarlier.className = 'text-center py-2';
+            loadEarlier.innerHTML = `
+                <button class="text-sm text-blue-600 hover:text-blue-800">
+                    <i class="fas fa-history mr-1"></i>Load earlier messages
+                </button>
+            `;
+            loadEarlier.querySelector('button').addEventListener('click', () => {
+                this.loadEarlierMessages(loadEarlier.dataset.cursor);
+            });
+            messagesContainer.insertBefore(loadEarlier, messagesContainer.firstChild);
+        }
+        
+        loadEarlier.dataset.cursor = cursor;
+    }
+    
+    async loadEarlierMessages(cursor) {
+        const params = new URLSearchParams({ before: cursor });
+        if (this.currentChatId) {
+            params.set('chat_id', this.currentChatId);
+        }
+        
+        try {
+            const response = await fetch(`/api/chat-messages?${params}`);
+            const data = await response.json();
+            
+            if (!data.success) {
+                this.dineDesk.showToast(data.error || 'Failed to load messages', 'error');
+                return;
+            }
+            
+            // Prepend the older page while keeping the visible messages in place
+            const messagesContainer = document.getElementById('messages-container');
+            const loadEarlier = document.getElementById('load-earlier');
+            const previousHeight = messagesContainer.scrollHeight;
+            const firstMessage = loadEarlier.nextSibling;
+            
+            data.messages.forEach(message => {
+                const messageElement = this.dineDesk.chatManager.createMessageElement(message, false);
+                messagesContainer.insertBefore(messageElement, firstMessage);
+            });
+            
+            if (data.has_more) {
+                loadEarlier.dataset.cursor = data.next_cursor;
+            } else {
+                loadEarlier.remove();
+            }
+            
+            messagesContainer.scrollTop += messagesContainer.scrollHeight - previousHeight;
+            
+        } catch (error) {
+            console.error('Error loading earlier messages:', error);
+            this.dineDesk.showToast('Failed to load messages', 'error');
+        }
+    }
+    
     async deleteChat(chatId) {
         if (!confirm('Are you sure you want to delete this chat? This action cannot be undone.')) {
             return;
@@ -26,21 +26,87 @@ class ChatManager {
         return messageElement;
     }
     
-    displayBotResponseWithStreaming(message) {
-        if (message.message_type === 'card') {
-            // Display card messages immediately
-            this.displayMessage(message);
-        } else {
-            // Simulate streaming for text messages
-            this.simulateStreamingResponse(message);
+    async streamMessage(text) {
+        const response = await fetch('/api/send_message/stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ message: text })
+        });
+        
+        if (!response.ok || !response.body) {
+            const data = await response.json().catch(() => ({}));
+            throw new Error(data.error || 'Error sending message');
+        }
+        
+        // Read Server-Sent Events frames as they arrive
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let streaming = null;
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const event = this.parseServerSentEvent(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+                if (event) {
+                    streaming = this.handleStreamEvent(event, streaming);
+                }
+            }
         }
     }
     
-    simulateStreamingResponse(message) {
+    parseServerSentEvent(frame) {
+        let event = 'message';
+        const data = [];
+        
+        frame.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                event = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                data.push(line.slice(5).trim());
+            }
+        });
+        
+        if (data.length === 0) return null;
+        return { event: event, data: JSON.parse(data.join('\n')) };
+    }
+    
+    handleStreamEvent(event, streaming) {
+        if (event.event === 'user_message') {
+            this.displayMessage(event.data);
+            this.dineDesk.showTypingIndicator();
+        } else if (event.event === 'token') {
+            if (!streaming) {
+                this.dineDesk.hideTypingIndicator();
+                streaming = this.startStreamingMessage();
+            }
+            streaming.append(event.data.text);
+        } else if (event.event === 'done') {
+            this.dineDesk.hideTypingIndicator();
+            if (streaming) {
+                streaming.finish(event.data);
+            } else {
+                this.displayMessage(event.data);
+            }
+        } else if (event.event === 'error') {
+            // The server failed after the stream started; report it like a failed request
+            throw new Error(event.data.error || 'Error sending message');
+        }
+        
+        return streaming;
+    }
+    
+    startStreamingMessage() {
         const messagesContainer = document.getElementById('messages-container');
         const messageDiv = document.createElement('div');
         messageDiv.className = 'flex justify-start animate-fade-in';
-        messageDiv.dataset.messageId = message.id;
         
         const avatar = `
             <div class="w-8 h-8 bg-gray-100 rounded-full flex items-center justify-center flex-shrink-0 mr-3">
@@ -53,7 +119,7 @@ class ChatManager {
                 <div class="message-bubble bot-message px-4 py-3 text-sm">
                     <div class="streaming-content whitespace-pre-wrap"></div>
                     <span class="typing-cursor animate-pulse">|</span>
-                    <div class="text-xs mt-2 text-gray-500">${this.dineDesk.formatTimestamp(message.timestamp)}</div>
+                    <div class="text-xs mt-2 text-gray-500">${this.dineDesk.formatTimestamp(new Date().toISOString())}</div>
                 </div>
             </div>
         `;
@@ -61,27 +127,20 @@ class ChatManager {
         messagesContainer.appendChild(messageDiv);
         this.dineDesk.scrollToBottom();
         
-        // Stream the content
         const contentElement = messageDiv.querySelector('.streaming-content');
-        const cursorElement = messageDiv.querySelector('.typing-cursor');
-        const content = message.content;
-        let currentIndex = 0;
-        
-        const streamInterval = setInterval(() => {
-            if (currentIndex <= content.length) {
-                contentElement.textContent = content.substring(0, currentIndex);
-                currentIndex++;
+        
+        return {
+            append: (text) => {
+                contentElement.textContent += text;
                 this.dineDesk.scrollToBottom();
-            } else {
-                clearInterval(streamInterval);
-                cursorElement.style.display = 'none';
-                
-                // Replace with complete message
+            },
+            finish: (message) => {
+                // Replace with the complete message, cards and quick replies included
                 const completeMessage = this.createMessageElement(message, false);
                 messageDiv.parentNode.replaceChild(completeMessage, messageDiv);
                 this.dineDesk.scrollToBottom();
             }
-        }, 50);
+        };
     }
     
     createMessageElement(message, animate = true) {
@@ -170,7 +229,7 @@ class ChatManager {
             actionsHTML = '<div class="flex flex-wrap gap-2 mt-3">';
             card.actions.forEach(action => {
                 actionsHTML += `
-                    <button onclick="window.chatManager.handleCardAction('${action.action}')" 
+                    <button onclick="window.chatManager.handleCardAction('${action.action}', '${action.text}')" 
                             class="action-btn px-3 py-1 text-xs rounded-full transition-all duration-200">
                         ${action.text}
                     </button>
@@ -238,7 +297,7 @@ class ChatManager {
         
         quickReplies.forEach(reply => {
             html += `
-                <button onclick="window.chatManager.handleQuickReply('${reply.text}')" 
+                <button onclick="window.chatManager.handleQuickReply('${reply.text}', '${reply.action || ''}')" 
                         class="quick-reply-btn px-3 py-2 text-xs rounded-full transition-all duration-200">
                     ${reply.text}
                 </button>
@@ -249,54 +308,54 @@ class ChatManager {
         return html;
     }
     
-    async handleQuickReply(text) {
+    async handleQuickReply(text, action) {
         try {
-            const response = await fetch('/api/quick_reply', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ text: text })
-            });
-            
-            const data = await response.json();
-            
-            if (response.ok) {
-                // Display user message
-                this.displayMessage(data.user_message);
-                
-                // Show typing indicator
-                this.dineDesk.showTypingIndicator();
-                
-                // Display bot response with delay
-                setTimeout(() => {
-                    this.dineDesk.hideTypingIndicator();
-                    this.displayBotResponseWithStreaming(data.bot_response);
-                }, 500);
+            if (action) {
+                // The server answers known actions directly and sends the rest on as text
+                await this.sendAction(action, text);
             } else {
-                this.dineDesk.showToast(data.error || 'Error processing quick reply', 'error');
+                // Quick replies without an action are sent as regular messages
+                await this.streamMessage(text);
             }
-            
         } catch (error) {
-            this.dineDesk.showToast('Network error. Please try again.', 'error');
+            this.dineDesk.hideTypingIndicator();
+            this.dineDesk.showToast(error.message || 'Network error. Please try again.', 'error');
             console.error('Error handling quick reply:', error);
         }
     }
     
-    handleCardAction(action) {
+    async sendAction(action, text) {
+        this.dineDesk.showTypingIndicator();
+        
+        const response = await fetch('/api/action', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ action: action, text: text })
+        });
+        
+        const data = await response.json();
+        this.dineDesk.hideTypingIndicator();
+        
+        if (!response.ok) {
+            throw new Error(data.error || 'Error sending action');
+        }
+        
+        this.displayMessage(data.user_message);
+        this.displayMessage(data.bot_response);
+    }
+    
+    handleCardAction(action, text) {
         console.log('Card action triggered:', action);
         
-        if (action.startsWith('book_')) {
-            this.dineDesk.showToast('Booking feature will be implemented soon!', 'info');
-        } else if (action.startsWith('menu_')) {
-            this.dineDesk.showToast('Menu viewing feature coming soon!', 'info');
-        } else if (action.startsWith('order_')) {
+        if (action.startsWith('order_')) {
             this.dineDesk.showToast('Online ordering feature in development!', 'info');
         } else if (action.startsWith('reviews_')) {
             this.dineDesk.showToast('Reviews feature coming soon!', 'info');
         } else {
-            // Treat as a message
-            this.handleQuickReply(action);
+            // Booking, menu and directions are answered by the server
+            this.handleQuickReply(text || action, action);
         }
     }
 }
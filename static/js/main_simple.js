@@ -105,33 +105,11 @@ class DineDesk {
         this.showTypingIndicator();
         
         try {
-            const response = await fetch('/api/send_message', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ message: message })
-            });
-            
-            const data = await response.json();
-            
-            if (response.ok) {
-                // Display user message
-                this.chatManager.displayMessage(data.user_message);
-                
-                // Simulate typing delay and display bot response
-                setTimeout(() => {
-                    this.hideTypingIndicator();
-                    this.chatManager.displayBotResponseWithStreaming(data.bot_response);
-                }, 500);
-            } else {
-                this.hideTypingIndicator();
-                this.showToast(data.error || 'Error sending message', 'error');
-            }
-            
+            // The bot response renders as it streams in
+            await this.chatManager.streamMessage(message);
         } catch (error) {
             this.hideTypingIndicator();
-            this.showToast('Network error. Please try again.', 'error');
+            this.showToast(error.message || 'Network error. Please try again.', 'error');
             console.error('Error sending message:', error);
         }
     }
@@ -143,6 +121,12 @@ class DineDesk {
             
             if (response.ok) {
                 this.chatManager.loadMessageHistory(messages);
+                
+                // Older messages are fetched on demand
+                const cursor = response.headers.get('X-History-Cursor');
+                if (cursor) {
+                    this.chatHistory.showLoadEarlier(cursor);
+                }
             }
         } catch (error) {
             console.error('Error loading message history:', error);
@@ -0,0 +1,196 @@
+import re
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, Optional
+
+class ActionHandler:
+    """Answers card buttons and quick replies from their action ids, without the AI
+    
+    Restaurant cards carry actions like ``book_12``, ``menu_12`` and
+    ``directions_12``; quick replies carry ones like ``booking``,
+    ``more_restaurants`` or a cuisine name. These map straight onto catalog
+    lookups, so the busiest clicks never wait on intent guessing or a
+    completion. ``dispatch`` returns None for actions it does not know, and
+    the caller sends the button label through the chat handler instead.
+    """
+    
+    PAGE_SIZE = 3
+    
+    RESTAURANT_ACTIONS = re.compile(r'^(book|menu|directions)_([\w-]+)$')
+    MORE_ACTIONS = re.compile(r'^more_(?:restaurants|options|cuisine)(?:_(\d+))?$')
+    SEARCH_ACTIONS = {'search', 'browse', 'new_york', 'manhattan', 'brooklyn'}
+    CUISINE_ACTIONS = {'italian', 'chinese', 'mexican', 'indian', 'japanese', 'american'}
+    
+    def __init__(self, restaurant_api, rule_handler=None):
+        self.restaurant_api = restaurant_api
+        self.rule_handler = rule_handler
+        self._lock = threading.Lock()
+        self.counts = {}
+    
+    def dispatch(self, action: str, state=None) -> Optional[Dict]:
+        """Get the bot response for an action id, None if the action is not handled here"""
+        action = (action or '').strip().lower()
+        kind = response = None
+        
+        restaurant_action = self.RESTAURANT_ACTIONS.match(action)
+        more_action = self.MORE_ACTIONS.match(action)
+        if restaurant_action:
+            kind, restaurant_id = restaurant_action.groups()
+            handler = {'book': self._book, 'menu': self._menu, 'directions': self._directions}[kind]
+            response = handler(restaurant_id)
+        elif more_action:
+            kind = 'more'
+            response = self._more_restaurants(state, int(more_action.group(1) or self.PAGE_SIZE))
+        elif action == 'booking':
+            kind = action
+            response = self._booking()
+        elif action in self.SEARCH_ACTIONS:
+            kind = 'search'
+            cuisine = state['cuisine'] if state is not None else None
+            response = self._search(cuisine if cuisine in self.CUISINE_ACTIONS else None)
+        elif action in self.CUISINE_ACTIONS:
+            kind = 'cuisine'
+            response = self._search(action)
+        elif action == 'help' and self.rule_handler is not None:
+            kind = action
+            response = self.rule_handler.process_message('help', [])
+        
+        if response is not None:
+            self._count(kind)
+        return response
+    
+    def _count(self, kind: str):
+        with self._lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+    
+    def stats(self) -> Dict:
+        """How many actions of each kind were answered without the AI"""
+        with self._lock:
+            return dict(self.counts)
+    
+    def _message(self, content, cards=None, quick_replies=None):
+        message = {
+            'id': str(uuid.uuid4()),
+            'type': 'bot',
+            'content': content,
+            'timestamp': datetime.now().isoformat(),
+            'message_type': 'card' if cards else 'text',
+            'quick_replies': quick_replies or [
+                {'text': 'Find restaurants', 'action': 'search'},
+                {'text': 'Book a table', 'action': 'booking'}
+            ]
+        }
+        if cards:
+            message['cards'] = cards
+        return message
+    
+    def _restaurant_quick_replies(self, restaurant_id):
+        return [
+            {'text': 'View Menu', 'action': f"menu_{restaurant_id}"},
+            {'text': 'Get Directions', 'action': f"directions_{restaurant_id}"},
+            {'text': 'See more restaurants', 'action': 'more_restaurants'}
+        ]
+    
+    def _book(self, restaurant_id):
+        """Show a restaurant's card with today's open times"""
+        card = self.restaurant_api.get_restaurant_card(restaurant_id)
+        if card is None:
+            return self._message("Sorry, I couldn't find that restaurant.")
+        
+        open_times = [slot['time'] for slot in card.get('availability', []) if slot.get('available')]
+        if open_times:
+            content = f"{card['name']} has tables at {', '.join(open_times[:4])} today. Which time and how many people?"
+        else:
+            content = f"{card['name']} is fully booked today. Want to see other restaurants?"
+        return self._message(content, cards=[card], quick_replies=self._restaurant_quick_replies(restaurant_id))
+    
+    def _menu(self, restaurant_id):
+        """List a restaurant's menu, popular dishes first in each category"""
+        menu = self.restaurant_api.get_restaurant_menu(restaurant_id)
+        if menu.get('type') == 'error':
+            return self._message("Sorry, I couldn't load that menu right now.")
+        
+        lines = [menu['content']]
+        for category, dishes in menu['categories'].items():
+            lines.append(f"\n{category.title()}")
+            for dish in sorted(dishes, key=lambda dish: not dish['popular']):
+                popular = ' ⭐' if dish['popular'] else ''
+                lines.append(f"• {dish['name']} - {dish['price']}{popular}")
+        if not menu['categories']:
+            lines.append("No dishes are listed yet.")
+        
+        return self._message('\n'.join(lines), quick_replies=[
+            {'text': 'Book Table', 'action': f"book_{restaurant_id}"},
+            {'text': 'Get Directions', 'action': f"directions_{restaurant_id}"},
+            {'text': 'See more restaurants', 'action': 'more_restaurants'}
+        ])
+    
+    def _directions(self, restaurant_id):
+        """Give a restaurant's address and phone number"""
+        details = self.restaurant_api.get_restaurant_details(restaurant_id)
+        if details.get('type') == 'error':
+            return self._message("Sorry, I couldn't find that restaurant.")
+        
+        restaurant = details['restaurant']
+        address = ', '.join(part for part in [
+            restaurant.get('address'),
+            restaurant.get('city'),
+            f"{restaurant.get('state', '')} {restaurant.get('postal_code', '')}".strip()
+        ] if part)
+        content = f"{restaurant['name']} is at {address}"
+        if restaurant.get('distance'):
+            content += f" ({restaurant['distance']} away)"
+        content += '.'
+        if restaurant.get('phone'):
+            content += f" Call them on {restaurant['phone']}."
+        
+        return self._message(content, quick_replies=[
+            {'text': 'Book Table', 'action': f"book_{restaurant_id}"},
+            {'text': 'View Menu', 'action': f"menu_{restaurant_id}"}
+        ])
+    
+    def _listing(self, cuisine=None):
+        restaurants = (
+            self.restaurant_api.get_restaurants_by_cuisine(cuisine) if cuisine
+            else self.restaurant_api.get_popular_restaurants()
+        )
+        return restaurants if isinstance(restaurants, list) else []
+    
+    def _booking(self):
+        """Restaurants taking table bookings"""
+        restaurants = self.restaurant_api.get_restaurants_for_booking()
+        cards = restaurants[:self.PAGE_SIZE] if isinstance(restaurants, list) else []
+        if not cards:
+            return self._message("Sorry, I couldn't find restaurants taking bookings right now.")
+        return self._message("Here are restaurants with tables available:", cards=cards, quick_replies=[
+            {'text': 'See more restaurants', 'action': 'more_restaurants'},
+            {'text': 'Different time', 'action': 'change_time'}
+        ])
+    
+    def _search(self, cuisine=None):
+        """First page of restaurants, of one cuisine or the most popular"""
+        restaurants = self._listing(cuisine)
+        if not restaurants:
+            return self._message("Sorry, I couldn't find restaurants for that right now.")
+        
+        content = f"Here are some {cuisine.title()} restaurants:" if cuisine else "Here are some popular restaurants:"
+        quick_replies = [{'text': 'Book a table', 'action': 'booking'}]
+        if len(restaurants) > self.PAGE_SIZE:
+            quick_replies.append({'text': 'See more restaurants', 'action': f"more_restaurants_{self.PAGE_SIZE}"})
+        return self._message(content, cards=restaurants[:self.PAGE_SIZE], quick_replies=quick_replies)
+    
+    def _more_restaurants(self, state, offset):
+        """The next page of the chat's restaurant listing"""
+        cuisine = state['cuisine'] if state is not None else None
+        restaurants = self._listing(cuisine if cuisine in self.CUISINE_ACTIONS else None)
+        cards = restaurants[offset:offset + self.PAGE_SIZE]
+        if not cards:
+            return self._message("That's all the restaurants I have for now. Try another cuisine?", quick_replies=[
+                {'text': name.title(), 'action': name} for name in ['italian', 'chinese', 'mexican', 'indian']
+            ])
+        
+        quick_replies = [{'text': 'Book a table', 'action': 'booking'}]
+        if len(restaurants) > offset + self.PAGE_SIZE:
+            quick_replies.append({'text': 'See more restaurants', 'action': f"more_restaurants_{offset + self.PAGE_SIZE}"})
+        return self._message("Here are a few more:", cards=cards, quick_replies=quick_replies)
\ No newline at end of file
@@ -1,17 +1,71 @@
+import asyncio
 import os
 import re
 import json
+import time
 import uuid
+import threading
+import contextvars
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
-from groq import Groq
+from .chat_handler import ChatHandler
 from .database_restaurant_api import DatabaseRestaurantAPI
+from .llm_client import create_llm_client
+from .llm_cache import create_llm_cache
+from .conversation_state import ConversationState
+from .message_matcher import match_message
+from .singleflight import SingleFlight
 
 class AIChatHandler:
-    """AI-powered chat handler using Groq API for restaurant assistant"""
+    """AI-powered chat handler using Groq API for restaurant assistant
+    
+    For restaurant queries the AI completion and the restaurant lookup run
+    concurrently under one per-turn deadline (``AI_TURN_DEADLINE`` seconds),
+    so a turn takes as long as the slower of the two rather than both.
+    
+    AI replies are cached by normalized message, intent and the slots known
+    from the conversation, so repeated questions skip the completion.
+    
+    Messages made only of known details ("Italian", "pizza in New York",
+    "book a table") never reach the AI: a fast path answers them from
+    templates, asking for the missing city or cuisine or showing cards.
+    """
+    
+    # Words a message may consist of to be answered by the fast path
+    FAST_PATH_WORDS = {
+        'new', 'york', 'ny', 'manhattan', 'brooklyn',
+        'italian', 'chinese', 'mexican', 'indian', 'japanese', 'american', 'pizza', 'pasta',
+        'book', 'table', 'reservation', 'reserve', 'delivery', 'order',
+        'a', 'an', 'the', 'in', 'at', 'for', 'some', 'me', 'i', 'want', 'need', 'please',
+        'find', 'show', 'get', 'near', 'around', 'restaurant', 'restaurants', 'food',
+        'place', 'places', 'spot', 'spots', 'options', 'cuisine'
+    }
+    
+    # Cuisines the restaurant catalog has, and the one to look dishes up under
+    CATALOG_CUISINES = ['italian', 'chinese', 'mexican', 'indian', 'japanese', 'american']
+    DISH_CUISINES = {'pizza': 'italian', 'pasta': 'italian', 'burger': 'american'}
+    LOCATION_NAMES = {'new_york': 'New York'}
     
     def __init__(self):
-        self.client = Groq(api_key=os.environ.get('GROQ_API_KEY'))
+        self.logger = logging.getLogger(__name__)
+        self.llm = create_llm_client()
         self.restaurant_api = DatabaseRestaurantAPI()
+        # Rule-based answers with real restaurant cards while the AI is unavailable
+        self.fallback_handler = ChatHandler(restaurant_api=self.restaurant_api)
+        self.response_cache = create_llm_cache()
+        # Identical turns arriving together (e.g. a popular quick reply) share one completion
+        self.inflight = SingleFlight()
+        self.route_counts = {'fast_path': 0, 'llm': 0, 'fallback': 0}
+        self._route_lock = threading.Lock()
+        # Timings of recent restaurant turns, for /api/metrics
+        self.turn_timings = deque(maxlen=500)
+        self.turn_deadline = float(os.environ.get('AI_TURN_DEADLINE', 10))
+        self.lookup_pool = ThreadPoolExecutor(
+            max_workers=int(os.environ.get('AI_LOOKUP_WORKERS', 8)),
+            thread_name_prefix='restaurant-lookup'
+        )
         self.system_prompt = """You are DineDesk, a smart restaurant assistant. Track conversation context and NEVER repeat questions.
 
 CRITICAL RULES:
@@ -43,131 +97,521 @@ User: "Ahmedabad" → "What cuisine?" (have location, need cuisine)
 User: "Italian" → "What city?" (have cuisine, need location)
 """
     
-    def process_message(self, message, chat_history):
-        """Process user message with AI and return appropriate response"""
+    def process_message(self, message, chat_history, state=None):
+        """Process user message with AI and return appropriate response
+        
+        ``state`` is the chat's ConversationState, already updated with this
+        message; without one it is rebuilt from ``chat_history``.
+        """
         try:
+            state = state or ConversationState.from_messages(chat_history)
+            
             # Analyze if this is a restaurant search/booking request
             intent = self._analyze_intent(message)
             
+            fast_response = self._get_fast_path_response(message, intent, state)
+            if fast_response is not None:
+                return fast_response
+            if self.llm.breaker.state == 'open':
+                return self._get_rule_based_response(message, chat_history)
+            self._count_route('llm')
+            
             if intent in ['booking', 'search', 'menu']:
-                return self._handle_restaurant_query(message, intent, chat_history)
+                return self._handle_restaurant_query(message, intent, chat_history, state)
             else:
-                return self._handle_general_query(message, chat_history)
-                
+                return self._handle_general_query(message, chat_history, state)
+        
         except Exception as e:
             print(f"Error in AI chat handler: {e}")
             return self._get_fallback_response()
     
     def _analyze_intent(self, message):
         """Analyze user intent from message"""
-        message_lower = message.lower()
+        intents = match_message(message)['intents']
         
-        booking_keywords = ['book', 'table', 'reservation', 'reserve', 'seat']
-        search_keywords = ['restaurant', 'find', 'search', 'near', 'cuisine']
-        menu_keywords = ['menu', 'food', 'dish', 'order', 'popular', 'recommend']
-        
-        if any(keyword in message_lower for keyword in booking_keywords):
+        if 'booking' in intents:
             return 'booking'
-        elif any(keyword in message_lower for keyword in search_keywords):
+        elif 'search' in intents:
             return 'search'
-        elif any(keyword in message_lower for keyword in menu_keywords):
+        elif 'menu' in intents:
             return 'menu'
         else:
             return 'general'
     
-    def _handle_restaurant_query(self, message, intent, chat_history):
-        """Handle restaurant-specific queries with AI and real data"""
+    def stream_message(self, message, chat_history, state=None):
+        """Process a message like process_message, yielding the reply as it is generated
+        
+        Yields ``('token', text)`` for each chunk of the AI reply and finally
+        ``('done', bot_response)`` with the complete message, cards included.
+        If the AI reply breaks off, the text already streamed is kept as the
+        reply; the rule-based reply is only used when nothing was streamed.
+        """
+        lookup = None
+        streamed = []
         try:
-            # Get recent conversation context
-            context = self._build_conversation_context(chat_history[-5:] if len(chat_history) > 5 else chat_history)
-            
-            # Create AI prompt for restaurant query
-            prompt = f"""User message: "{message}"
-Intent: {intent}
-Previous context: {context}
-
-Extract ALL details. Only ask for missing info. Never repeat questions. Check if location is valid."""
+            state = state or ConversationState.from_messages(chat_history)
+            intent = self._analyze_intent(message)
             
-            completion = self.client.chat.completions.create(
-                model="llama-3.1-8b-instant",
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.5,
-                max_completion_tokens=50,  # Much shorter for concise responses
-                top_p=0.9,
-                stream=False
-            )
+            fast_response = self._get_fast_path_response(message, intent, state)
+            if fast_response is not None:
+                yield 'token', fast_response['content']
+                yield 'done', fast_response
+                return
+            if self.llm.breaker.state == 'open':
+                fallback_response = self._get_rule_based_response(message, chat_history)
+                yield 'token', fallback_response['content']
+                yield 'done', fallback_response
+                return
+            self._count_route('llm')
             
-            ai_response = getattr(completion.choices[0].message, 'content', '') or "I'm here to help with your restaurant needs!"
-            ai_response = ai_response.strip()
+            started = time.perf_counter()
+            deadline = started + self.turn_deadline
             
-            # Get relevant restaurant data based on intent
-            restaurants = self._get_relevant_restaurants(message, intent)
+            if intent in ['booking', 'search', 'menu']:
+                # Look restaurants up while the reply streams
+                lookup = self._start_restaurant_lookup(message, intent, state)
+                prompt = self._build_restaurant_prompt(message, intent, chat_history, state)
+            else:
+                prompt = self._build_general_prompt(message, chat_history, state)
             
-            if restaurants is None:  # Invalid location detected
-                return {
-                    'id': str(uuid.uuid4()),
-                    'type': 'bot',
-                    'content': "Sorry, we don't serve that area. Try New York instead?",
-                    'timestamp': datetime.now().isoformat(),
-                    'message_type': 'text',
-                    'quick_replies': [
-                        {'text': 'New York restaurants', 'action': 'new_york'},
-                        {'text': 'Browse all', 'action': 'browse'}
-                    ]
-                }
-            elif restaurants:
-                return {
-                    'id': str(uuid.uuid4()),
-                    'type': 'bot',
-                    'content': ai_response,
-                    'timestamp': datetime.now().isoformat(),
-                    'message_type': 'card',
-                    'cards': restaurants[:3],  # Show top 3 restaurants
-                    'quick_replies': self._generate_quick_replies(intent)
-                }
+            cache_key = self._response_cache_key(message, intent, state)
+            ai_response = self.response_cache.get(cache_key)
+            if ai_response is not None:
+                streamed.append(ai_response)
+                yield 'token', ai_response
             else:
-                return {
-                    'id': str(uuid.uuid4()),
-                    'type': 'bot',
-                    'content': ai_response,
-                    'timestamp': datetime.now().isoformat(),
-                    'message_type': 'text',
-                    'quick_replies': self._generate_quick_replies('general')
-                }
+                for chunk in self._create_completion(prompt, stream=True, timeout=self._time_left(deadline)):
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if text:
+                        streamed.append(text)
+                        yield 'token', text
                 
+                ai_response = ''.join(streamed).strip()
+                if ai_response:
+                    self.response_cache.set(cache_key, ai_response)
+            llm_ms = self._elapsed_ms(started)
+            
+            ai_response = ai_response or "I'm here to help with your restaurant needs!"
+            
+            if lookup is not None:
+                restaurants, restaurants_ms = self._wait_for_restaurants(lookup, deadline)
+                response = self._build_restaurant_response(ai_response, intent, restaurants)
+                response['timings'] = self._log_timings(started, llm_ms, restaurants_ms)
+                yield 'done', response
+            else:
+                yield 'done', self._build_general_response(ai_response)
+        
         except Exception as e:
-            print(f"Error handling restaurant query: {e}")
+            print(f"Error streaming AI response: {e}")
+            partial = ''.join(streamed).strip()
+            if partial:
+                # The client already shows this text, an unrelated reply would replace it
+                yield 'done', self._build_general_response(partial)
+            else:
+                yield 'done', self._get_rule_based_response(message, chat_history)
+        
+        finally:
+            if lookup is not None:
+                lookup.cancel()
+    
+    async def aprocess_message(self, message, chat_history, state=None):
+        """Async version of process_message for the ASGI entry point
+        
+        The completion is awaited on the async Groq client; restaurant
+        lookups and the rule-based fallback, which may query Supabase, run on
+        threads so the event loop is never blocked.
+        """
+        try:
+            state = state or ConversationState.from_messages(chat_history)
+            intent = self._analyze_intent(message)
+            
+            fast_response = await asyncio.to_thread(self._get_fast_path_response, message, intent, state)
+            if fast_response is not None:
+                return fast_response
+            if self.llm.breaker.state == 'open':
+                return await asyncio.to_thread(self._get_rule_based_response, message, chat_history)
+            self._count_route('llm')
+            
+            started = time.perf_counter()
+            deadline = started + self.turn_deadline
+            lookup = None
+            
+            if intent in ['booking', 'search', 'menu']:
+                lookup = asyncio.wrap_future(self._start_restaurant_lookup(message, intent, state))
+                prompt = self._build_restaurant_prompt(message, intent, chat_history, state)
+            else:
+                prompt = self._build_general_prompt(message, chat_history, state)
+            
+            try:
+                cache_key = self._response_cache_key(message, intent, state)
+                ai_response = await self._aget_ai_response(prompt, cache_key, timeout=self._time_left(deadline))
+            except Exception as e:
+                print(f"AI completion failed, answering from rules: {e}")
+                if lookup is not None:
+                    lookup.cancel()
+                return await asyncio.to_thread(self._get_rule_based_response, message, chat_history)
+            llm_ms = self._elapsed_ms(started)
+            
+            if lookup is None:
+                return self._build_general_response(ai_response)
+            
+            restaurants, restaurants_ms = await self._await_restaurants(lookup, deadline)
+            response = self._build_restaurant_response(ai_response, intent, restaurants)
+            response['timings'] = self._log_timings(started, llm_ms, restaurants_ms)
+            return response
+        
+        except Exception as e:
+            print(f"Error in AI chat handler: {e}")
             return self._get_fallback_response()
     
-    def _handle_general_query(self, message, chat_history):
-        """Handle general queries with AI"""
+    async def astream_message(self, message, chat_history, state=None):
+        """Async version of stream_message for the ASGI entry point"""
+        lookup = None
+        streamed = []
         try:
-            # Build conversation context
-            context = self._build_conversation_context(chat_history[-5:] if len(chat_history) > 5 else chat_history)
+            state = state or ConversationState.from_messages(chat_history)
+            intent = self._analyze_intent(message)
+            
+            fast_response = await asyncio.to_thread(self._get_fast_path_response, message, intent, state)
+            if fast_response is None and self.llm.breaker.state == 'open':
+                fast_response = await asyncio.to_thread(self._get_rule_based_response, message, chat_history)
+            if fast_response is not None:
+                yield 'token', fast_response['content']
+                yield 'done', fast_response
+                return
+            self._count_route('llm')
+            
+            started = time.perf_counter()
+            deadline = started + self.turn_deadline
+            
+            if intent in ['booking', 'search', 'menu']:
+                lookup = asyncio.wrap_future(self._start_restaurant_lookup(message, intent, state))
+                prompt = self._build_restaurant_prompt(message, intent, chat_history, state)
+            else:
+                prompt = self._build_general_prompt(message, chat_history, state)
+            
+            cache_key = self._response_cache_key(message, intent, state)
+            ai_response = self.response_cache.get(cache_key)
+            if ai_response is not None:
+                streamed.append(ai_response)
+                yield 'token', ai_response
+            else:
+                stream = await self._acreate_completion(prompt, stream=True, timeout=self._time_left(deadline))
+                async for chunk in stream:
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if text:
+                        streamed.append(text)
+                        yield 'token', text
+                
+                ai_response = ''.join(streamed).strip()
+                if ai_response:
+                    self.response_cache.set(cache_key, ai_response)
+            llm_ms = self._elapsed_ms(started)
             
-            prompt = f"""User message: "{message}"
+            ai_response = ai_response or "I'm here to help with your restaurant needs!"
+            
+            if lookup is not None:
+                restaurants, restaurants_ms = await self._await_restaurants(lookup, deadline)
+                response = self._build_restaurant_response(ai_response, intent, restaurants)
+                response['timings'] = self._log_timings(started, llm_ms, restaurants_ms)
+                yield 'done', response
+            else:
+                yield 'done', self._build_general_response(ai_response)
+        
+        except Exception as e:
+            print(f"Error streaming AI response: {e}")
+            partial = ''.join(streamed).strip()
+            if partial:
+                yield 'done', self._build_general_response(partial)
+            else:
+                yield 'done', await asyncio.to_thread(self._get_rule_based_response, message, chat_history)
+        
+        finally:
+            if lookup is not None:
+                lookup.cancel()
+    
+    def _get_fast_path_response(self, message, intent, state):
+        """Answer a message from templates when it only carries known details, None to ask the AI"""
+        if self._is_invalid_location(message):
+            self._count_route('fast_path')
+            return self._get_invalid_location_response()
+        
+        words = re.findall(r"[a-z']+", message.lower())
+        if not words or any(word not in self.FAST_PATH_WORDS for word in words):
+            return None  # Open-ended input, leave it to the AI
+        
+        # Filler alone ("me please") carries no detail to answer from
+        matched = match_message(message)
+        if all(matched[slot] is None for slot in ('location', 'cuisine', 'service_type')):
+            return None
+        
+        location = state['location']
+        cuisine = self.DISH_CUISINES.get(state['cuisine'], state['cuisine'])
+        if location == 'invalid' or (cuisine is not None and cuisine not in self.CATALOG_CUISINES):
+            return None
+        
+        self._count_route('fast_path')
+        cuisine_name = cuisine.capitalize() if cuisine else None
+        
+        if location is None:
+            content = f"{cuisine_name}, great choice! Which city?" if cuisine else "Sure! Which city are you looking in?"
+            return self._build_general_response(content, quick_replies=[
+                {'text': 'New York', 'action': 'new_york'},
+                {'text': 'Manhattan', 'action': 'manhattan'},
+                {'text': 'Brooklyn', 'action': 'brooklyn'}
+            ])
+        
+        if cuisine is None:
+            return self._build_general_response("What cuisine are you in the mood for?", quick_replies=[
+                {'text': name, 'action': name.lower()}
+                for name in ['Italian', 'Chinese', 'Mexican', 'Japanese', 'Indian']
+            ])
+        
+        restaurant_intent = intent if intent in ['booking', 'search', 'menu'] else 'search'
+        restaurants = self._get_relevant_restaurants(cuisine, restaurant_intent)
+        if not isinstance(restaurants, list):
+            restaurants = []
+        
+        location_name = self.LOCATION_NAMES.get(location, location.replace('_', ' ').title())
+        if restaurant_intent == 'booking' or state['service_type'] == 'reservation':
+            content = f"Here are {cuisine_name} places in {location_name} with tables open:"
+        else:
+            content = f"Here are some {cuisine_name} spots in {location_name}:"
+        return self._build_restaurant_response(content, restaurant_intent, restaurants)
+    
+    def _count_route(self, route):
+        with self._route_lock:
+            self.route_counts[route] += 1
+    
+    def route_stats(self):
+        """How many messages the fast path answered versus the AI, and how many the rule-based fallback answered"""
+        with self._route_lock:
+            # Fallbacks after a failed AI call are already counted as llm
+            total = self.route_counts['fast_path'] + self.route_counts['llm']
+            return dict(
+                self.route_counts,
+                fast_path_share=round(self.route_counts['fast_path'] / total, 3) if total else 0.0
+            )
+    
+    def _create_completion(self, prompt, stream=False, timeout=None):
+        """Ask the model for a short reply to a prompt, within ``timeout`` seconds including retries"""
+        return self.llm.create(
+            deadline=time.monotonic() + timeout if timeout is not None else None,
+            **self._completion_params(prompt, stream)
+        )
+    
+    async def _acreate_completion(self, prompt, stream=False, timeout=None):
+        """Async version of _create_completion"""
+        return await self.llm.acreate(
+            deadline=time.monotonic() + timeout if timeout is not None else None,
+            **self._completion_params(prompt, stream)
+        )
+    
+    def _completion_params(self, prompt, stream):
+        return dict(
+            model="llama-3.1-8b-instant",
+            messages=[
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.5,
+            max_completion_tokens=50,  # Much shorter for concise responses
+            top_p=0.9,
+            stream=stream
+        )
+    
+    def _response_cache_key(self, message, intent, state):
+        """Cache key for the AI reply to a message given the conversation so far"""
+        return self.response_cache.make_key(message, intent, state.slots)
+    
+    def _get_ai_response(self, prompt, cache_key, timeout=None):
+        """Get the AI reply to a prompt, from the response cache if it was answered before
+        
+        Concurrent calls with the same cache key wait for the first one's
+        completion instead of sending their own.
+        """
+        ai_response = self.response_cache.get(cache_key)
+        if ai_response is not None:
+            return ai_response
+        
+        def complete():
+            completion = self._create_completion(prompt, timeout=timeout)
+            ai_response = (getattr(completion.choices[0].message, 'content', '') or '').strip()
+            if ai_response:
+                self.response_cache.set(cache_key, ai_response)
+            return ai_response
+        
+        ai_response = self.inflight.do(cache_key, complete, timeout=timeout)
+        return ai_response or "I'm here to help with your restaurant needs!"
+    
+    async def _aget_ai_response(self, prompt, cache_key, timeout=None):
+        """Async version of _get_ai_response"""
+        ai_response = self.response_cache.get(cache_key)
+        if ai_response is not None:
+            return ai_response
+        
+        async def complete():
+            completion = await self._acreate_completion(prompt, timeout=timeout)
+            ai_response = (getattr(completion.choices[0].message, 'content', '') or '').strip()
+            if ai_response:
+                self.response_cache.set(cache_key, ai_response)
+            return ai_response
+        
+        ai_response = await self.inflight.ado(cache_key, complete, timeout=timeout)
+        return ai_response or "I'm here to help with your restaurant needs!"
+    
+    def _time_left(self, deadline):
+        """Seconds left before a turn's deadline, never less than a moment"""
+        return max(deadline - time.perf_counter(), 0.1)
+    
+    def _elapsed_ms(self, started):
+        return round((time.perf_counter() - started) * 1000, 1)
+    
+    def _start_restaurant_lookup(self, message, intent, state=None):
+        """Start the restaurant lookup on the worker pool, returns a future of (restaurants, elapsed ms)"""
+        # Run in a copy of this context so per-turn query counting still applies
+        context = contextvars.copy_context()
+        
+        def lookup():
+            started = time.perf_counter()
+            restaurants = context.run(self._get_relevant_restaurants, message, intent, state)
+            return restaurants, self._elapsed_ms(started)
+        
+        return self.lookup_pool.submit(lookup)
+    
+    def _wait_for_restaurants(self, lookup, deadline):
+        """Wait for a restaurant lookup until the deadline, returns (restaurants, elapsed ms)"""
+        try:
+            restaurants, elapsed_ms = lookup.result(timeout=max(deadline - time.perf_counter(), 0))
+        except FutureTimeoutError:
+            print("Restaurant lookup missed the turn deadline, answering without cards")
+            return [], None
+        except Exception as e:
+            print(f"Error looking up restaurants: {e}")
+            return [], None
+        
+        # The API reports failures as an error dict instead of a card list
+        return (restaurants if isinstance(restaurants, list) else []), elapsed_ms
+    
+    async def _await_restaurants(self, lookup, deadline):
+        """Async version of _wait_for_restaurants"""
+        try:
+            restaurants, elapsed_ms = await asyncio.wait_for(lookup, max(deadline - time.perf_counter(), 0))
+        except asyncio.TimeoutError:
+            print("Restaurant lookup missed the turn deadline, answering without cards")
+            return [], None
+        except Exception as e:
+            print(f"Error looking up restaurants: {e}")
+            return [], None
+        
+        return (restaurants if isinstance(restaurants, list) else []), elapsed_ms
+    
+    def _log_timings(self, started, llm_ms, restaurants_ms):
+        """Record how long each branch of a restaurant turn took"""
+        timings = {
+            'llm_ms': llm_ms,
+            'restaurants_ms': restaurants_ms,
+            'total_ms': self._elapsed_ms(started)
+        }
+        self.logger.debug(f"Restaurant turn timings: {timings}")
+        with self._route_lock:
+            self.turn_timings.append(timings)
+        return timings
+    
+    def timing_stats(self):
+        """p50/p95 of each branch of recent restaurant turns, in milliseconds"""
+        with self._route_lock:
+            timings = list(self.turn_timings)
+        
+        stats = {'turns': len(timings)}
+        for field in ('llm_ms', 'restaurants_ms', 'total_ms'):
+            values = sorted(t[field] for t in timings if t[field] is not None)
+            stats[field] = {
+                'p50': values[len(values) // 2] if values else None,
+                'p95': values[min(int(len(values) * 0.95), len(values) - 1)] if values else None
+            }
+        return stats
+    
+    def _build_restaurant_prompt(self, message, intent, chat_history, state):
+        """Build the AI prompt for a restaurant query"""
+        # Get recent conversation context
+        context = self._build_conversation_context(chat_history[-5:], state)
+        
+        return f"""User message: "{message}"
+Intent: {intent}
+Previous context: {context}
+
+Extract ALL details. Only ask for missing info. Never repeat questions. Check if location is valid."""
+    
+    def _build_general_prompt(self, message, chat_history, state):
+        """Build the AI prompt for a general query"""
+        # Build conversation context
+        context = self._build_conversation_context(chat_history[-5:], state)
+        
+        return f"""User message: "{message}"
 Previous context: {context}
 
 Extract ALL details. Only ask for missing info. Never repeat questions. Under 15 words."""
+    
+    def _handle_restaurant_query(self, message, intent, chat_history, state):
+        """Handle restaurant-specific queries with AI and real data"""
+        try:
+            if self._is_invalid_location(message):
+                return self._get_invalid_location_response()
             
-            completion = self.client.chat.completions.create(
-                model="llama-3.1-8b-instant",
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.5,
-                max_completion_tokens=50,
-                top_p=0.9,
-                stream=False
-            )
+            started = time.perf_counter()
+            deadline = started + self.turn_deadline
             
-            ai_response = getattr(completion.choices[0].message, 'content', '') or "I'm here to help with your restaurant needs!"
-            ai_response = ai_response.strip()
+            # Get relevant restaurant data based on intent, while the AI replies
+            lookup = self._start_restaurant_lookup(message, intent, state)
             
+            # Create AI prompt for restaurant query
+            prompt = self._build_restaurant_prompt(message, intent, chat_history, state)
+            try:
+                cache_key = self._response_cache_key(message, intent, state)
+                ai_response = self._get_ai_response(prompt, cache_key, timeout=self._time_left(deadline))
+            except Exception as e:
+                print(f"AI completion failed, answering from rules: {e}")
+                lookup.cancel()
+                return self._get_rule_based_response(message, chat_history)
+            llm_ms = self._elapsed_ms(started)
+            
+            restaurants, restaurants_ms = self._wait_for_restaurants(lookup, deadline)
+            response = self._build_restaurant_response(ai_response, intent, restaurants)
+            response['timings'] = self._log_timings(started, llm_ms, restaurants_ms)
+            return response
+        
+        except Exception as e:
+            print(f"Error handling restaurant query: {e}")
+            return self._get_fallback_response()
+    
+    def _get_invalid_location_response(self):
+        """Response for a location we have no restaurants in"""
+        return {
+            'id': str(uuid.uuid4()),
+            'type': 'bot',
+            'content': "Sorry, we don't serve that area. Try New York instead?",
+            'timestamp': datetime.now().isoformat(),
+            'message_type': 'text',
+            'quick_replies': [
+                {'text': 'New York restaurants', 'action': 'new_york'},
+                {'text': 'Browse all', 'action': 'browse'}
+            ]
+        }
+    
+    def _build_restaurant_response(self, ai_response, intent, restaurants):
+        """Build the bot message for a restaurant query, with cards when restaurants were found"""
+        if restaurants:
+            return {
+                'id': str(uuid.uuid4()),
+                'type': 'bot',
+                'content': ai_response,
+                'timestamp': datetime.now().isoformat(),
+                'message_type': 'card',
+                'cards': restaurants[:3],  # Show top 3 restaurants
+                'quick_replies': self._generate_quick_replies(intent)
+            }
+        else:
             return {
                 'id': str(uuid.uuid4()),
                 'type': 'bot',
@@ -176,45 +620,37 @@ Extract ALL details. Only ask for missing info. Never repeat questions. Under 15
                 'message_type': 'text',
                 'quick_replies': self._generate_quick_replies('general')
             }
+    
+    def _handle_general_query(self, message, chat_history, state):
+        """Handle general queries with AI"""
+        try:
+            deadline = time.perf_counter() + self.turn_deadline
+            prompt = self._build_general_prompt(message, chat_history, state)
+            cache_key = self._response_cache_key(message, 'general', state)
+            ai_response = self._get_ai_response(prompt, cache_key, timeout=self._time_left(deadline))
             
+            return self._build_general_response(ai_response)
+        
         except Exception as e:
             print(f"Error handling general query: {e}")
-            return self._get_fallback_response()
+            return self._get_rule_based_response(message, chat_history)
     
-    def _build_conversation_context(self, recent_messages):
-        """Build conversation context and extract collected information"""
-        context_parts = []
-        collected_info = {
-            'location': None,
-            'cuisine': None,
-            'service_type': None,
-            'time': None,
-            'party_size': None
+    def _build_general_response(self, ai_response, quick_replies=None):
+        """Build the bot message for a general query"""
+        return {
+            'id': str(uuid.uuid4()),
+            'type': 'bot',
+            'content': ai_response,
+            'timestamp': datetime.now().isoformat(),
+            'message_type': 'text',
+            'quick_replies': quick_replies or self._generate_quick_replies('general')
         }
+    
+    def _build_conversation_context(self, recent_messages, state):
+        """Build conversation context from the last messages and the collected slots"""
+        context_parts = []
         
-        # Extract information from conversation history
         for msg in recent_messages:
-            content = msg['content'].lower()
-            
-            # Location detection
-            if any(loc in content for loc in ['new york', 'ny', 'manhattan', 'brooklyn']):
-                collected_info['location'] = 'new_york'
-            elif any(loc in content for loc in ['ahmedabad', 'mumbai', 'delhi', 'bangalore']):
-                collected_info['location'] = 'invalid'
-            
-            # Cuisine detection
-            cuisines = ['italian', 'chinese', 'mexican', 'indian', 'japanese', 'american', 'pizza', 'pasta']
-            for cuisine in cuisines:
-                if cuisine in content:
-                    collected_info['cuisine'] = cuisine
-                    break
-            
-            # Service type detection
-            if any(word in content for word in ['delivery', 'order']):
-                collected_info['service_type'] = 'delivery'
-            elif any(word in content for word in ['reservation', 'book', 'table']):
-                collected_info['service_type'] = 'reservation'
-            
             if msg['type'] == 'user':
                 context_parts.append(f"User: {msg['content']}")
             elif msg['type'] == 'bot':
@@ -223,27 +659,22 @@ Extract ALL details. Only ask for missing info. Never repeat questions. Under 15
         context_str = " | ".join(context_parts[-2:])  # Last 2 exchanges
         
         # Add collected info summary
-        info_summary = f"Known: location={collected_info['location']}, cuisine={collected_info['cuisine']}, service={collected_info['service_type']}"
+        info_summary = f"Known: location={state['location']}, cuisine={state['cuisine']}, service={state['service_type']}"
         
         return f"{context_str} | {info_summary}"
     
-    def _get_relevant_restaurants(self, message, intent):
-        """Get relevant restaurant data based on message and intent"""
-        message_lower = message.lower()
+    def _get_relevant_restaurants(self, message, intent, state=None):
+        """Get relevant restaurant data based on message and intent, falling back to the chat's cuisine"""
+        matched = match_message(message)
         
-        # Check for invalid locations (not in our database)
-        invalid_locations = ['ahmedabad', 'mumbai', 'delhi', 'bangalore', 'chennai', 'kolkata', 'hyderabad', 'pune', 'india']
-        for invalid_loc in invalid_locations:
-            if invalid_loc in message_lower:
-                return None  # Signal invalid location
+        # Check for invalid locations (not in our database); a served one wins
+        if matched['location'] == 'invalid':
+            return None  # Signal invalid location
         
-        # Extract cuisine type if mentioned
-        cuisines = ['italian', 'chinese', 'mexican', 'indian', 'japanese', 'american']
-        found_cuisine = None
-        for cuisine in cuisines:
-            if cuisine in message_lower:
-                found_cuisine = cuisine
-                break
+        # Extract cuisine type if mentioned and the catalog has it, dishes under their cuisine
+        cuisine = matched['cuisine'] or (state['cuisine'] if state is not None else None)
+        cuisine = self.DISH_CUISINES.get(cuisine, cuisine)
+        found_cuisine = cuisine if cuisine in self.CATALOG_CUISINES else None
         
         if intent == 'booking':
             return self.restaurant_api.get_restaurants_for_booking()
@@ -252,6 +683,10 @@ Extract ALL details. Only ask for missing info. Never repeat questions. Under 15
         else:
             return self.restaurant_api.get_popular_restaurants()
     
+    def _is_invalid_location(self, message):
+        """Check whether a message names only locations we have no restaurants in"""
+        return match_message(message)['location'] == 'invalid'
+    
     def _generate_quick_replies(self, intent):
         """Generate contextual quick reply options"""
         if intent == 'booking':
@@ -280,6 +715,15 @@ Extract ALL details. Only ask for missing info. Never repeat questions. Under 15
                 {'text': 'Get help', 'action': 'help'}
             ]
     
+    def _get_rule_based_response(self, message, chat_history):
+        """Answer with the rule-based handler while the AI provider is failing"""
+        self._count_route('fallback')
+        try:
+            return self.fallback_handler.process_message(message, chat_history)
+        except Exception as e:
+            print(f"Error in rule-based fallback: {e}")
+            return self._get_fallback_response()
+    
     def _get_fallback_response(self):
         """Fallback response when AI is unavailable"""
         return {
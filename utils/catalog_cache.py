@@ -0,0 +1,216 @@
+import json
+import os
+import threading
+import time
+import logging
+from typing import Any, Callable, Dict, Hashable, Optional
+from .file_locks import file_lock, atomic_write_json
+from .lru_cache import LRUCache
+from .singleflight import SingleFlight
+
+# Generation counter of a full invalidation in the shared generations file
+ALL_KINDS = '*'
+
+class CatalogCache:
+    """Cache for restaurant catalog queries with stale-while-revalidate refresh
+    
+    Keys are tuples whose first element names what they hold (e.g.
+    ``('restaurants', 'cuisine', 'italian')``), so everything of one kind can
+    be invalidated at once. An entry younger than its ``ttl`` is served as is;
+    an older one is still served for up to ``stale_ttl`` more seconds while a
+    background thread reloads it, so callers never wait on a refresh. Entries
+    past both are dropped and the next caller loads them inline; concurrent
+    misses on one key share a single load.
+    
+    With ``shared_path`` set, invalidations are also counted per kind in that
+    JSON file, so every worker process on the host drops the same entries:
+    each process checks the file's signature at most every
+    ``check_interval`` seconds and invalidates the kinds whose counter moved.
+    """
+    
+    def __init__(self, max_size: int = 256, ttl: float = 300, stale_ttl: float = 600,
+                 shared_path: Optional[str] = None, check_interval: float = 1.0):
+        self.logger = logging.getLogger(__name__)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.shared_path = shared_path
+        self.check_interval = check_interval
+        self._shared_generations = None
+        self._shared_signature = None
+        self._shared_checked_at = 0.0
+        self._entries = LRUCache(max_size=max_size, ttl=ttl + stale_ttl)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._flight = SingleFlight()
+        # Bumped on invalidation so loads started before it are not stored
+        self._generation = 0
+        self.fresh_hits = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.shared_invalidations = 0
+    
+    def _shared_file_signature(self):
+        try:
+            stat = os.stat(self.shared_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    
+    def _read_shared(self) -> Dict[str, int]:
+        try:
+            with open(self.shared_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (json.JSONDecodeError, IOError) as e:
+            self.logger.error(f"Error reading {self.shared_path}: {e}")
+            return {}
+    
+    def _check_shared(self):
+        """Apply invalidations other workers recorded in the shared file since the last check"""
+        now = time.monotonic()
+        if self.shared_path is None or now - self._shared_checked_at < self.check_interval:
+            return
+        self._shared_checked_at = now
+        
+        signature = self._shared_file_signature()
+        if signature == self._shared_signature and self._shared_generations is not None:
+            return
+        
+        generations = self._read_shared()
+        previous = self._shared_generations
+        self._shared_generations = generations
+        self._shared_signature = signature
+        if previous is None:
+            return
+        
+        if generations.get(ALL_KINDS, 0) != previous.get(ALL_KINDS, 0):
+            changed = [None]
+        else:
+            changed = [kind for kind, count in generations.items() if previous.get(kind, 0) != count]
+        for kind in changed:
+            self._invalidate_local(kind)
+            with self._lock:
+                self.shared_invalidations += 1
+    
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """Get a cached value, loading it with ``loader`` on a miss
+        
+        Errors raised by ``loader`` propagate and nothing is cached.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        self._check_shared()
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, loaded_at, entry_ttl = entry
+            if time.monotonic() - loaded_at < entry_ttl:
+                with self._lock:
+                    self.fresh_hits += 1
+                return value
+            
+            with self._lock:
+                self.stale_hits += 1
+            self._refresh_in_background(key, loader, ttl)
+            return value
+        
+        generation = self._generation
+        
+        def load():
+            value = loader()
+            self.set(key, value, ttl, generation)
+            return value
+        
+        return self._flight.do(key, load)
+    
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, generation: Optional[int] = None):
+        """Store a freshly loaded value, unless the cache was invalidated since ``generation``"""
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries.set(key, (value, time.monotonic(), ttl), ttl=ttl + self.stale_ttl)
+    
+    def _refresh_in_background(self, key: Hashable, loader: Callable[[], Any], ttl: float):
+        """Reload a stale entry on a background thread, at most one refresh per key at a time"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            generation = self._generation
+        
+        def refresh():
+            try:
+                self.set(key, loader(), ttl, generation)
+                with self._lock:
+                    self.refreshes += 1
+            except Exception as e:
+                # Keep serving the stale value until it expires for good
+                with self._lock:
+                    self.refresh_errors += 1
+                self.logger.warning(f"Catalog cache refresh failed for {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+        
+        threading.Thread(target=refresh, daemon=True).start()
+    
+    def invalidate(self, kind: Optional[str] = None) -> int:
+        """Drop every entry of one kind (e.g. ``'availability'``), or everything, returns how many were dropped
+        
+        The invalidation is recorded in the shared file, if there is one, for
+        the other workers to pick up.
+        """
+        if self.shared_path is not None:
+            try:
+                if os.path.dirname(self.shared_path):
+                    os.makedirs(os.path.dirname(self.shared_path), exist_ok=True)
+                with file_lock(self.shared_path + '.lock'):
+                    generations = self._read_shared()
+                    counter = kind or ALL_KINDS
+                    generations[counter] = generations.get(counter, 0) + 1
+                    atomic_write_json(self.shared_path, generations)
+                    # Our own entries are dropped below, no need to do it again on the next check
+                    self._shared_generations = generations
+                    self._shared_signature = self._shared_file_signature()
+            except IOError as e:
+                self.logger.error(f"Error recording catalog invalidation in {self.shared_path}: {e}")
+        return self._invalidate_local(kind)
+    
+    def _invalidate_local(self, kind: Optional[str] = None) -> int:
+        with self._lock:
+            self._generation += 1
+            if kind is None:
+                count = len(self._entries)
+                self._entries.clear()
+                return count
+            
+            keys = [key for key, _ in self._entries.items() if isinstance(key, tuple) and key and key[0] == kind]
+            for key in keys:
+                self._entries.pop(key)
+            return len(keys)
+    
+    def stats(self) -> Dict:
+        """Cache size and hit/stale/miss counters"""
+        stats = self._entries.stats()
+        with self._lock:
+            stats.update({
+                'fresh_hits': self.fresh_hits,
+                'stale_hits': self.stale_hits,
+                'refreshes': self.refreshes,
+                'refresh_errors': self.refresh_errors,
+                'shared_invalidations': self.shared_invalidations,
+                'collapsed_loads': self._flight.collapsed
+            })
+        return stats
+
+# Shared by every DatabaseRestaurantAPI instance in the process
+catalog_cache = CatalogCache(
+    max_size=int(os.environ.get('CATALOG_CACHE_SIZE', 256)),
+    ttl=float(os.environ.get('CATALOG_CACHE_TTL', 300)),
+    stale_ttl=float(os.environ.get('CATALOG_CACHE_STALE_TTL', 600)),
+    shared_path=os.environ.get('CATALOG_GENERATIONS_FILE', os.path.join('chat_history', 'catalog_generations.json')) or None
+)
+
+# Availability changes with every booking, so it is kept fresh for less long
+AVAILABILITY_TTL = float(os.environ.get('CATALOG_AVAILABILITY_TTL', 60))
\ No newline at end of file
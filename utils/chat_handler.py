@@ -3,68 +3,59 @@ import random
 from datetime import datetime, timedelta
 import uuid
 from .restaurant_api import RestaurantAPI
+from .message_matcher import match_message
 
 class ChatHandler:
-    """Handles chat message processing and response generation"""
+    """Handles chat message processing and response generation
     
-    def __init__(self):
-        self.restaurant_api = RestaurantAPI()
-        self.context_keywords = {
-            'booking': ['book', 'table', 'reservation', 'reserve', 'seat'],
-            'menu': ['menu', 'food', 'dish', 'eat', 'order', 'popular', 'recommend'],
-            'location': ['near', 'nearby', 'location', 'address', 'where'],
-            'cuisine': ['italian', 'chinese', 'mexican', 'indian', 'american', 'japanese', 'thai', 'pizza', 'burger'],
-            'time': ['tonight', 'today', 'tomorrow', 'lunch', 'dinner', 'breakfast'],
-            'party_size': ['people', 'person', 'party', 'group']
-        }
+    Uses the sample RestaurantAPI unless given another restaurant API (the
+    AI handler passes its DatabaseRestaurantAPI when falling back to this).
+    """
+    
+    def __init__(self, restaurant_api=None):
+        self.restaurant_api = restaurant_api or RestaurantAPI()
     
     def process_message(self, message, chat_history):
         """Process user message and return appropriate bot response"""
-        message_lower = message.lower()
+        # Match intents and details in one pass
+        matched = match_message(message)
         
         # Extract context from message
-        context = self._extract_context(message_lower)
+        context = self._extract_context(matched)
         
         # Determine intent
-        if self._has_keywords(message_lower, self.context_keywords['booking']):
+        if 'booking' in matched['intents']:
             return self._handle_booking_request(message, context)
-        elif self._has_keywords(message_lower, self.context_keywords['menu']):
+        elif 'menu' in matched['intents']:
             return self._handle_menu_request(message, context)
-        elif any(cuisine in message_lower for cuisine in self.context_keywords['cuisine']):
+        elif matched['cuisine']:
             return self._handle_cuisine_search(message, context)
-        elif 'help' in message_lower or 'what can you do' in message_lower:
+        elif 'help' in matched['intents']:
             return self._handle_help_request()
         else:
             return self._handle_general_query(message)
     
-    def _extract_context(self, message):
-        """Extract relevant context from message"""
+    def _extract_context(self, matched):
+        """Extract relevant context from a matched message"""
         context = {}
         
         # Extract party size
-        party_match = re.search(r'(\d+)\s*(people|person)', message)
-        if party_match:
-            context['party_size'] = int(party_match.group(1))
+        if matched['party_size']:
+            context['party_size'] = matched['party_size']
         
         # Extract time references
-        if 'tonight' in message:
-            context['time'] = 'tonight'
-        elif 'today' in message:
-            context['time'] = 'today'
-        elif 'tomorrow' in message:
-            context['time'] = 'tomorrow'
+        if matched['time'] in ['tonight', 'today', 'tomorrow']:
+            context['time'] = matched['time']
         
         # Extract cuisine preferences
-        for cuisine in self.context_keywords['cuisine']:
-            if cuisine in message:
-                context['cuisine'] = cuisine
-                break
+        if matched['cuisine']:
+            context['cuisine'] = matched['cuisine']
         
         return context
     
-    def _has_keywords(self, message, keywords):
-        """Check if message contains any of the given keywords"""
-        return any(keyword in message for keyword in keywords)
+    def _cards(self, restaurants, limit):
+        """First restaurant cards of a lookup; the database API returns an error dict on failure"""
+        return restaurants[:limit] if isinstance(restaurants, list) else []
     
     def _handle_booking_request(self, message, context):
         """Handle table booking requests"""
@@ -83,7 +74,7 @@ class ChatHandler:
             'content': response_text,
             'timestamp': datetime.now().isoformat(),
             'message_type': 'card',
-            'cards': restaurants[:3],  # Show top 3 restaurants
+            'cards': self._cards(restaurants, 3),  # Show top 3 restaurants
             'quick_replies': [
                 {'text': 'Book a table', 'action': 'booking'},
                 {'text': 'See more restaurants', 'action': 'more_restaurants'},
@@ -108,7 +99,7 @@ class ChatHandler:
             'content': response_text,
             'timestamp': datetime.now().isoformat(),
             'message_type': 'card',
-            'cards': restaurants[:3],
+            'cards': self._cards(restaurants, 3),
             'quick_replies': [
                 {'text': 'View full menu', 'action': 'full_menu'},
                 {'text': 'Order now', 'action': 'order'},
@@ -129,7 +120,7 @@ class ChatHandler:
             'content': response_text,
             'timestamp': datetime.now().isoformat(),
             'message_type': 'card',
-            'cards': restaurants[:4],
+            'cards': self._cards(restaurants, 4),
             'quick_replies': [
                 {'text': 'Book a table', 'action': 'booking'},
                 {'text': 'Order delivery', 'action': 'delivery'},
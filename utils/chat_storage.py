@@ -1,13 +1,23 @@
 import uuid
 import logging
 from datetime import datetime
+from postgrest.exceptions import APIError
 from config_supabase import supabase
+from .simple_chat_storage import format_relative_time
 
 class ChatStorage:
-    """Handle chat session and message storage in Supabase"""
+    """Handle chat session and message storage in Supabase
+    
+    Same interface as SimpleChatStorage and SQLiteChatStorage, selected
+    with ``CHAT_STORAGE_BACKEND=supabase``.
+    """
     
     def __init__(self):
         self.logger = logging.getLogger(__name__)
+        # Cleared if the database lacks the save_chat_message function (migration 0002)
+        self.use_save_rpc = True
+        # Cleared if it lacks save_chat_messages (migration 0003); the two are checked separately
+        self.use_batch_rpc = True
     
     def create_chat_session(self, user_email, title=None):
         """Create a new chat session for user"""
@@ -17,6 +27,7 @@ class ChatStorage:
             
             chat_data = {
                 'id': chat_id,
+                'session_id': chat_id,
                 'user_email': user_email,
                 'session_title': session_title,
                 'started_at': datetime.now().isoformat(),
@@ -34,12 +45,15 @@ class ChatStorage:
             else:
                 self.logger.error(f"Failed to create chat session: {result}")
                 return None
-                
+        
         except Exception as e:
             self.logger.error(f"Error creating chat session: {e}")
             return None
     
-    def save_message(self, chat_session_id, message_type, content, message_data=None):
+    def flush(self, user_email=None):
+        """Writes go straight to Supabase, nothing to flush"""
+    
+    def save_message(self, chat_session_id, user_email, message_type, content, message_data=None):
         """Save a message to the chat session"""
         try:
             message_id = str(uuid.uuid4())
@@ -53,27 +67,74 @@ class ChatStorage:
                 'timestamp': datetime.now().isoformat()
             }
             
-            # Save message
-            result = supabase.table('chat_messages').insert(message).execute()
+            if self.use_save_rpc:
+                try:
+                    # Insert the message and bump the session's count and last activity in one transaction
+                    result = supabase.rpc('save_chat_message', {
+                        f"p_{field}": value for field, value in message.items()
+                    }).execute()
+                except APIError as e:
+                    if e.code != 'PGRST202':
+                        raise
+                    self.logger.warning("save_chat_message function not found, run migrations/0002_save_chat_message.sql")
+                    self.use_save_rpc = False
+            
+            if not self.use_save_rpc:
+                result = supabase.table('chat_messages').insert(message).execute()
+                if result.data:
+                    # Update session message count and last activity
+                    self.update_session_activity(chat_session_id)
             
             if result.data:
-                # Update session message count and last activity
-                self.update_session_activity(chat_session_id)
                 return message_id
             else:
                 self.logger.error(f"Failed to save message: {result}")
                 return None
-                
+        
         except Exception as e:
             self.logger.error(f"Error saving message: {e}")
             return None
     
+    def save_messages(self, messages):
+        """Save a batch of queued messages in one call, returns how many were new
+        
+        save_chat_messages (migration 0003) inserts them in one statement,
+        skipping ids already stored and sessions that are gone, and bumps
+        each session's counter. Errors are raised for the caller to retry.
+        """
+        rows = [
+            {field: message.get(field) for field in ('id', 'chat_session_id', 'message_type', 'content', 'message_data', 'timestamp')}
+            for message in messages
+        ]
+        
+        if self.use_batch_rpc:
+            try:
+                return supabase.rpc('save_chat_messages', {'p_messages': rows}).execute().data or 0
+            except APIError as e:
+                if e.code != 'PGRST202':
+                    raise
+                self.logger.warning("save_chat_messages function not found, run migrations/0003_save_chat_messages.sql")
+                self.use_batch_rpc = False
+        
+        # Without the function: drop messages of deleted sessions (they would fail the
+        # foreign key on every retry), one multi-row insert, then one counter update per session
+        session_ids = list(dict.fromkeys(row['chat_session_id'] for row in rows))
+        existing = {row['id'] for row in supabase.table('chat_sessions').select('id').in_('id', session_ids).execute().data or []}
+        rows = [row for row in rows if row['chat_session_id'] in existing]
+        if not rows:
+            return 0
+        
+        result = supabase.table('chat_messages').upsert(rows, ignore_duplicates=True).execute()
+        for chat_session_id in existing:
+            self.update_session_activity(chat_session_id)
+        return len(result.data or [])
+    
     def update_session_activity(self, chat_session_id):
         """Update session last activity and message count"""
         try:
-            # Get current message count
-            messages = supabase.table('chat_messages').select('id').eq('chat_session_id', chat_session_id).execute()
-            message_count = len(messages.data) if messages.data else 0
+            # Count rows server-side instead of fetching every message id
+            messages = supabase.table('chat_messages').select('id', count='exact').eq('chat_session_id', chat_session_id).limit(0).execute()
+            message_count = messages.count or 0
             
             # Update session
             update_data = {
@@ -82,39 +143,115 @@ class ChatStorage:
             }
             
             supabase.table('chat_sessions').update(update_data).eq('id', chat_session_id).execute()
-            
+        
         except Exception as e:
             self.logger.error(f"Error updating session activity: {e}")
     
     def get_user_chat_sessions(self, user_email, limit=50):
         """Get all chat sessions for a user"""
         try:
-            result = supabase.table('chat_sessions').select('*').eq('user_email', user_email).order('last_activity', desc=True).limit(limit).execute()
-            
-            if result.data:
-                return result.data
-            else:
-                return []
-                
+            result = supabase.table('chat_sessions').select('id, session_title, last_activity, message_count, status').eq('user_email', user_email).order('last_activity', desc=True).limit(limit).execute()
+        
         except Exception as e:
             self.logger.error(f"Error fetching user chat sessions: {e}")
             return []
+        
+        now = datetime.now()
+        chat_list = []
+        for row in result.data or []:
+            last_activity_dt = datetime.fromisoformat(row['last_activity'])
+            chat_list.append({
+                'id': row['id'],
+                'title': row['session_title'],
+                'last_activity': row['last_activity'],
+                'message_count': row['message_count'] or 0,
+                'status': row['status'],
+                'formatted_date': last_activity_dt.strftime("%B %d, %Y"),
+                'formatted_time': last_activity_dt.strftime("%I:%M %p"),
+                'relative_time': format_relative_time(now - last_activity_dt)
+            })
+        
+        return chat_list
     
-    def get_chat_messages(self, chat_session_id):
-        """Get all messages for a chat session"""
+    def get_chat_messages(self, chat_session_id, user_email, limit=None, before=None):
+        """Get the messages of a chat session, all of them unless a page is asked for"""
+        if limit is not None or before is not None:
+            return self.get_chat_messages_page(chat_session_id, user_email, limit or 20, before)['messages']
+        
         try:
-            result = supabase.table('chat_messages').select('*').eq('chat_session_id', chat_session_id).order('timestamp', desc=False).execute()
-            
-            if result.data:
-                return result.data
-            else:
-                return []
-                
+            result = supabase.table('chat_messages').select('*, chat_sessions!inner(user_email)').eq('chat_session_id', chat_session_id).eq('chat_sessions.user_email', user_email).order('timestamp', desc=False).order('id', desc=False).execute()
+            return [{k: v for k, v in row.items() if k != 'chat_sessions'} for row in result.data or []]
+        
         except Exception as e:
             self.logger.error(f"Error fetching chat messages: {e}")
             return []
     
-    def end_chat_session(self, chat_session_id):
+    def get_chat_messages_page(self, chat_session_id, user_email, limit=20, before=None):
+        """Get up to ``limit`` messages older than the ``before`` cursor (the latest ones without it)
+        
+        The cursor is ``<timestamp>|<id>`` of the oldest message already
+        loaded, so messages sharing a timestamp across a page boundary are
+        neither skipped nor repeated. A malformed cursor gets an empty page.
+        """
+        if before:
+            cursor = self._parse_cursor(before)
+            if cursor is None:
+                self.logger.warning(f"Ignoring malformed chat messages cursor: {before!r}")
+                return {'messages': [], 'next_cursor': None, 'has_more': False}
+        
+        try:
+            # Joined to the session so only its owner gets the messages
+            query = supabase.table('chat_messages').select('*, chat_sessions!inner(user_email)').eq('chat_session_id', chat_session_id).eq('chat_sessions.user_email', user_email)
+            if before:
+                # Built from the parsed values only, so a cursor cannot add filter terms
+                timestamp, message_id = cursor
+                query = query.or_(f'timestamp.lt."{timestamp}",and(timestamp.eq."{timestamp}",id.lt."{message_id}")')
+            # Newest first with one extra row to learn whether an older page exists
+            result = query.order('timestamp', desc=True).order('id', desc=True).limit(limit + 1).execute()
+            
+            rows = result.data or []
+            has_more = len(rows) > limit
+            messages = [{k: v for k, v in row.items() if k != 'chat_sessions'} for row in reversed(rows[:limit])]
+            return {
+                'messages': messages,
+                'next_cursor': f"{messages[0]['timestamp']}|{messages[0]['id']}" if has_more else None,
+                'has_more': has_more
+            }
+        
+        except Exception as e:
+            self.logger.error(f"Error fetching chat messages: {e}")
+            return {'messages': [], 'next_cursor': None, 'has_more': False}
+    
+    @staticmethod
+    def _parse_cursor(before):
+        """Split a ``<timestamp>|<id>`` cursor into a normalized timestamp and message id, None if malformed"""
+        timestamp, _, message_id = before.partition('|')
+        try:
+            return datetime.fromisoformat(timestamp).isoformat(), str(uuid.UUID(message_id))
+        except ValueError:
+            return None
+    
+    def get_session_state(self, chat_session_id, user_email):
+        """Get the conversation state stored with a chat session (migration 0004), None if it has none"""
+        try:
+            result = supabase.table('chat_sessions').select('conversation_state').eq('id', chat_session_id).eq('user_email', user_email).limit(1).execute()
+            return result.data[0]['conversation_state'] if result.data else None
+        
+        except Exception as e:
+            self.logger.error(f"Error loading conversation state: {e}")
+            return None
+    
+    def set_session_state(self, chat_session_id, user_email, state):
+        """Store the conversation state with a chat session"""
+        try:
+            result = supabase.table('chat_sessions').update({'conversation_state': state}).eq('id', chat_session_id).eq('user_email', user_email).execute()
+            return bool(result.data)
+        
+        except Exception as e:
+            self.logger.error(f"Error saving conversation state: {e}")
+            return False
+    
+    def end_chat_session(self, chat_session_id, user_email):
         """Mark a chat session as ended"""
         try:
             update_data = {
@@ -122,9 +259,9 @@ class ChatStorage:
                 'last_activity': datetime.now().isoformat()
             }
             
-            result = supabase.table('chat_sessions').update(update_data).eq('id', chat_session_id).execute()
-            return result.data is not None
-            
+            result = supabase.table('chat_sessions').update(update_data).eq('id', chat_session_id).eq('user_email', user_email).execute()
+            return bool(result.data)
+        
         except Exception as e:
             self.logger.error(f"Error ending chat session: {e}")
             return False
@@ -145,7 +282,7 @@ class ChatStorage:
             # Delete session
             result = supabase.table('chat_sessions').delete().eq('id', chat_session_id).execute()
             return result.data is not None
-            
+        
         except Exception as e:
             self.logger.error(f"Error deleting chat session: {e}")
             return False
@@ -0,0 +1,32 @@
+import os
+import logging
+from .simple_chat_storage import SimpleChatStorage
+from .sqlite_chat_storage import SQLiteChatStorage
+from .message_writer import WriteBehindChatStorage, create_message_writer
+
+CHAT_STORAGE_BACKENDS = {
+    'file': SimpleChatStorage,
+    'sqlite': SQLiteChatStorage
+}
+
+def create_chat_storage(backend=None):
+    """Create the chat storage selected by ``CHAT_STORAGE_BACKEND`` (file, sqlite or supabase)
+    
+    Message saves go through a write-behind queue unless ``CHAT_WRITE_BEHIND``
+    is false.
+    """
+    backend = (backend or os.environ.get('CHAT_STORAGE_BACKEND', 'file')).lower()
+    
+    storage_class = CHAT_STORAGE_BACKENDS.get(backend)
+    if backend == 'supabase':
+        # Imported here as it needs the Supabase configuration
+        from .chat_storage import ChatStorage
+        storage_class = ChatStorage
+    if storage_class is None:
+        logging.warning(f"Unknown chat storage backend '{backend}', falling back to file storage")
+        storage_class = SimpleChatStorage
+    
+    storage = storage_class()
+    if os.environ.get('CHAT_WRITE_BEHIND', 'true').lower() in ('1', 'true', 'yes'):
+        storage = WriteBehindChatStorage(storage, create_message_writer(storage))
+    return storage
\ No newline at end of file
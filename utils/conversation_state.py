@@ -0,0 +1,54 @@
+from typing import Dict, Iterable, Optional
+from .message_matcher import match_message
+
+class ConversationState:
+    """Details the user has given so far in a chat (location, cuisine, ...)
+    
+    Slots are filled from each new user message as it arrives, later
+    messages overriding earlier ones, so reading them costs the same however
+    long the chat is and nothing said early on is forgotten. The state is
+    stored with the chat session in chat storage and cached next to the
+    conversation window in the conversation store.
+    """
+    
+    SLOTS = ('location', 'cuisine', 'service_type', 'time', 'party_size')
+    
+    def __init__(self, slots: Optional[Dict] = None, turns: int = 0):
+        self.slots = {slot: None for slot in self.SLOTS}
+        if slots:
+            self.slots.update({slot: value for slot, value in slots.items() if slot in self.slots})
+        self.turns = turns
+    
+    def update(self, message: str) -> 'ConversationState':
+        """Fill slots from a new user message"""
+        matched = match_message(message)
+        for slot in self.SLOTS:
+            if matched[slot] is not None:
+                self.slots[slot] = matched[slot]
+        self.turns += 1
+        return self
+    
+    def copy(self) -> 'ConversationState':
+        return ConversationState(self.slots, self.turns)
+    
+    def __getitem__(self, slot: str):
+        return self.slots[slot]
+    
+    def to_dict(self) -> Dict:
+        return {'slots': dict(self.slots), 'turns': self.turns}
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'ConversationState':
+        return cls(data.get('slots'), data.get('turns', 0))
+    
+    @classmethod
+    def from_messages(cls, messages: Iterable[Dict]) -> 'ConversationState':
+        """Rebuild the state from stored chat messages, e.g. when a chat is reopened"""
+        state = cls()
+        for message in messages:
+            if message.get('type') == 'user':
+                state.update(message.get('content', ''))
+        return state
+    
+    def __repr__(self):
+        return f"ConversationState({self.slots}, turns={self.turns})"
\ No newline at end of file
@@ -0,0 +1,317 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from typing import List, Dict, Optional
+from .conversation_state import ConversationState
+from .lru_cache import LRUCache
+
+try:
+    import redis
+except ImportError:  # Only needed for CONVERSATION_STORE=redis
+    redis = None
+
+# Fields kept for each message in a conversation window; card payloads and
+# quick replies stay in chat storage
+WINDOW_FIELDS = ('id', 'type', 'content', 'timestamp', 'message_type')
+
+def compact_message(message: Dict) -> Dict:
+    """Strip a chat message down to what the chat handlers read"""
+    return {field: message[field] for field in WINDOW_FIELDS if field in message}
+
+class MemoryConversationStore:
+    """Conversation windows kept in this process's memory
+    
+    Fast, but every worker process has its own copy; with several gunicorn
+    workers use the sqlite or redis store so all workers see the same window.
+    """
+    
+    def __init__(self, window: int = 20, ttl: Optional[float] = 3600, max_size: int = 1024):
+        self.window = window
+        self._lock = threading.Lock()
+        self._conversations = LRUCache(max_size=max_size, ttl=ttl)
+        self._states = LRUCache(max_size=max_size, ttl=ttl)
+    
+    def get(self, chat_id: str) -> Optional[List[Dict]]:
+        """Get a conversation window, None if it is not stored"""
+        messages = self._conversations.get(chat_id)
+        return list(messages) if messages is not None else None
+    
+    def set(self, chat_id: str, messages: List[Dict]):
+        """Replace a conversation window"""
+        self._conversations.set(chat_id, [compact_message(m) for m in messages][-self.window:])
+    
+    def append(self, chat_id: str, messages: List[Dict]):
+        """Append messages to a stored window, dropping the oldest beyond the window size"""
+        with self._lock:
+            current = self._conversations.peek(chat_id)
+            if current is None:
+                return
+            self._conversations.set(chat_id, (current + [compact_message(m) for m in messages])[-self.window:])
+    
+    def get_state(self, chat_id: str) -> Optional[ConversationState]:
+        """Get a conversation's slot state, None if it is not stored"""
+        state = self._states.get(chat_id)
+        return state.copy() if state is not None else None
+    
+    def set_state(self, chat_id: str, state: ConversationState):
+        """Store a conversation's slot state"""
+        self._states.set(chat_id, state.copy())
+    
+    def delete(self, chat_id: str):
+        """Forget a conversation window and its state"""
+        self._conversations.pop(chat_id)
+        self._states.pop(chat_id)
+    
+    def stats(self) -> Dict:
+        """Store statistics"""
+        return dict(self._conversations.stats(), backend='memory')
+
+class SQLiteConversationStore:
+    """Conversation windows in a SQLite table shared by every worker on the host"""
+    
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS conversations (
+        chat_id TEXT PRIMARY KEY,
+        messages TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    
+    CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations (updated_at);
+    
+    CREATE TABLE IF NOT EXISTS conversation_states (
+        chat_id TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    
+    CREATE INDEX IF NOT EXISTS idx_conversation_states_updated ON conversation_states (updated_at);
+    """
+    
+    def __init__(self, window: int = 20, ttl: Optional[float] = 3600, db_path: Optional[str] = None):
+        self.logger = logging.getLogger(__name__)
+        self.window = window
+        self.ttl = ttl
+        self.db_path = db_path or os.environ.get('CONVERSATION_SQLITE_PATH', os.path.join('chat_history', 'conversations.db'))
+        self._local = threading.local()
+        
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._connection().executescript(self.SCHEMA)
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use or after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+    
+    def get(self, chat_id: str) -> Optional[List[Dict]]:
+        """Get a conversation window, None if it is not stored or has expired"""
+        try:
+            row = self._connection().execute(
+                'SELECT messages, updated_at FROM conversations WHERE chat_id = ?', (chat_id,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error loading conversation: {e}")
+            return None
+        
+        if row is None or (self.ttl is not None and row[1] < time.time() - self.ttl):
+            return None
+        return json.loads(row[0])
+    
+    def set(self, chat_id: str, messages: List[Dict]):
+        """Replace a conversation window, pruning expired windows on the way"""
+        window = [compact_message(m) for m in messages][-self.window:]
+        try:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO conversations (chat_id, messages, updated_at) VALUES (?, ?, ?)',
+                (chat_id, json.dumps(window, ensure_ascii=False), time.time())
+            )
+            if self.ttl is not None:
+                conn.execute('DELETE FROM conversations WHERE updated_at < ?', (time.time() - self.ttl,))
+        except sqlite3.Error as e:
+            self.logger.error(f"Error saving conversation: {e}")
+    
+    def append(self, chat_id: str, messages: List[Dict]):
+        """Append messages to a stored window, dropping the oldest beyond the window size"""
+        conn = self._connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT messages FROM conversations WHERE chat_id = ?', (chat_id,)).fetchone()
+                if row is not None:
+                    window = (json.loads(row[0]) + [compact_message(m) for m in messages])[-self.window:]
+                    conn.execute(
+                        'UPDATE conversations SET messages = ?, updated_at = ? WHERE chat_id = ?',
+                        (json.dumps(window, ensure_ascii=False), time.time(), chat_id)
+                    )
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error saving conversation: {e}")
+    
+    def get_state(self, chat_id: str) -> Optional[ConversationState]:
+        """Get a conversation's slot state, None if it is not stored or has expired"""
+        try:
+            row = self._connection().execute(
+                'SELECT state, updated_at FROM conversation_states WHERE chat_id = ?', (chat_id,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error loading conversation state: {e}")
+            return None
+        
+        if row is None or (self.ttl is not None and row[1] < time.time() - self.ttl):
+            return None
+        return ConversationState.from_dict(json.loads(row[0]))
+    
+    def set_state(self, chat_id: str, state: ConversationState):
+        """Store a conversation's slot state, pruning expired states on the way"""
+        try:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO conversation_states (chat_id, state, updated_at) VALUES (?, ?, ?)',
+                (chat_id, json.dumps(state.to_dict(), ensure_ascii=False), time.time())
+            )
+            if self.ttl is not None:
+                conn.execute('DELETE FROM conversation_states WHERE updated_at < ?', (time.time() - self.ttl,))
+        except sqlite3.Error as e:
+            self.logger.error(f"Error saving conversation state: {e}")
+    
+    def delete(self, chat_id: str):
+        """Forget a conversation window and its state"""
+        try:
+            conn = self._connection()
+            conn.execute('DELETE FROM conversations WHERE chat_id = ?', (chat_id,))
+            conn.execute('DELETE FROM conversation_states WHERE chat_id = ?', (chat_id,))
+        except sqlite3.Error as e:
+            self.logger.error(f"Error deleting conversation: {e}")
+    
+    def stats(self) -> Dict:
+        """Store statistics"""
+        try:
+            size = self._connection().execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+        except sqlite3.Error:
+            size = None
+        return {'backend': 'sqlite', 'size': size}
+
+class RedisConversationStore:
+    """Conversation windows in Redis (or any server speaking its protocol)
+    
+    Each window is a list trimmed to the window size and expiring ``ttl``
+    seconds after its last write, so the server does the bookkeeping.
+    """
+    
+    def __init__(self, window: int = 20, ttl: Optional[float] = 3600, url: Optional[str] = None):
+        if redis is None:
+            raise ImportError("CONVERSATION_STORE=redis needs the redis package (pip install redis)")
+        
+        self.logger = logging.getLogger(__name__)
+        self.window = window
+        self.ttl = int(ttl) if ttl is not None else None
+        self.client = redis.Redis.from_url(url or os.environ.get('CONVERSATION_REDIS_URL', 'redis://localhost:6379/0'))
+    
+    def _key(self, chat_id: str) -> str:
+        return f"dinedesk:conversation:{chat_id}"
+    
+    def _state_key(self, chat_id: str) -> str:
+        return f"dinedesk:conversation_state:{chat_id}"
+    
+    def get(self, chat_id: str) -> Optional[List[Dict]]:
+        """Get a conversation window, None if it is not stored or has expired"""
+        try:
+            pipe = self.client.pipeline()
+            pipe.exists(self._key(chat_id))
+            pipe.lrange(self._key(chat_id), 0, -1)
+            exists, items = pipe.execute()
+        except redis.RedisError as e:
+            self.logger.error(f"Error loading conversation: {e}")
+            return None
+        
+        if not exists:
+            return None
+        # An empty window is stored as a single placeholder so it still exists
+        return [json.loads(item) for item in items if item != b'{}']
+    
+    def _write(self, pipe, chat_id: str, messages: List[Dict]):
+        key = self._key(chat_id)
+        pipe.rpush(key, *[json.dumps(compact_message(m), ensure_ascii=False) for m in messages] or ['{}'])
+        pipe.ltrim(key, -self.window, -1)
+        if self.ttl is not None:
+            pipe.expire(key, self.ttl)
+    
+    def set(self, chat_id: str, messages: List[Dict]):
+        """Replace a conversation window"""
+        try:
+            pipe = self.client.pipeline()
+            pipe.delete(self._key(chat_id))
+            self._write(pipe, chat_id, messages)
+            pipe.execute()
+        except redis.RedisError as e:
+            self.logger.error(f"Error saving conversation: {e}")
+    
+    def append(self, chat_id: str, messages: List[Dict]):
+        """Append messages to a stored window, dropping the oldest beyond the window size"""
+        try:
+            if self.client.exists(self._key(chat_id)):
+                pipe = self.client.pipeline()
+                self._write(pipe, chat_id, messages)
+                pipe.execute()
+        except redis.RedisError as e:
+            self.logger.error(f"Error saving conversation: {e}")
+    
+    def get_state(self, chat_id: str) -> Optional[ConversationState]:
+        """Get a conversation's slot state, None if it is not stored or has expired"""
+        try:
+            data = self.client.get(self._state_key(chat_id))
+        except redis.RedisError as e:
+            self.logger.error(f"Error loading conversation state: {e}")
+            return None
+        return ConversationState.from_dict(json.loads(data)) if data is not None else None
+    
+    def set_state(self, chat_id: str, state: ConversationState):
+        """Store a conversation's slot state"""
+        try:
+            self.client.set(self._state_key(chat_id), json.dumps(state.to_dict(), ensure_ascii=False), ex=self.ttl)
+        except redis.RedisError as e:
+            self.logger.error(f"Error saving conversation state: {e}")
+    
+    def delete(self, chat_id: str):
+        """Forget a conversation window and its state"""
+        try:
+            self.client.delete(self._key(chat_id), self._state_key(chat_id))
+        except redis.RedisError as e:
+            self.logger.error(f"Error deleting conversation: {e}")
+    
+    def stats(self) -> Dict:
+        """Store statistics"""
+        return {'backend': 'redis'}
+
+CONVERSATION_STORES = {
+    'memory': MemoryConversationStore,
+    'sqlite': SQLiteConversationStore,
+    'redis': RedisConversationStore
+}
+
+def create_conversation_store(backend=None):
+    """Create the conversation store selected by ``CONVERSATION_STORE`` (memory, sqlite or redis)"""
+    backend = (backend or os.environ.get('CONVERSATION_STORE', 'memory')).lower()
+    window = int(os.environ.get('CONVERSATION_WINDOW', 20))
+    ttl = float(os.environ.get('CONVERSATION_TTL', 3600))
+    
+    store_class = CONVERSATION_STORES.get(backend)
+    if store_class is None:
+        logging.warning(f"Unknown conversation store '{backend}', falling back to memory")
+        store_class = MemoryConversationStore
+    
+    return store_class(window=window, ttl=ttl)
\ No newline at end of file
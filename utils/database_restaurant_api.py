@@ -1,18 +1,63 @@
 import random
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime, timedelta, date
 from config_supabase import supabase
+from .catalog_cache import catalog_cache, AVAILABILITY_TTL
+
+# Supabase queries issued by this module: a process-wide total, plus a
+# per-block counter (e.g. one chat turn) set up with count_queries()
+query_stats = {'queries': 0}
+_query_stats_lock = threading.Lock()
+_turn_queries = ContextVar('restaurant_turn_queries', default=None)
+
+@contextmanager
+def count_queries():
+    """Count the restaurant queries made inside the block"""
+    counter = {'queries': 0}
+    token = _turn_queries.set(counter)
+    try:
+        yield counter
+    finally:
+        _turn_queries.reset(token)
+
+def _execute(query):
+    """Execute a Supabase query, counting it"""
+    with _query_stats_lock:
+        query_stats['queries'] += 1
+    counter = _turn_queries.get()
+    if counter is not None:
+        counter['queries'] += 1
+    return query.execute()
 
 class DatabaseRestaurantAPI:
-    """Restaurant API that uses Supabase instead of SQLAlchemy models"""
+    """Restaurant API that uses Supabase instead of SQLAlchemy models
+    
+    Catalog listings and availability are served from the shared
+    ``catalog_cache``; call ``invalidate_restaurants`` or
+    ``invalidate_availability`` after editing them.
+    """
     
     def __init__(self):
-        pass
+        self.cache = catalog_cache
+    
+    def invalidate_restaurants(self):
+        """Drop cached restaurant listings, e.g. after a restaurant is edited"""
+        return self.cache.invalidate('restaurants')
+    
+    def invalidate_availability(self):
+        """Drop cached availability, e.g. after a booking or a slot edit"""
+        return self.cache.invalidate('availability')
     
     def get_restaurants_for_booking(self):
         """Get restaurants suitable for table booking with availability"""
         try:
-            result = supabase.table('restaurants').select('*').eq('is_active', True).limit(6).execute()
-            restaurants = [r for r in result.data if 'dine_in' in r.get('services_offered', [])]
+            rows = self.cache.get_or_load(
+                ('restaurants', 'booking'),
+                lambda: _execute(supabase.table('restaurants').select('*').eq('is_active', True).limit(6)).data
+            )
+            restaurants = [r for r in rows if 'dine_in' in r.get('services_offered', [])]
             
             return self._format_restaurant_cards(restaurants)
         except Exception as e:
@@ -24,9 +69,12 @@ class DatabaseRestaurantAPI:
     def get_restaurants_by_cuisine(self, cuisine):
         """Get restaurants filtered by cuisine type"""
         try:
-            result = supabase.table('restaurants').select('*').eq('cuisine', cuisine.lower()).eq('is_active', True).limit(8).execute()
+            restaurants = self.cache.get_or_load(
+                ('restaurants', 'cuisine', cuisine.lower()),
+                lambda: _execute(supabase.table('restaurants').select('*').eq('cuisine', cuisine.lower()).eq('is_active', True).limit(8)).data
+            )
             
-            return self._format_restaurant_cards(result.data)
+            return self._format_restaurant_cards(restaurants)
         except Exception as e:
             return {
                 'type': 'error',
@@ -36,12 +84,15 @@ class DatabaseRestaurantAPI:
     def get_popular_restaurants(self):
         """Get popular restaurants for general recommendations"""
         try:
-            result = supabase.table('restaurants').select('*').eq('is_active', True).order('rating', desc=True).limit(6).execute()
+            restaurants = self.cache.get_or_load(
+                ('restaurants', 'popular'),
+                lambda: _execute(supabase.table('restaurants').select('*').eq('is_active', True).order('rating', desc=True).limit(6)).data
+            )
             
-            return self._format_restaurant_cards(result.data)
+            return self._format_restaurant_cards(restaurants)
         except Exception as e:
             return {
-                'type': 'error', 
+                'type': 'error',
                 'content': f"Error fetching popular restaurants: {str(e)}"
             }
     
@@ -64,43 +115,55 @@ class DatabaseRestaurantAPI:
             if min_rating:
                 query_builder = query_builder.gte('rating', min_rating)
             
-            # Execute query
-            result = query_builder.limit(10).execute()
+            # Execute query, cached per filter combination
+            restaurants = self.cache.get_or_load(
+                ('restaurants', 'search', cuisine and cuisine.lower(), max_price, min_rating),
+                lambda: _execute(query_builder.limit(10)).data
+            )
             
             # Text search if query provided (simplified - in production use full-text search)
             if query:
                 filtered_data = []
                 query_lower = query.lower()
-                for restaurant in result.data:
-                    if (query_lower in restaurant.get('name', '').lower() or 
+                for restaurant in restaurants:
+                    if (query_lower in restaurant.get('name', '').lower() or
                         query_lower in restaurant.get('description', '').lower() or
                         query_lower in restaurant.get('cuisine', '').lower()):
                         filtered_data.append(restaurant)
-                result.data = filtered_data
+                restaurants = filtered_data
             
-            return self._format_restaurant_cards(result.data)
+            return self._format_restaurant_cards(restaurants)
         except Exception as e:
             return {
                 'type': 'error',
                 'content': f"Error searching restaurants: {str(e)}"
             }
     
+    def _get_restaurant(self, restaurant_id):
+        """Get one restaurant row, None if there is no such restaurant"""
+        rows = self.cache.get_or_load(
+            ('restaurants', 'id', str(restaurant_id)),
+            lambda: _execute(supabase.table('restaurants').select('*').eq('id', restaurant_id)).data
+        )
+        return rows[0] if rows else None
+    
     def get_restaurant_menu(self, restaurant_id):
         """Get full menu for a specific restaurant"""
         try:
             # Get restaurant details
-            restaurant_result = supabase.table('restaurants').select('*').eq('id', restaurant_id).execute()
-            if not restaurant_result.data:
+            restaurant = self._get_restaurant(restaurant_id)
+            if restaurant is None:
                 return {'type': 'error', 'content': 'Restaurant not found'}
             
-            restaurant = restaurant_result.data[0]
-            
             # Get dishes for this restaurant
-            dishes_result = supabase.table('dishes').select('*').eq('restaurant_id', restaurant_id).eq('is_available', True).execute()
+            dishes = self.cache.get_or_load(
+                ('restaurants', 'dishes', str(restaurant_id)),
+                lambda: _execute(supabase.table('dishes').select('*').eq('restaurant_id', restaurant_id).eq('is_available', True)).data
+            )
             
             # Group dishes by category
             menu_categories = {}
-            for dish in dishes_result.data:
+            for dish in dishes:
                 category = dish.get('category', 'other')
                 if category not in menu_categories:
                     menu_categories[category] = []
@@ -132,12 +195,10 @@ class DatabaseRestaurantAPI:
     def get_restaurant_details(self, restaurant_id):
         """Get detailed information about a restaurant"""
         try:
-            result = supabase.table('restaurants').select('*').eq('id', restaurant_id).execute()
-            if not result.data:
+            restaurant = self._get_restaurant(restaurant_id)
+            if restaurant is None:
                 return {'type': 'error', 'content': 'Restaurant not found'}
             
-            restaurant = result.data[0]
-            
             return {
                 'type': 'restaurant_details',
                 'restaurant': restaurant,
@@ -149,12 +210,23 @@ class DatabaseRestaurantAPI:
                 'content': f"Error fetching restaurant details: {str(e)}"
             }
     
+    def get_restaurant_card(self, restaurant_id):
+        """Get the card for one restaurant, with today's availability, None if it is not found"""
+        try:
+            restaurant = self._get_restaurant(restaurant_id)
+            cards = self._format_restaurant_cards([restaurant]) if restaurant is not None else []
+            return cards[0] if cards else None
+        except Exception:
+            return None
+    
     def get_available_cuisines(self):
         """Get list of available cuisines"""
         try:
-            result = supabase.table('restaurants').select('cuisine').eq('is_active', True).execute()
-            cuisines = list(set(r['cuisine'] for r in result.data if r.get('cuisine')))
-            return sorted(cuisines)
+            def load_cuisines():
+                result = _execute(supabase.table('restaurants').select('cuisine').eq('is_active', True))
+                return sorted(set(r['cuisine'] for r in result.data if r.get('cuisine')))
+            
+            return list(self.cache.get_or_load(('restaurants', 'cuisines'), load_cuisines))
         except Exception as e:
             return []
     
@@ -162,28 +234,54 @@ class DatabaseRestaurantAPI:
         """Get restaurants near a specific location (simplified)"""
         try:
             # Simplified implementation - in production, use PostGIS for geo queries
-            result = supabase.table('restaurants').select('*').eq('is_active', True).limit(8).execute()
+            restaurants = self.cache.get_or_load(
+                ('restaurants', 'nearby'),
+                lambda: _execute(supabase.table('restaurants').select('*').eq('is_active', True).limit(8)).data
+            )
             
-            return self._format_restaurant_cards(result.data)
+            return self._format_restaurant_cards(restaurants)
         except Exception as e:
             return {
                 'type': 'error',
                 'content': f"Error fetching nearby restaurants: {str(e)}"
             }
     
+    def _get_availability(self, restaurant_ids, per_restaurant=6):
+        """Get today's open slots for several restaurants in one query, grouped by restaurant id"""
+        if not restaurant_ids:
+            return {}
+        
+        today = str(date.today())
+        
+        def load_availability():
+            result = _execute(supabase.table('availability_slots').select('restaurant_id, time_slot, is_available').in_('restaurant_id', list(restaurant_ids)).eq('date', today).eq('is_available', True))
+            
+            availability = {restaurant_id: [] for restaurant_id in restaurant_ids}
+            for slot in result.data:
+                slots = availability.get(slot['restaurant_id'])
+                if slots is not None and len(slots) < per_restaurant:
+                    slots.append({'time': slot['time_slot'], 'available': slot['is_available']})
+            return availability
+        
+        try:
+            return self.cache.get_or_load(
+                ('availability', today, tuple(sorted(restaurant_ids, key=str))),
+                load_availability,
+                ttl=AVAILABILITY_TTL
+            )
+        except Exception:
+            return {}
+    
     def _format_restaurant_cards(self, restaurants):
         """Helper method to format restaurant data as cards"""
         restaurant_cards = []
         
+        # One availability query for the whole result set
+        availability_by_restaurant = self._get_availability([r['id'] for r in restaurants if 'id' in r])
+        
         for restaurant in restaurants:
             try:
-                # Get availability slots for today from database
-                availability_result = supabase.table('availability_slots').select('*').eq('restaurant_id', restaurant['id']).eq('date', str(date.today())).eq('is_available', True).limit(6).execute()
-                
-                availability = [
-                    {'time': slot['time_slot'], 'available': slot['is_available']}
-                    for slot in availability_result.data
-                ]
+                availability = availability_by_restaurant.get(restaurant['id'], [])
                 
                 # If no availability data, generate some default slots
                 if not availability:
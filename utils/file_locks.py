@@ -0,0 +1,49 @@
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock; locking degrades to a no-op there
+    fcntl = None
+
+@contextmanager
+def file_lock(lock_path: str, shared: bool = False):
+    """Hold an advisory lock on ``lock_path`` for the duration of the block
+    
+    Shared locks can be held by any number of readers at once, an exclusive
+    lock waits for every other holder. The lock is taken on a freshly opened
+    file descriptor, so it excludes other threads of this process as well as
+    other processes (e.g. other gunicorn workers). Never nest two locks on the
+    same path in one thread: the inner one would wait on the outer one.
+    """
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+def atomic_write(path: str, data, fsync: bool = True):
+    """Replace ``path`` with ``data`` (str or bytes) so readers see either the old or the new file"""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix=os.path.basename(path))
+    try:
+        with (os.fdopen(fd, 'wb') if isinstance(data, bytes) else os.fdopen(fd, 'w', encoding='utf-8')) as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def atomic_write_json(path: str, data, fsync: bool = True, **dump_kwargs):
+    """Atomically replace ``path`` with ``data`` serialized as JSON"""
+    dump_kwargs.setdefault('ensure_ascii', False)
+    atomic_write(path, json.dumps(data, **dump_kwargs), fsync=fsync)
\ No newline at end of file
@@ -0,0 +1,106 @@
+import atexit
+import json
+import os
+import re
+import threading
+import time
+import logging
+from typing import Dict, Optional
+from .file_locks import atomic_write_json
+from .lru_cache import LRUCache
+
+def normalize_message(message: str) -> str:
+    """Normalize a user message for cache lookups: case, spacing and trailing punctuation"""
+    return re.sub(r'\s+', ' ', message.lower()).strip().strip('.!?, ')
+
+class LLMResponseCache:
+    """Cache of AI replies keyed on the normalized message, intent and conversation slots
+    
+    Two users asking the same thing in the same situation (e.g. "book a
+    table" with no location known yet) get the same reply without another
+    completion. Entries live for ``ttl`` seconds in an LRU of ``max_size``.
+    
+    With ``persist_path`` set the cache is loaded from that JSON file at
+    startup and written back every ``save_every`` new entries and at exit,
+    so a restart does not start cold.
+    """
+    
+    def __init__(self, max_size: int = 1024, ttl: float = 3600, persist_path: Optional[str] = None, save_every: int = 50):
+        self.logger = logging.getLogger(__name__)
+        self.ttl = ttl
+        self.persist_path = persist_path
+        self.save_every = save_every
+        self._entries = LRUCache(max_size=max_size, ttl=ttl)
+        self._save_lock = threading.Lock()
+        self._unsaved = 0
+        
+        if persist_path:
+            self.load()
+            atexit.register(self.save)
+    
+    def make_key(self, message: str, intent: str, collected_info: Dict) -> str:
+        """Build the cache key for a message in a given conversation state"""
+        slots = sorted((slot, value) for slot, value in collected_info.items() if value is not None)
+        return json.dumps([normalize_message(message), intent, slots])
+    
+    def get(self, key: str) -> Optional[str]:
+        """Get a cached reply"""
+        entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+    
+    def set(self, key: str, response: str):
+        """Cache a reply"""
+        # Wall-clock creation time, so persisted entries expire across restarts
+        self._entries.set(key, (response, time.time()))
+        
+        if self.persist_path:
+            with self._save_lock:
+                self._unsaved += 1
+                save_now = self._unsaved >= self.save_every
+            if save_now:
+                self.save()
+    
+    def load(self):
+        """Load persisted entries that have not expired yet"""
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (IOError, json.JSONDecodeError) as e:
+            self.logger.warning(f"Ignoring unreadable LLM cache file {self.persist_path}: {e}")
+            return
+        
+        now = time.time()
+        for key, response, created_at in entries:
+            remaining = self.ttl - (now - created_at)
+            if remaining > 0:
+                self._entries.set(key, (response, created_at), ttl=remaining)
+    
+    def save(self):
+        """Write the cache to ``persist_path``"""
+        if not self.persist_path:
+            return
+        
+        with self._save_lock:
+            self._unsaved = 0
+            entries = [[key, response, created_at] for key, (response, created_at) in self._entries.items()]
+            try:
+                directory = os.path.dirname(self.persist_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                atomic_write_json(self.persist_path, entries, fsync=False)
+            except IOError as e:
+                self.logger.error(f"Error saving LLM cache: {e}")
+    
+    def stats(self) -> Dict:
+        """Cache size and hit/miss counters"""
+        return self._entries.stats()
+
+def create_llm_cache():
+    """Create the AI reply cache configured by ``LLM_CACHE_SIZE``, ``LLM_CACHE_TTL`` and ``LLM_CACHE_PATH``"""
+    return LLMResponseCache(
+        max_size=int(os.environ.get('LLM_CACHE_SIZE', 1024)),
+        ttl=float(os.environ.get('LLM_CACHE_TTL', 3600)),
+        persist_path=os.environ.get('LLM_CACHE_PATH') or None
+    )
\ No newline at end of file
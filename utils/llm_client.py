@@ -0,0 +1,440 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Optional
+import groq
+from .rate_limiter import INTERACTIVE, BACKGROUND, RateLimitExceeded, create_rate_limiter
+
+# Errors worth another attempt: the provider was slow, unreachable,
+# overloaded or broke; anything else (bad request, auth) fails the same way
+# every time
+RETRYABLE_ERRORS = (
+    groq.APITimeoutError,
+    groq.APIConnectionError,
+    groq.RateLimitError,
+    groq.InternalServerError
+)
+
+class LLMUnavailableError(Exception):
+    """Raised instead of calling the provider while the circuit breaker is open"""
+
+class LLMDeadlineExceeded(TimeoutError):
+    """Raised when the caller's deadline passes before an attempt could start"""
+
+class CircuitBreaker:
+    """Stop calling a provider after repeated failures, then probe it again
+    
+    After ``failure_threshold`` failed calls in a row the breaker opens and
+    calls are refused for ``reset_timeout`` seconds. Then one probe call is
+    let through (half open): success closes the breaker, failure opens it
+    for another ``reset_timeout``.
+    """
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self.opened_count = 0
+    
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+    
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return 'open'
+        return 'half_open'
+    
+    def allow(self) -> bool:
+        """Whether a call may go to the provider now"""
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+    
+    def cancel(self):
+        """Forget a call that was allowed but never reached the provider"""
+        with self._lock:
+            self._probing = False
+    
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._probing:
+                    self.opened_count += 1
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+class LatencyTracker:
+    """Latencies of the last ``size`` successful calls"""
+    
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+    
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+    
+    def percentile(self, fraction: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+    
+    def __len__(self):
+        return len(self._samples)
+
+def estimate_tokens(kwargs: Dict) -> int:
+    """Rough token count of a completion request: ~4 characters per prompt token plus the reply limit"""
+    prompt_chars = sum(len(message.get('content') or '') for message in kwargs.get('messages', []))
+    return prompt_chars // 4 + kwargs.get('max_completion_tokens', kwargs.get('max_tokens', 0))
+
+def release_when_done(stream, release):
+    """Iterate a streamed completion, calling ``release`` once it is consumed or dropped"""
+    try:
+        yield from stream
+    finally:
+        release()
+
+async def arelease_when_done(stream, release):
+    """Async version of release_when_done for streams from the async client"""
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        release()
+
+class LLMClient:
+    """Chat completions with deadlines, retries, hedging and a circuit breaker
+    
+    Each attempt gets at most ``timeout`` seconds and never outlives the
+    caller's deadline. Retryable errors are retried up to ``max_retries``
+    times with full-jitter exponential backoff. With ``hedge`` on, a
+    non-streaming call still running at the p95 latency of recent calls gets
+    a second identical request and the first answer wins. When the breaker
+    is open, ``create`` raises LLMUnavailableError right away so callers can
+    fall back without tying up a worker.
+    
+    Every attempt first takes budget from ``limiter`` (requests/min,
+    tokens/min and a concurrency cap); a streamed call holds its slot until
+    the stream is consumed. A call that gets no budget in time raises
+    RateLimitExceeded, which does not count against the provider; neither
+    does running out of the caller's own deadline (LLMDeadlineExceeded).
+    
+    ``acreate`` does the same on ``async_client`` for the ASGI entry point,
+    so a slow provider holds a coroutine rather than a worker thread.
+    """
+    
+    def __init__(self, client, timeout: float = 8, max_retries: int = 2, backoff_base: float = 0.2,
+                 backoff_max: float = 2, hedge: bool = False, hedge_min_samples: int = 20,
+                 breaker: Optional[CircuitBreaker] = None, limiter=None, async_client_factory=None):
+        self.logger = logging.getLogger(__name__)
+        self.client = client
+        self._async_client = None
+        self._async_client_factory = async_client_factory
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.limiter = limiter
+        self._hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='llm-hedge') if hedge else None
+        self._lock = threading.Lock()
+        self.counts = {'calls': 0, 'retries': 0, 'hedges': 0, 'hedge_wins': 0, 'failures': 0, 'rejected': 0, 'throttled': 0, 'deadline_exceeded': 0}
+    
+    def _count(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+    
+    @property
+    def async_client(self):
+        """The async provider client, created on first use inside the event loop"""
+        if self._async_client is None:
+            self._async_client = self._async_client_factory()
+        return self._async_client
+    
+    def create(self, deadline: Optional[float] = None, priority: int = INTERACTIVE, **kwargs):
+        """Create a chat completion, giving up at ``deadline`` (a time.monotonic() value)"""
+        if not self.breaker.allow():
+            self._count('rejected')
+            raise LLMUnavailableError("LLM provider circuit breaker is open")
+        self._count('calls')
+        
+        attempt = 0
+        while True:
+            try:
+                timeout = self._attempt_timeout(deadline)
+                if self.hedge and not kwargs.get('stream'):
+                    result = self._create_hedged(timeout, kwargs, priority)
+                else:
+                    result = self._create_once(timeout, kwargs, priority)
+                self.breaker.record_success()
+                return result
+            except RateLimitExceeded:
+                self._count('throttled')
+                self.breaker.cancel()
+                raise
+            except LLMDeadlineExceeded:
+                # Our own budget ran out, which says nothing about the provider
+                self._count('deadline_exceeded')
+                self.breaker.cancel()
+                raise
+            except RETRYABLE_ERRORS as e:
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    self._fail()
+                    raise
+                attempt += 1
+                time.sleep(delay)
+            except Exception:
+                self._fail()
+                raise
+    
+    async def acreate(self, deadline: Optional[float] = None, priority: int = INTERACTIVE, **kwargs):
+        """Async version of ``create``"""
+        if not self.breaker.allow():
+            self._count('rejected')
+            raise LLMUnavailableError("LLM provider circuit breaker is open")
+        self._count('calls')
+        
+        attempt = 0
+        while True:
+            try:
+                timeout = self._attempt_timeout(deadline)
+                if self.hedge and not kwargs.get('stream'):
+                    result = await self._acreate_hedged(timeout, kwargs, priority)
+                else:
+                    result = await self._acreate_once(timeout, kwargs, priority)
+                self.breaker.record_success()
+                return result
+            except RateLimitExceeded:
+                self._count('throttled')
+                self.breaker.cancel()
+                raise
+            except LLMDeadlineExceeded:
+                # Our own budget ran out, which says nothing about the provider
+                self._count('deadline_exceeded')
+                self.breaker.cancel()
+                raise
+            except RETRYABLE_ERRORS as e:
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    self._fail()
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.breaker.cancel()
+                raise
+            except Exception:
+                self._fail()
+                raise
+    
+    def _retry_delay(self, error, attempt: int, deadline: Optional[float]) -> Optional[float]:
+        """Backoff before the next attempt, None when the call should fail instead"""
+        if isinstance(error, groq.RateLimitError) and self.limiter is not None:
+            self.limiter.pause(self._retry_after(error))
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        out_of_time = deadline is not None and time.monotonic() + delay >= deadline
+        if attempt >= self.max_retries or out_of_time:
+            return None
+        self._count('retries')
+        self.logger.warning(f"LLM call failed ({error.__class__.__name__}), retry {attempt + 1} in {delay:.2f}s")
+        return delay
+    
+    def _retry_after(self, error) -> float:
+        """Seconds the provider asked us to back off for, 1 when it did not say"""
+        try:
+            return float(error.response.headers.get('retry-after', 1))
+        except (AttributeError, TypeError, ValueError):
+            return 1.0
+    
+    def _fail(self):
+        self._count('failures')
+        self.breaker.record_failure()
+    
+    def _attempt_timeout(self, deadline: Optional[float]) -> float:
+        if deadline is None:
+            return self.timeout
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise LLMDeadlineExceeded("LLM call deadline passed")
+        return min(self.timeout, left)
+    
+    def _create_once(self, timeout: float, kwargs: Dict, priority: int = INTERACTIVE):
+        if self.limiter is None:
+            return self._call(timeout, kwargs)
+        
+        started = time.monotonic()
+        self.limiter.acquire(estimate_tokens(kwargs), priority, timeout=timeout)
+        try:
+            result = self._call(max(timeout - (time.monotonic() - started), 0.1), kwargs)
+        except BaseException:
+            self.limiter.release()
+            raise
+        
+        if kwargs.get('stream'):
+            return release_when_done(result, self.limiter.release)
+        self.limiter.release()
+        return result
+    
+    async def _acreate_once(self, timeout: float, kwargs: Dict, priority: int = INTERACTIVE):
+        if self.limiter is None:
+            return await self._acall(timeout, kwargs)
+        
+        # Waiting for budget blocks, so it waits on a thread instead of the event loop
+        started = time.monotonic()
+        acquiring = asyncio.ensure_future(asyncio.to_thread(self.limiter.acquire, estimate_tokens(kwargs), priority, timeout))
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # The thread still takes the slot (e.g. for a cancelled hedge), so hand it back once it has
+            acquiring.add_done_callback(self._release_acquired)
+            raise
+        try:
+            result = await self._acall(max(timeout - (time.monotonic() - started), 0.1), kwargs)
+        except BaseException:
+            self.limiter.release()
+            raise
+        
+        if kwargs.get('stream'):
+            return arelease_when_done(result, self.limiter.release)
+        self.limiter.release()
+        return result
+    
+    def _release_acquired(self, acquiring):
+        if not acquiring.cancelled() and acquiring.exception() is None:
+            self.limiter.release()
+    
+    async def _acall(self, timeout: float, kwargs: Dict):
+        started = time.monotonic()
+        result = await self.async_client.chat.completions.create(timeout=timeout, **kwargs)
+        if not kwargs.get('stream'):
+            self.latency.add(time.monotonic() - started)
+        return result
+    
+    def _call(self, timeout: float, kwargs: Dict):
+        started = time.monotonic()
+        result = self.client.chat.completions.create(timeout=timeout, **kwargs)
+        if not kwargs.get('stream'):
+            self.latency.add(time.monotonic() - started)
+        return result
+    
+    def _create_hedged(self, timeout: float, kwargs: Dict, priority: int = INTERACTIVE):
+        """Send a second request if the first is slower than p95, return whichever answers first"""
+        hedge_after = self.latency.percentile(0.95) if len(self.latency) >= self.hedge_min_samples else None
+        if hedge_after is None or hedge_after >= timeout:
+            return self._create_once(timeout, kwargs, priority)
+        
+        primary = self._hedge_pool.submit(self._create_once, timeout, kwargs, priority)
+        done, _ = wait([primary], timeout=hedge_after)
+        if done:
+            return primary.result()
+        
+        self._count('hedges')
+        # The duplicate only gets budget left over by interactive calls
+        hedged = self._hedge_pool.submit(self._create_once, max(timeout - hedge_after, 0.1), kwargs, BACKGROUND)
+        pending = {primary, hedged}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedged:
+                        self._count('hedge_wins')
+                    return future.result()
+                error = future.exception()
+        raise error
+    
+    async def _acreate_hedged(self, timeout: float, kwargs: Dict, priority: int = INTERACTIVE):
+        """Async version of ``_create_hedged``; the slower request is cancelled"""
+        hedge_after = self.latency.percentile(0.95) if len(self.latency) >= self.hedge_min_samples else None
+        if hedge_after is None or hedge_after >= timeout:
+            return await self._acreate_once(timeout, kwargs, priority)
+        
+        primary = asyncio.ensure_future(self._acreate_once(timeout, kwargs, priority))
+        done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+        if done:
+            return primary.result()
+        
+        self._count('hedges')
+        hedged = asyncio.ensure_future(self._acreate_once(max(timeout - hedge_after, 0.1), kwargs, BACKGROUND))
+        pending = {primary, hedged}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedged:
+                            self._count('hedge_wins')
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    def stats(self) -> Dict:
+        """Call counters, breaker state and recent latency"""
+        with self._lock:
+            stats = dict(self.counts)
+        p50 = self.latency.percentile(0.5)
+        p95 = self.latency.percentile(0.95)
+        stats.update({
+            'breaker': self.breaker.state,
+            'breaker_opened': self.breaker.opened_count,
+            'p50_ms': round(p50 * 1000, 1) if p50 is not None else None,
+            'p95_ms': round(p95 * 1000, 1) if p95 is not None else None
+        })
+        if self.limiter is not None:
+            stats['rate_limiter'] = self.limiter.stats()
+        return stats
+
+def create_llm_client():
+    """Create the Groq client wrapper configured by the ``LLM_*`` environment variables"""
+    timeout = float(os.environ.get('LLM_TIMEOUT', 8))
+    # Retries are ours, so the SDK's own are turned off
+    client = groq.Groq(api_key=os.environ.get('GROQ_API_KEY'), timeout=timeout, max_retries=0)
+    return LLMClient(
+        client,
+        timeout=timeout,
+        max_retries=int(os.environ.get('LLM_MAX_RETRIES', 2)),
+        backoff_base=float(os.environ.get('LLM_BACKOFF_BASE', 0.2)),
+        backoff_max=float(os.environ.get('LLM_BACKOFF_MAX', 2)),
+        hedge=os.environ.get('LLM_HEDGE', '').lower() in ('1', 'true', 'yes'),
+        hedge_min_samples=int(os.environ.get('LLM_HEDGE_MIN_SAMPLES', 20)),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.environ.get('LLM_BREAKER_FAILURES', 5)),
+            reset_timeout=float(os.environ.get('LLM_BREAKER_RESET', 30))
+        ),
+        limiter=create_rate_limiter(),
+        async_client_factory=lambda: groq.AsyncGroq(api_key=os.environ.get('GROQ_API_KEY'), timeout=timeout, max_retries=0)
+    )
\ No newline at end of file
@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+class LRUCache:
+    """Thread-safe LRU cache with optional time-to-live eviction
+    
+    Entries are evicted once the cache holds more than ``max_size`` items
+    (least recently used first) or once they are older than ``ttl`` seconds.
+    ``on_evict(key, value)`` is called for every evicted entry, outside the
+    cache lock, so it may do I/O such as flushing the entry to disk.
+    """
+    
+    def __init__(self, max_size: int = 128, ttl: Optional[float] = None,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def _is_expired(self, expires_at: Optional[float], now: float) -> bool:
+        return expires_at is not None and expires_at <= now
+    
+    def _notify(self, evicted: List[Tuple[Hashable, Any]]):
+        """Run the eviction callback for evicted entries"""
+        if self.on_evict:
+            for key, value in evicted:
+                self.on_evict(key, value)
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value and mark it as recently used"""
+        evicted = []
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            
+            value, expires_at = entry
+            if self._is_expired(expires_at, time.monotonic()):
+                del self._data[key]
+                self.evictions += 1
+                self.misses += 1
+                evicted.append((key, value))
+                value = default
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+        
+        self._notify(evicted)
+        return value
+    
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value, restarting its time-to-live"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        
+        evicted = []
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                evicted.append(self._data.popitem(last=False))
+            evicted = [(k, v) for k, (v, _) in evicted]
+            self.evictions += len(evicted)
+        
+        self._notify(evicted)
+    
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value without touching recency, expiry or statistics"""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry[0] if entry is not None else default
+    
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove a value without calling the eviction callback"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[0] if entry is not None else default
+    
+    def expire(self) -> int:
+        """Evict every expired entry, returns how many were evicted"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (_, expires_at) in self._data.items() if self._is_expired(expires_at, now)]
+            evicted = [(key, self._data.pop(key)[0]) for key in expired]
+            self.evictions += len(evicted)
+        
+        self._notify(evicted)
+        return len(evicted)
+    
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """Snapshot of the cached entries, least recently used first"""
+        with self._lock:
+            return [(key, value) for key, (value, _) in self._data.items()]
+    
+    def clear(self):
+        """Drop every entry without calling the eviction callback"""
+        with self._lock:
+            self._data.clear()
+    
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def stats(self) -> Dict:
+        """Cache size and hit/miss/eviction counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
\ No newline at end of file
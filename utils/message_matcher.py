@@ -0,0 +1,120 @@
+import re
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+
+# (category, value, phrases) - every phrase also matches with a plural or
+# verb ending (tables, booking, ordered), and only on whole words, so "ny"
+# does not match "any" and "seat" does not match "seattle"
+VOCABULARY = [
+    ('intent', 'booking', ['book', 'table', 'reservation', 'reserve', 'seat']),
+    ('intent', 'search', ['restaurant', 'find', 'search', 'near', 'nearby', 'cuisine']),
+    ('intent', 'menu', ['menu', 'food', 'dish', 'eat', 'order', 'popular', 'recommend']),
+    ('intent', 'help', ['help', 'what can you do']),
+    ('cuisine', 'italian', ['italian']),
+    ('cuisine', 'chinese', ['chinese']),
+    ('cuisine', 'mexican', ['mexican']),
+    ('cuisine', 'indian', ['indian']),
+    ('cuisine', 'japanese', ['japanese']),
+    ('cuisine', 'american', ['american']),
+    ('cuisine', 'thai', ['thai']),
+    ('cuisine', 'pizza', ['pizza']),
+    ('cuisine', 'pasta', ['pasta']),
+    ('cuisine', 'burger', ['burger']),
+    ('location', 'new_york', ['new york', 'ny', 'nyc', 'manhattan', 'brooklyn']),
+    ('location', 'invalid', ['ahmedabad', 'mumbai', 'delhi', 'bangalore', 'chennai', 'kolkata', 'hyderabad', 'pune', 'india']),
+    ('service_type', 'delivery', ['delivery', 'order']),
+    ('service_type', 'reservation', ['reservation', 'book', 'table']),
+    ('time', 'tonight', ['tonight']),
+    ('time', 'today', ['today']),
+    ('time', 'tomorrow', ['tomorrow']),
+    ('time', 'breakfast', ['breakfast']),
+    ('time', 'lunch', ['lunch']),
+    ('time', 'dinner', ['dinner']),
+]
+
+class MessageMatcher:
+    """Extract intent, cuisine, location, service type, time and party size in one regex pass
+    
+    All phrases are compiled into a single word-bounded alternation, so a
+    message is scanned once however large the vocabulary is. Intents are
+    returned in the order they appear; handlers apply their own priority.
+    """
+    
+    def __init__(self, vocabulary: List[Tuple[str, str, List[str]]] = VOCABULARY):
+        self._terms = {}
+        for category, value, phrases in vocabulary:
+            for phrase in phrases:
+                self._terms.setdefault(phrase, []).append((category, value))
+        
+        # Longest phrases first, so "new york" wins over any shorter overlap
+        phrases = sorted(self._terms, key=len, reverse=True)
+        alternation = '|'.join(re.escape(phrase).replace(r'\ ', r'\s+') for phrase in phrases)
+        self._pattern = re.compile(
+            r"\b(?:"
+            r"(?P<count>\d+)\s*(?:people|persons?|guests|pax)"
+            # "for 7 pm" is a time, not a party of seven
+            r"|(?:party\s+of|for)\s+(?P<count_for>\d+)(?!(?::\d{2})?\s*[ap]m\b)"
+            r"|(?P<clock>\d{1,2}(?::\d{2})?\s*[ap]m)"
+            r"|(?P<term>" + alternation + r")(?:s|es|d|ed|ing)?"
+            r")\b"
+        )
+    
+    def match(self, message: str) -> Dict:
+        """Match a message against the vocabulary"""
+        result = {
+            'intents': [],
+            'cuisine': None,
+            'location': None,
+            'locations': set(),
+            'service_type': None,
+            'time': None,
+            'party_size': None
+        }
+        
+        # Lowercasing once is much cheaper than a case-insensitive pattern
+        for found in self._pattern.finditer(message.lower()):
+            count = found.group('count') or found.group('count_for')
+            if count:
+                if result['party_size'] is None:
+                    result['party_size'] = int(count)
+                continue
+            
+            clock = found.group('clock')
+            if clock:
+                result['time'] = result['time'] or re.sub(r'\s+', '', clock)
+                continue
+            
+            term = re.sub(r'\s+', ' ', found.group('term'))
+            for category, value in self._terms.get(term, []):
+                if category == 'intent':
+                    if value not in result['intents']:
+                        result['intents'].append(value)
+                elif category == 'location':
+                    result['locations'].add(value)
+                elif result[category] is None:
+                    result[category] = value
+        
+        # A served location wins when a message names several
+        if result['locations']:
+            result['location'] = 'new_york' if 'new_york' in result['locations'] else 'invalid'
+        
+        return result
+
+message_matcher = MessageMatcher()
+
+@lru_cache(maxsize=4096)
+def _match_cached(message: str) -> Mapping:
+    # Frozen, as the one cached result is handed to every caller
+    result = message_matcher.match(message)
+    result['intents'] = tuple(result['intents'])
+    result['locations'] = frozenset(result['locations'])
+    return MappingProxyType(result)
+
+def match_message(message: Optional[str]) -> Mapping:
+    """Match a message with the shared matcher
+    
+    Every turn re-reads the recent history, so results are memoized and
+    returned read-only: intents as a tuple, locations as a frozenset.
+    """
+    return _match_cached(message or '')
\ No newline at end of file
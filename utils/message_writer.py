@@ -0,0 +1,413 @@
+import atexit
+import glob
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock; spools of dead processes are then not recovered
+    fcntl = None
+
+# Messages storage keeps rejecting are set aside here, next to the spools
+DEAD_LETTER_FILE = 'dead-letter.jsonl'
+
+class MessageSpool:
+    """Append-only local journal of the messages a process has queued but not yet stored
+    
+    Each queued message is appended as one JSON line; once a batch is in
+    chat storage an ``{"ack": [ids]}`` line follows, and the file is
+    truncated whenever nothing is outstanding. Every writer has a spool of
+    its own and holds an flock on it for as long as it runs, so a spool
+    whose lock can be taken was left behind by a process that died, and its
+    unacknowledged messages can be replayed.
+    """
+    
+    def __init__(self, directory: str, name: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(directory, name)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(self.fd)
+                raise RuntimeError(f"Chat message spool {self.path} is already used by another writer")
+    
+    def append(self, records: List[Dict]):
+        os.write(self.fd, ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode('utf-8'))
+    
+    def ack(self, ids: List[str]):
+        self.append([{'ack': ids}])
+    
+    def truncate(self):
+        os.ftruncate(self.fd, 0)
+    
+    def dead_letter(self, records: List[Dict]):
+        """Set messages aside in the spool directory's dead-letter file"""
+        with open(os.path.join(self.directory, DEAD_LETTER_FILE), 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+    
+    def size(self) -> int:
+        return os.fstat(self.fd).st_size
+    
+    def close(self):
+        os.close(self.fd)
+    
+    @staticmethod
+    def read_pending(path: str) -> List[Dict]:
+        """Messages in a spool file that were never acknowledged, in the order they were queued"""
+        records = {}
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line of a crashed process
+                    if 'ack' in entry:
+                        for message_id in entry['ack']:
+                            records.pop(message_id, None)
+                    else:
+                        records[entry['id']] = entry
+        except FileNotFoundError:
+            return []
+        return list(records.values())
+    
+    @classmethod
+    def recover(cls, directory: str, own_path: str) -> List[Dict]:
+        """Take over the spools of processes that died, returning their unacknowledged messages"""
+        if fcntl is None:
+            return []
+        
+        pending = []
+        for path in sorted(glob.glob(os.path.join(directory, 'messages-*.jsonl'))):
+            if path == own_path:
+                continue
+            try:
+                fd = os.open(path, os.O_RDWR)
+            except FileNotFoundError:
+                continue
+            
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # Its owner is still running
+                # Another process may have recovered and removed it while we waited
+                if not os.path.exists(path) or os.stat(path).st_ino != os.fstat(fd).st_ino:
+                    continue
+                pending.extend(cls.read_pending(path))
+                os.remove(path)
+            finally:
+                os.close(fd)
+        return pending
+
+class MessageWriter:
+    """Background writer that saves queued chat messages to chat storage in batches
+    
+    ``enqueue`` only appends the message to this process's spool (a page
+    cache write, no fsync) and to an in-memory queue. A writer thread
+    hands the queue to ``storage.save_messages`` when ``batch_size``
+    messages are waiting or ``flush_interval`` seconds after the first one,
+    retrying with backoff while storage is unavailable. After
+    ``max_attempts`` failures the batch is saved in halves to find the
+    messages storage rejects, which go to the dead-letter file so they no
+    longer hold up the rest of the queue. Messages stay in
+    the spool until stored, so after a crash or an outage the next process
+    to start replays them; storage backends skip message ids they already
+    have. ``close`` (registered with atexit) writes out what is queued.
+    """
+    
+    def __init__(self, storage, spool_dir: Optional[str] = None, batch_size: int = 50,
+                 flush_interval: float = 0.2, max_retry_delay: float = 30, max_attempts: int = 5):
+        self.logger = logging.getLogger(__name__)
+        self.storage = storage
+        self.spool_dir = spool_dir or os.environ.get('CHAT_SPOOL_DIR', os.path.join('chat_history', 'spool'))
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._pending_users = {}
+        self._flush_waiters = 0
+        self._spool = None
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        
+        self.enqueued = 0
+        self.saved = 0
+        self.batches = 0
+        self.failures = 0
+        self.recovered = 0
+        self.dead_lettered = 0
+        atexit.register(self.close)
+    
+    def _ensure_started(self):
+        """Open this process's spool and start the writer thread (call with ``_cond`` held)"""
+        if self._pid == os.getpid():
+            return
+        
+        # A forked worker inherits the parent's spool descriptor and queue but not its thread
+        if self._spool is not None:
+            self._spool.close()
+        self._queue.clear()
+        self._pending_users.clear()
+        self._pid = os.getpid()
+        # Named per writer, so several storages in one process never share a spool
+        self._spool = MessageSpool(self.spool_dir, f"messages-{self._pid}-{uuid.uuid4().hex}.jsonl")
+        
+        recovered = MessageSpool.recover(self.spool_dir, self._spool.path)
+        if recovered:
+            self.logger.warning(f"Replaying {len(recovered)} chat messages left in the spool")
+            self.recovered += len(recovered)
+            self._add(recovered)
+        
+        self._thread = threading.Thread(target=self._run, name='chat-message-writer', daemon=True)
+        self._thread.start()
+    
+    def _add(self, messages: List[Dict]):
+        self._spool.append(messages)
+        self._queue.extend(messages)
+        for message in messages:
+            self._pending_users[message['user_email']] = self._pending_users.get(message['user_email'], 0) + 1
+        if len(self._queue) >= self.batch_size:
+            self._cond.notify_all()
+    
+    def enqueue(self, message: Dict):
+        """Queue a message (with ``id``, ``chat_session_id`` and ``user_email``) to be saved"""
+        with self._cond:
+            if self._closed:
+                # Shutting down, nobody is left to write it later
+                self.storage.save_messages([message])
+                return
+            
+            self._ensure_started()
+            self._add([message])
+            self.enqueued += 1
+            if len(self._queue) == 1:
+                self._cond.notify_all()
+    
+    def _next_batch(self) -> List[Dict]:
+        """Wait until a batch is due, an empty list once closed with nothing left"""
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._queue) < self.batch_size and not self._closed and not self._flush_waiters:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return list(itertools.islice(self._queue, self.batch_size))
+    
+    def _save_in_halves(self, batch: List[Dict], rejected: List[Dict]) -> int:
+        """Save a failing batch half by half, collecting the single messages storage rejects"""
+        saved = 0
+        for part in (batch[:len(batch) // 2], batch[len(batch) // 2:]):
+            if not part:
+                continue
+            try:
+                self.storage.save_messages(part)
+                saved += len(part)
+            except Exception as e:
+                if len(part) == 1:
+                    rejected.append(dict(part[0], error=str(e)))
+                else:
+                    saved += self._save_in_halves(part, rejected)
+        return saved
+    
+    def _run(self):
+        retry_delay = 0
+        attempts = 0
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            
+            rejected = []
+            try:
+                self.storage.save_messages(batch)
+                error = None
+            except Exception as e:
+                self.failures += 1
+                attempts += 1
+                error = e
+                if attempts >= self.max_attempts:
+                    attempts = 0
+                    # When no part of the batch can be saved storage is down rather than
+                    # rejecting a message, so the batch is retried as a whole
+                    if self._save_in_halves(batch, rejected):
+                        error = None
+            if error is not None:
+                retry_delay = min(max(retry_delay * 2, 0.5), self.max_retry_delay)
+                self.logger.error(f"Error saving {len(batch)} chat messages, retrying in {retry_delay:.1f}s: {error}")
+                retry_at = time.monotonic() + retry_delay
+                with self._cond:
+                    while not self._closed and time.monotonic() < retry_at:
+                        self._cond.wait(retry_at - time.monotonic())
+                    if self._closed:
+                        # Left in the spool for the next process to replay
+                        return
+                continue
+            retry_delay = 0
+            attempts = 0
+            
+            with self._cond:
+                if rejected:
+                    self._spool.dead_letter(rejected)
+                    self.dead_lettered += len(rejected)
+                    self.logger.error(f"Moved {len(rejected)} chat messages storage keeps rejecting to the dead-letter file: "
+                                      f"{', '.join(message['id'] for message in rejected)}")
+                for message in batch:
+                    self._queue.popleft()
+                    remaining = self._pending_users[message['user_email']] - 1
+                    if remaining:
+                        self._pending_users[message['user_email']] = remaining
+                    else:
+                        del self._pending_users[message['user_email']]
+                
+                if self._queue:
+                    self._spool.ack([message['id'] for message in batch])
+                else:
+                    self._spool.truncate()
+                self.saved += len(batch) - len(rejected)
+                self.batches += 1
+                self._cond.notify_all()
+    
+    def flush(self, user_email: Optional[str] = None, timeout: Optional[float] = None) -> bool:
+        """Wait until the queued messages (of one user, or all) are stored; False if ``timeout`` ran out"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            # Starting the writer replays whatever dead processes left in the spool
+            self._ensure_started()
+            self._flush_waiters += 1
+            self._cond.notify_all()
+            try:
+                while self._pending_users.get(user_email) if user_email is not None else self._queue:
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._flush_waiters -= 1
+        return True
+    
+    def close(self, timeout: float = 10):
+        """Write out what is queued and stop the writer thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread is not None:
+            thread.join(timeout)
+    
+    def stats(self) -> Dict:
+        """Queue depth, spool size and how many messages and batches were written"""
+        with self._cond:
+            return {
+                'queued': len(self._queue) if self._pid == os.getpid() else 0,
+                'spool_bytes': self._spool.size() if self._pid == os.getpid() else 0,
+                'enqueued': self.enqueued,
+                'saved': self.saved,
+                'batches': self.batches,
+                'failures': self.failures,
+                'recovered': self.recovered,
+                'dead_lettered': self.dead_lettered
+            }
+
+class WriteBehindChatStorage:
+    """Chat storage whose message saves are queued for a background MessageWriter
+    
+    ``save_message`` returns as soon as the message is queued, so a chat
+    turn never waits on disk or Supabase. Reading a user's chats first waits
+    (up to ``read_wait`` seconds) for that user's queued messages, so a
+    worker always sees its own writes; other workers see them once written,
+    as with the file backend's flusher. Everything else is passed through
+    to the wrapped storage.
+    """
+    
+    def __init__(self, storage, writer: Optional[MessageWriter] = None, read_wait: float = 2.0):
+        self.logger = logging.getLogger(__name__)
+        self.storage = storage
+        self.writer = writer or MessageWriter(storage)
+        self.read_wait = read_wait
+    
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+    
+    def _settle(self, user_email: str):
+        """Wait for a user's queued messages before reading their chats"""
+        if not self.writer.flush(user_email, timeout=self.read_wait):
+            self.logger.warning(f"Chat messages still queued after {self.read_wait}s, reading without them")
+    
+    def save_message(self, chat_session_id: str, user_email: str, message_type: str, content: str, message_data: Optional[Dict] = None) -> str:
+        """Queue a message for a chat session"""
+        message = {
+            'id': str(uuid.uuid4()),
+            'chat_session_id': chat_session_id,
+            'user_email': user_email,
+            'message_type': message_type,
+            'content': content,
+            'message_data': message_data or {},
+            'timestamp': datetime.now().isoformat()
+        }
+        self.writer.enqueue(message)
+        return message['id']
+    
+    def get_user_chat_sessions(self, user_email: str, *args, **kwargs):
+        self._settle(user_email)
+        return self.storage.get_user_chat_sessions(user_email, *args, **kwargs)
+    
+    def get_chat_messages(self, chat_session_id: str, user_email: str, *args, **kwargs):
+        self._settle(user_email)
+        return self.storage.get_chat_messages(chat_session_id, user_email, *args, **kwargs)
+    
+    def get_chat_messages_page(self, chat_session_id: str, user_email: str, *args, **kwargs):
+        self._settle(user_email)
+        return self.storage.get_chat_messages_page(chat_session_id, user_email, *args, **kwargs)
+    
+    def end_chat_session(self, chat_session_id: str, user_email: str) -> bool:
+        self._settle(user_email)
+        return self.storage.end_chat_session(chat_session_id, user_email)
+    
+    def delete_chat_session(self, chat_session_id: str, user_email: str) -> bool:
+        self._settle(user_email)
+        return self.storage.delete_chat_session(chat_session_id, user_email)
+    
+    def flush(self, user_email: Optional[str] = None):
+        """Write queued messages, then whatever the wrapped storage buffers"""
+        self.writer.flush(user_email, timeout=self.read_wait)
+        if hasattr(self.storage, 'flush'):
+            self.storage.flush(user_email)
+    
+    def close(self):
+        self.writer.close()
+        if hasattr(self.storage, 'close'):
+            self.storage.close()
+    
+    def write_stats(self) -> Dict:
+        return self.writer.stats()
+
+def create_message_writer(storage):
+    """Create the message writer configured by the ``CHAT_WRITE_*`` environment variables"""
+    return MessageWriter(
+        storage,
+        batch_size=int(os.environ.get('CHAT_WRITE_BATCH_SIZE', 50)),
+        flush_interval=float(os.environ.get('CHAT_WRITE_INTERVAL', 0.2)),
+        max_retry_delay=float(os.environ.get('CHAT_WRITE_MAX_RETRY_DELAY', 30)),
+        max_attempts=int(os.environ.get('CHAT_WRITE_MAX_ATTEMPTS', 5))
+    )
\ No newline at end of file
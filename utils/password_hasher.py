@@ -0,0 +1,166 @@
+import hmac
+import os
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Optional, Tuple
+from werkzeug.security import generate_password_hash, check_password_hash
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many hashes are already waiting for the pool"""
+
+class PasswordHasher:
+    """PBKDF2-SHA256 password hashing with a calibrated cost, run on a small pool
+    
+    The iteration count is calibrated at startup so one hash takes about
+    ``target_ms`` on this machine (never fewer than ``min_iterations``).
+    Hashing runs on ``workers`` threads - hashlib releases the GIL while it
+    works - so a burst of logins uses at most that many cores and chat
+    requests keep running. At most ``max_pending`` hashes wait for a thread;
+    a hash that finds the queue full, or waits longer than ``timeout``
+    seconds, gets PasswordHasherBusy.
+    
+    ``verify`` also accepts the plaintext passwords stored by older versions
+    and returns a new hash whenever the stored one is plaintext or notably
+    cheaper than the current cost, so accounts are upgraded as users log in.
+    """
+    
+    METHOD = 'pbkdf2:sha256'
+    # Stored hashes within this fraction of the current cost are kept, so
+    # workers whose calibrations differ slightly do not keep rehashing
+    UPGRADE_TOLERANCE = 0.75
+    
+    def __init__(self, iterations: Optional[int] = None, target_ms: float = 50, min_iterations: int = 100000,
+                 workers: int = 2, max_pending: int = 32, timeout: float = 5):
+        self.logger = logging.getLogger(__name__)
+        self.target_ms = target_ms
+        self.min_iterations = min_iterations
+        self.iterations = iterations or self.calibrate(target_ms, min_iterations)
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._lock = threading.Lock()
+        self._durations = deque(maxlen=500)
+        # Passwords of unknown accounts are checked against this, so those
+        # logins take as long as real ones and do not reveal who is registered
+        self.dummy_hash = generate_password_hash(os.urandom(16).hex(), f"{self.METHOD}:{self.iterations}")
+        self.hashed = 0
+        self.verified = 0
+        self.upgraded = 0
+        self.rejected = 0
+    
+    @classmethod
+    def calibrate(cls, target_ms: float, min_iterations: int = 100000, sample_iterations: int = 20000) -> int:
+        """Iterations for one hash to take about ``target_ms`` here, rounded to 10,000"""
+        best = min(cls._time_hash(sample_iterations) for _ in range(3))
+        iterations = int(sample_iterations * target_ms / 1000 / best)
+        iterations = max(min_iterations, round(iterations, -4))
+        logging.getLogger(__name__).info(f"Password hashing calibrated to {iterations} iterations (~{target_ms:.0f}ms)")
+        return iterations
+    
+    @classmethod
+    def _time_hash(cls, iterations: int) -> float:
+        started = time.perf_counter()
+        generate_password_hash('calibration', method=f"{cls.METHOD}:{iterations}")
+        return time.perf_counter() - started
+    
+    def _run(self, fn, *args):
+        """Run ``fn`` on the hashing pool, waiting at most ``timeout`` seconds"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHasherBusy("Too many password hashes in progress")
+        
+        started = time.perf_counter()
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # A hash already running cannot be cancelled, so its slot is only freed once it finishes
+        future.add_done_callback(lambda _: self._slots.release())
+        
+        try:
+            return future.result(timeout=max(self.timeout - (time.perf_counter() - started), 0))
+        except FutureTimeoutError:
+            future.cancel()
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHasherBusy("Timed out waiting for password hashing")
+        finally:
+            with self._lock:
+                self._durations.append(time.perf_counter() - started)
+    
+    def hash(self, password: str) -> str:
+        """Hash a password at the current cost"""
+        hashed = self._run(generate_password_hash, password, f"{self.METHOD}:{self.iterations}")
+        with self._lock:
+            self.hashed += 1
+        return hashed
+    
+    def is_hash(self, stored: str) -> bool:
+        return stored.count('$') == 2 and stored.split('$', 1)[0].startswith(('pbkdf2:', 'scrypt:'))
+    
+    def needs_rehash(self, stored: str) -> bool:
+        """Whether a stored password is plaintext or hashed more cheaply than the current cost"""
+        if not self.is_hash(stored):
+            return True
+        method = stored.split('$', 1)[0]
+        if not method.startswith(self.METHOD + ':'):
+            return True
+        try:
+            iterations = int(method.rsplit(':', 1)[1])
+        except ValueError:
+            return True
+        return iterations < self.iterations * self.UPGRADE_TOLERANCE
+    
+    def verify(self, stored: str, password: str) -> Tuple[bool, Optional[str]]:
+        """Check a password against what is stored; returns (ok, new hash to store or None)"""
+        if self.is_hash(stored):
+            ok = self._run(check_password_hash, stored, password)
+        else:
+            # Account from before passwords were hashed
+            ok = hmac.compare_digest(stored.encode(), password.encode())
+        with self._lock:
+            self.verified += 1
+        
+        if not ok or not self.needs_rehash(stored):
+            return ok, None
+        try:
+            new_hash = self.hash(password)
+        except PasswordHasherBusy:
+            # The password was right; the account is upgraded on a quieter login instead
+            return True, None
+        with self._lock:
+            self.upgraded += 1
+        return True, new_hash
+    
+    def stats(self) -> Dict:
+        """Cost, counts and time spent per hash including the wait for the pool"""
+        with self._lock:
+            durations = sorted(self._durations)
+            stats = {
+                'iterations': self.iterations,
+                'hashed': self.hashed,
+                'verified': self.verified,
+                'upgraded': self.upgraded,
+                'rejected': self.rejected
+            }
+        stats.update({
+            'p50_ms': round(durations[len(durations) // 2] * 1000, 1) if durations else None,
+            'p99_ms': round(durations[min(int(len(durations) * 0.99), len(durations) - 1)] * 1000, 1) if durations else None
+        })
+        return stats
+
+def create_password_hasher():
+    """Create the password hasher configured by the ``PASSWORD_HASH_*`` environment variables"""
+    return PasswordHasher(
+        iterations=int(os.environ.get('PASSWORD_HASH_ITERATIONS', 0)) or None,
+        target_ms=float(os.environ.get('PASSWORD_HASH_TARGET_MS', 50)),
+        min_iterations=int(os.environ.get('PASSWORD_HASH_MIN_ITERATIONS', 100000)),
+        workers=int(os.environ.get('PASSWORD_HASH_WORKERS', 2)),
+        max_pending=int(os.environ.get('PASSWORD_HASH_QUEUE', 32)),
+        timeout=float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
+    )
\ No newline at end of file
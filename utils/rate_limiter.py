@@ -0,0 +1,222 @@
+import heapq
+import itertools
+import os
+import struct
+import threading
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+from .file_locks import file_lock
+
+# Interactive chat turns are served before background work (e.g. hedged
+# duplicate requests) when both wait for budget
+INTERACTIVE = 0
+BACKGROUND = 1
+
+class RateLimitExceeded(Exception):
+    """Raised when a call cannot get budget in time or the wait queue is full"""
+
+# Bucket levels (requests, tokens), when they were last refilled and until
+# when the provider asked us to pause, all wall-clock so processes agree
+BucketState = Tuple[List[float], float, float]
+
+def refill_and_take(state: BucketState, capacity: Tuple[float, float], amounts: Tuple[float, float], now: float):
+    """Refill both buckets up to ``now`` and take ``amounts`` if they are there
+    
+    Returns the new state and how many seconds to wait before the amounts
+    will be available (0 when they were taken). A bucket with capacity 0 is
+    unlimited.
+    """
+    levels, updated, paused_until = state
+    elapsed = max(now - updated, 0)
+    levels = [min(cap, level + cap / 60 * elapsed) if cap else 0 for cap, level in zip(capacity, levels)]
+    
+    if now < paused_until:
+        return (levels, now, paused_until), paused_until - now
+    
+    wait = 0.0
+    for cap, level, amount in zip(capacity, levels, amounts):
+        amount = min(amount, cap)  # A call bigger than the bucket waits for a full one
+        if cap and level < amount:
+            wait = max(wait, (amount - level) / (cap / 60))
+    if wait == 0:
+        levels = [level - min(amount, cap) if cap else 0 for cap, level, amount in zip(capacity, levels, amounts)]
+    return (levels, now, paused_until), wait
+
+class LocalBucketStore:
+    """Bucket state for this process only"""
+    
+    def __init__(self, capacity: Tuple[float, float]):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._state = (list(capacity), time.time(), 0.0)
+    
+    def take(self, amounts: Tuple[float, float]) -> float:
+        with self._lock:
+            self._state, wait = refill_and_take(self._state, self.capacity, amounts, time.time())
+            return wait
+    
+    def pause(self, until: float):
+        with self._lock:
+            levels, updated, paused_until = self._state
+            self._state = (levels, updated, max(paused_until, until))
+
+class SharedBucketStore:
+    """Bucket state in a small file shared by every worker process on the host
+    
+    The file holds the bucket levels as packed doubles and is read and
+    rewritten under an exclusive ``file_lock``, so all gunicorn workers draw
+    from one budget.
+    """
+    
+    STATE = struct.Struct('<5d')
+    
+    def __init__(self, capacity: Tuple[float, float], path: str):
+        self.capacity = capacity
+        self.path = path
+        self.lock_path = path + '.lock'
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    
+    def _update(self, apply):
+        with file_lock(self.lock_path):
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                data = os.pread(fd, self.STATE.size, 0)
+                if len(data) == self.STATE.size:
+                    requests, tokens, updated, paused_until, _ = self.STATE.unpack(data)
+                    state = ([requests, tokens], updated, paused_until)
+                else:
+                    state = (list(self.capacity), time.time(), 0.0)
+                (levels, updated, paused_until), result = apply(state)
+                os.pwrite(fd, self.STATE.pack(levels[0], levels[1], updated, paused_until, 0.0), 0)
+                return result
+            finally:
+                os.close(fd)
+    
+    def take(self, amounts: Tuple[float, float]) -> float:
+        return self._update(lambda state: refill_and_take(state, self.capacity, amounts, time.time()))
+    
+    def pause(self, until: float):
+        self._update(lambda state: ((state[0], state[1], max(state[2], until)), None))
+
+class RateLimiter:
+    """Requests/min and tokens/min budgets plus a concurrency cap for outbound calls
+    
+    Callers wait in a bounded priority queue; only the head of the queue
+    draws from the buckets, so interactive calls go first and nobody is
+    starved by a stream of smaller calls. A call that cannot get budget
+    within its timeout, or finds the queue full, gets RateLimitExceeded at
+    once instead of piling up behind the provider's own 429s.
+    """
+    
+    def __init__(self, requests_per_minute: float = 30, tokens_per_minute: float = 6000, max_concurrent: int = 8,
+                 max_queue: int = 64, max_wait: float = 5, shared_path: Optional[str] = None):
+        self.logger = logging.getLogger(__name__)
+        capacity = (requests_per_minute, tokens_per_minute)
+        self.store = SharedBucketStore(capacity, shared_path) if shared_path else LocalBucketStore(capacity)
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._waits = deque(maxlen=500)
+        self.max_queue_depth = 0
+        self.acquired = 0
+        self.rejected = 0
+    
+    def acquire(self, tokens: int, priority: int = INTERACTIVE, timeout: Optional[float] = None):
+        """Wait for one request and ``tokens`` tokens of budget and a concurrency slot"""
+        timeout = self.max_wait if timeout is None else min(timeout, self.max_wait)
+        started = time.monotonic()
+        deadline = started + timeout
+        
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self.rejected += 1
+                raise RateLimitExceeded(f"LLM call queue is full ({self.max_queue} waiting)")
+            
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._queue, entry)
+            self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    wait = None
+                    if self._queue[0] == entry and self._in_flight < self.max_concurrent:
+                        wait = self.store.take((1, tokens))
+                        if wait == 0:
+                            break
+                        if wait > remaining:
+                            # Budget will not be back in time, fail now instead of at the deadline
+                            raise RateLimitExceeded(f"LLM budget exhausted, next slot in {wait:.1f}s")
+                    if remaining <= 0:
+                        raise RateLimitExceeded(f"Waited {timeout:.1f}s for an LLM call slot")
+                    self._cond.wait(remaining if wait is None else min(wait, remaining))
+            except BaseException:
+                self.rejected += 1
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+                raise
+            
+            heapq.heappop(self._queue)
+            self._in_flight += 1
+            self.acquired += 1
+            self._waits.append(time.monotonic() - started)
+            self._cond.notify_all()
+    
+    def release(self):
+        """Give back the concurrency slot taken by ``acquire``"""
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+    
+    @contextmanager
+    def limit(self, tokens: int, priority: int = INTERACTIVE, timeout: Optional[float] = None):
+        """Hold budget and a concurrency slot for the duration of the block"""
+        self.acquire(tokens, priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+    
+    def pause(self, seconds: float):
+        """Stop handing out budget for a while, e.g. when the provider answers 429"""
+        self.store.pause(time.time() + seconds)
+        with self._cond:
+            self._cond.notify_all()
+    
+    def stats(self) -> Dict:
+        """Queue depth, in-flight calls and wait times"""
+        with self._cond:
+            waits = sorted(self._waits)
+            stats = {
+                'queue_depth': len(self._queue),
+                'max_queue_depth': self.max_queue_depth,
+                'in_flight': self._in_flight,
+                'acquired': self.acquired,
+                'rejected': self.rejected
+            }
+        stats.update({
+            'wait_p50_ms': round(waits[len(waits) // 2] * 1000, 1) if waits else None,
+            'wait_p95_ms': round(waits[min(int(len(waits) * 0.95), len(waits) - 1)] * 1000, 1) if waits else None,
+            'wait_max_ms': round(waits[-1] * 1000, 1) if waits else None
+        })
+        return stats
+
+def create_rate_limiter():
+    """Create the LLM rate limiter configured by the ``LLM_RATE_*`` environment variables"""
+    return RateLimiter(
+        requests_per_minute=float(os.environ.get('LLM_RATE_RPM', 30)),
+        tokens_per_minute=float(os.environ.get('LLM_RATE_TPM', 6000)),
+        max_concurrent=int(os.environ.get('LLM_MAX_CONCURRENT', 8)),
+        max_queue=int(os.environ.get('LLM_QUEUE_SIZE', 64)),
+        max_wait=float(os.environ.get('LLM_QUEUE_MAX_WAIT', 5)),
+        shared_path=os.environ.get('LLM_RATE_SHARED_PATH') or None
+    )
\ No newline at end of file
@@ -1,59 +1,755 @@
+import atexit
 import json
 import os
+import struct
+import threading
 import uuid
 import logging
+from contextlib import contextmanager
 from datetime import datetime
 from typing import List, Dict, Optional
+from .file_locks import atomic_write, atomic_write_json, file_lock
+from .lru_cache import LRUCache
+
+def format_relative_time(time_diff) -> str:
+    """Format a time difference for display, e.g. 3 hours ago"""
+    if time_diff.days > 0:
+        if time_diff.days == 1:
+            return "1 day ago"
+        return f"{time_diff.days} days ago"
+    elif time_diff.seconds > 3600:
+        hours = time_diff.seconds // 3600
+        if hours == 1:
+            return "1 hour ago"
+        return f"{hours} hours ago"
+    elif time_diff.seconds > 60:
+        minutes = time_diff.seconds // 60
+        if minutes == 1:
+            return "1 minute ago"
+        return f"{minutes} minutes ago"
+    return "Just now"
 
 class SimpleChatStorage:
-    """Simple file-based chat storage system"""
+    """Simple file-based chat storage system
+    
+    Each user gets a directory under ``chat_history/`` holding one
+    append-only ``<chat_id>.jsonl`` message log per chat session plus a
+    small ``<chat_id>.meta.json`` record with the session metadata. Saving a
+    message appends a single line and rewrites only the metadata record, so
+    the cost of a write does not grow with the user's history.
+    
+    Next to each log, ``<chat_id>.idx`` holds the byte offset of every
+    message (8 bytes each), so a page of the latest messages, or of the
+    messages before a cursor, is read by seeking straight to it.
+    
+    A per-user ``index.jsonl`` keeps a compact summary of every session (id,
+    title, last activity, message count, status). Every change appends the
+    session's new summary, so listing sessions never touches message bodies.
+    
+    Users still on the legacy single-file layout
+    (``<user>_chats.json``) are migrated the first time they are accessed.
     
-    def __init__(self):
+    Hot users are kept in a bounded in-memory LRU cache (``CHAT_CACHE_SIZE``
+    users, each for at most ``CHAT_CACHE_TTL`` seconds). Message writes are
+    applied to the cached document and flushed to disk by a background
+    thread every ``CHAT_FLUSH_INTERVAL`` seconds, on eviction and at
+    shutdown, so a burst of messages costs one write per session. Set
+    ``CHAT_FLUSH_INTERVAL=0`` to write through synchronously.
+    
+    The layout is safe to share between processes (e.g. gunicorn workers):
+    every disk write happens under an exclusive per-user advisory lock,
+    disk reads under a shared one, and metadata/index rewrites go through a
+    temp file plus rename. Flushes merge message counts with what is on disk
+    instead of overwriting it, and a cached document is reloaded as soon as
+    another process has changed the user's index. Writes deferred by the
+    write-behind flusher only become visible to other workers once flushed.
+    """
+    
+    LOG_SUFFIX = '.jsonl'
+    META_SUFFIX = '.meta.json'
+    OFFSETS_SUFFIX = '.idx'
+    OFFSET = struct.Struct('<Q')
+    INDEX_FILE = 'index.jsonl'
+    LOCK_FILE = '.lock'
+    # Rewrite the index once it holds this many times more lines than sessions
+    INDEX_COMPACT_RATIO = 4
+    
+    def __init__(self, cache_size: Optional[int] = None, cache_ttl: Optional[float] = None, flush_interval: Optional[float] = None, chat_dir: str = "chat_history"):
         self.logger = logging.getLogger(__name__)
-        self.chat_dir = "chat_history"
+        self.chat_dir = chat_dir
+        self._migrated_users = set()
         self.ensure_directory()
+        
+        # In-memory documents of hot users, flushed when evicted
+        self.cache_size = cache_size if cache_size is not None else int(os.environ.get('CHAT_CACHE_SIZE', 256))
+        self.cache_ttl = cache_ttl if cache_ttl is not None else float(os.environ.get('CHAT_CACHE_TTL', 300))
+        self.flush_interval = flush_interval if flush_interval is not None else float(os.environ.get('CHAT_FLUSH_INTERVAL', 1.0))
+        self._lock = threading.RLock()
+        self._documents = LRUCache(max_size=self.cache_size, ttl=self.cache_ttl, on_evict=self._flush_quietly)
+        
+        # Background write-behind flusher, started on the first deferred write
+        self._flush_event = threading.Event()
+        self._flusher = None
+        self._flusher_pid = None
+        self._closed = False
+        atexit.register(self.close)
     
     def ensure_directory(self):
         """Create chat history directory if it doesn't exist"""
         if not os.path.exists(self.chat_dir):
             os.makedirs(self.chat_dir)
     
+    def _safe_email(self, user_email: str) -> str:
+        """Turn an email address into a filesystem-safe name"""
+        return user_email.replace('@', '_at_').replace('.', '_dot_')
+    
     def get_user_file_path(self, user_email: str) -> str:
-        """Get the file path for a user's chat history"""
-        safe_email = user_email.replace('@', '_at_').replace('.', '_dot_')
-        return os.path.join(self.chat_dir, f"{safe_email}_chats.json")
+        """Get the file path for a user's legacy single-file chat history"""
+        return os.path.join(self.chat_dir, f"{self._safe_email(user_email)}_chats.json")
     
-    def load_user_chats(self, user_email: str) -> Dict:
-        """Load all chats for a user"""
-        file_path = self.get_user_file_path(user_email)
+    def get_user_dir(self, user_email: str) -> str:
+        """Get the directory holding a user's per-session chat logs"""
+        return os.path.join(self.chat_dir, self._safe_email(user_email))
+    
+    def get_session_log_path(self, user_email: str, chat_session_id: str) -> str:
+        """Get the append-only message log path for a chat session"""
+        return os.path.join(self.get_user_dir(user_email), f"{chat_session_id}{self.LOG_SUFFIX}")
+    
+    def get_session_meta_path(self, user_email: str, chat_session_id: str) -> str:
+        """Get the metadata record path for a chat session"""
+        return os.path.join(self.get_user_dir(user_email), f"{chat_session_id}{self.META_SUFFIX}")
+    
+    def get_session_offsets_path(self, user_email: str, chat_session_id: str) -> str:
+        """Get the message offset index path for a chat session"""
+        return os.path.join(self.get_user_dir(user_email), f"{chat_session_id}{self.OFFSETS_SUFFIX}")
+    
+    def get_index_path(self, user_email: str) -> str:
+        """Get the session index path for a user"""
+        return os.path.join(self.get_user_dir(user_email), self.INDEX_FILE)
+    
+    def _user_lock(self, user_email: str, shared: bool = False):
+        """Advisory lock guarding a user's files across threads and processes"""
+        user_dir = self.get_user_dir(user_email)
+        os.makedirs(user_dir, exist_ok=True)
+        return file_lock(os.path.join(user_dir, self.LOCK_FILE), shared=shared)
+    
+    def _index_signature(self, user_email: str):
+        """Identify the current version of a user's index file"""
+        try:
+            stat = os.stat(self.get_index_path(user_email))
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    
+    def _prepare_user(self, user_email: str) -> str:
+        """Make sure the user's directory exists and legacy data is migrated"""
+        if user_email not in self._migrated_users:
+            os.makedirs(self.get_user_dir(user_email), exist_ok=True)
+            self.migrate_user_chats(user_email)
+            self._migrated_users.add(user_email)
+        return self.get_user_dir(user_email)
+    
+    def migrate_user_chats(self, user_email: str) -> bool:
+        """Migrate a user's legacy ``<user>_chats.json`` file to per-session logs
+        
+        The legacy file is renamed to ``<user>_chats.json.migrated`` afterwards
+        so the migration runs only once and the original data is kept around.
+        Returns True if a legacy file was migrated.
+        """
+        legacy_path = self.get_user_file_path(user_email)
+        if not os.path.exists(legacy_path):
+            return False
+        
+        with self._user_lock(user_email):
+            # Another worker may have migrated it while we waited for the lock
+            if not os.path.exists(legacy_path):
+                return False
+            
+            try:
+                with open(legacy_path, 'r', encoding='utf-8') as f:
+                    legacy_data = json.load(f)
+            except (json.JSONDecodeError, IOError) as e:
+                self.logger.error(f"Error reading legacy chats for {user_email}: {e}")
+                return False
+            
+            try:
+                self._write_user_document(user_email, legacy_data)
+            except IOError as e:
+                self.logger.error(f"Error migrating chats for {user_email}, keeping the legacy file: {e}")
+                return False
+            os.replace(legacy_path, legacy_path + '.migrated')
+        self._documents.pop(user_email)
         
-        if not os.path.exists(file_path):
-            return {"user_email": user_email, "chats": []}
+        self.logger.info(f"Migrated {len(legacy_data.get('chats', []))} chats for user {user_email}")
+        return True
+    
+    def migrate_all(self) -> int:
+        """Migrate every legacy chat file in the chat directory, returns the count"""
+        migrated = 0
+        for file_name in os.listdir(self.chat_dir):
+            if not file_name.endswith('_chats.json'):
+                continue
+            try:
+                with open(os.path.join(self.chat_dir, file_name), 'r', encoding='utf-8') as f:
+                    user_email = json.load(f).get('user_email')
+            except (json.JSONDecodeError, IOError) as e:
+                self.logger.error(f"Error reading legacy chat file {file_name}: {e}")
+                continue
+            if user_email and self.migrate_user_chats(user_email):
+                self._migrated_users.add(user_email)
+                migrated += 1
+        return migrated
+    
+    def _read_meta(self, user_email: str, chat_session_id: str) -> Optional[Dict]:
+        """Read the metadata record for a chat session
+        
+        Metadata records are only ever replaced atomically, so this needs no lock.
+        """
+        meta_path = self.get_session_meta_path(user_email, chat_session_id)
+        if not os.path.exists(meta_path):
+            return None
         
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
+            with open(meta_path, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except (json.JSONDecodeError, IOError) as e:
-            self.logger.error(f"Error loading user chats: {e}")
-            return {"user_email": user_email, "chats": []}
+            self.logger.error(f"Error loading chat metadata: {e}")
+            return None
     
-    def save_user_chats(self, user_email: str, chat_data: Dict):
-        """Save all chats for a user"""
-        file_path = self.get_user_file_path(user_email)
+    def _write_meta(self, user_email: str, meta: Dict, update_index: bool = True):
+        """Write the metadata record for a chat session and update the index, raising IOError on failure"""
+        meta_path = self.get_session_meta_path(user_email, meta['id'])
+        
+        try:
+            atomic_write_json(meta_path, meta)
+        except IOError as e:
+            self.logger.error(f"Error saving chat metadata: {e}")
+            raise
+        
+        if update_index:
+            self._append_index(user_email, [self._index_entry(meta)])
+    
+    def _index_entry(self, meta: Dict) -> Dict:
+        """Build the compact index summary of a chat session"""
+        last_activity_dt = datetime.fromisoformat(meta['last_activity'])
+        return {
+            'id': meta['id'],
+            'title': meta.get('session_title'),
+            'last_activity': meta['last_activity'],
+            'message_count': meta.get('message_count', 0),
+            'status': meta.get('status', 'active'),
+            # Display strings only change with last_activity, so format them once here
+            'formatted_date': last_activity_dt.strftime("%B %d, %Y"),
+            'formatted_time': last_activity_dt.strftime("%I:%M %p")
+        }
+    
+    def _append_index(self, user_email: str, entries: List[Dict]):
+        """Append session summaries (or deletion tombstones) to the user's index"""
+        if not entries:
+            return
+        
+        index_path = self.get_index_path(user_email)
+        lines = ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries)
+        
+        try:
+            with open(index_path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+        except IOError as e:
+            self.logger.error(f"Error updating chat index: {e}")
+    
+    def _read_index(self, user_email: str):
+        """Read the user's index, the latest line for each session wins
+        
+        Returns the sessions and the number of lines read, or ``(None, 0)`` if
+        the index doesn't exist. Callers must hold the user lock.
+        """
+        index_path = self.get_index_path(user_email)
+        sessions = {}
+        line_count = 0
+        
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    line_count += 1
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        self.logger.warning(f"Skipping corrupt line in {index_path}")
+                        continue
+                    if entry.get('deleted'):
+                        sessions.pop(entry['id'], None)
+                    else:
+                        sessions[entry['id']] = entry
+        except FileNotFoundError:
+            return None, 0
+        except IOError as e:
+            self.logger.error(f"Error loading chat index: {e}")
+            return {}, 0
+        
+        return sessions, line_count
+    
+    def _load_index(self, user_email: str):
+        """Load a user's index under a shared lock, rebuilding or compacting it if needed
+        
+        Returns the sessions and the signature of the index they were read from.
+        """
+        with self._user_lock(user_email, shared=True):
+            sessions, line_count = self._read_index(user_email)
+            signature = self._index_signature(user_email)
+        
+        needs_compaction = sessions is not None and line_count > self.INDEX_COMPACT_RATIO * max(len(sessions), 1)
+        if sessions is None or needs_compaction:
+            with self._user_lock(user_email):
+                sessions, line_count = self._read_index(user_email)
+                if sessions is None:
+                    sessions = self._rebuild_index_locked(user_email)
+                elif line_count > self.INDEX_COMPACT_RATIO * max(len(sessions), 1):
+                    self._write_index(user_email, sessions)
+                signature = self._index_signature(user_email)
+        
+        return sessions, signature
+    
+    def _write_index(self, user_email: str, sessions: Dict[str, Dict]):
+        """Rewrite the user's index with one line per live session"""
+        lines = ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in sessions.values())
+        
+        try:
+            atomic_write(self.get_index_path(user_email), lines)
+        except IOError as e:
+            self.logger.error(f"Error compacting chat index: {e}")
+    
+    def rebuild_index(self, user_email: str) -> Dict[str, Dict]:
+        """Rebuild a user's index from the per-session metadata records"""
+        with self._user_lock(user_email):
+            sessions = self._rebuild_index_locked(user_email)
+        self._documents.pop(user_email)
+        return sessions
+    
+    def _rebuild_index_locked(self, user_email: str) -> Dict[str, Dict]:
+        """Rebuild a user's index, callers must hold the exclusive user lock"""
+        sessions = {}
+        for chat_id in self._list_session_ids(user_email):
+            meta = self._read_meta(user_email, chat_id)
+            if meta is not None:
+                sessions[meta['id']] = self._index_entry(meta)
+        
+        self._write_index(user_email, sessions)
+        return sessions
+    
+    def _append_messages(self, user_email: str, chat_session_id: str, messages: List[Dict]):
+        """Append messages to a chat session's log, one JSON document per line
+        
+        Their offsets are appended to the offset index first, so an append
+        interrupted half-way leaves offsets pointing past the end of the log,
+        which readers detect and repair. A failed append is cut back off both
+        files and IOError is raised. Callers must hold the exclusive user lock.
+        """
+        if not messages:
+            return
+        
+        log_path = self.get_session_log_path(user_email, chat_session_id)
+        offsets_path = self.get_session_offsets_path(user_email, chat_session_id)
+        lines = [(json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8') for message in messages]
+        log_start = offsets_start = None
+        
+        try:
+            if not self._offsets_valid(user_email, chat_session_id):
+                self._rebuild_offsets(user_email, chat_session_id)
+            log_size = log_start = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+            offsets_start = os.path.getsize(offsets_path) if os.path.exists(offsets_path) else 0
+            
+            offsets = []
+            for line in lines:
+                offsets.append(self.OFFSET.pack(log_size))
+                log_size += len(line)
+            
+            with open(offsets_path, 'ab') as f:
+                f.write(b''.join(offsets))
+            with open(log_path, 'ab') as f:
+                f.write(b''.join(lines))
+        except IOError as e:
+            self.logger.error(f"Error appending chat messages: {e}")
+            # Leave no torn line or dangling offsets behind for the retry to append after
+            for path, size in ((log_path, log_start), (offsets_path, offsets_start)):
+                if size is not None and os.path.exists(path):
+                    try:
+                        os.truncate(path, size)
+                    except OSError:
+                        pass
+            raise
+    
+    def _offsets_valid(self, user_email: str, chat_session_id: str) -> bool:
+        """Check the offset index covers the log and points nowhere past its end"""
+        log_path = self.get_session_log_path(user_email, chat_session_id)
+        offsets_path = self.get_session_offsets_path(user_email, chat_session_id)
+        
+        log_size = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+        if not os.path.exists(offsets_path):
+            return log_size == 0
+        
+        offsets_size = os.path.getsize(offsets_path)
+        if offsets_size % self.OFFSET.size or (offsets_size == 0) != (log_size == 0):
+            return False
+        if offsets_size == 0:
+            return True
+        
+        with open(offsets_path, 'rb') as f:
+            f.seek(offsets_size - self.OFFSET.size)
+            return self.OFFSET.unpack(f.read(self.OFFSET.size))[0] < log_size
+    
+    def _rebuild_offsets(self, user_email: str, chat_session_id: str):
+        """Rebuild a session's offset index by scanning its log once
+        
+        Callers must hold the exclusive user lock.
+        """
+        log_path = self.get_session_log_path(user_email, chat_session_id)
+        offsets = []
+        position = 0
+        if os.path.exists(log_path):
+            with open(log_path, 'rb') as f:
+                for line in f:
+                    if line.strip():
+                        offsets.append(self.OFFSET.pack(position))
+                    position += len(line)
+        
+        atomic_write(self.get_session_offsets_path(user_email, chat_session_id), b''.join(offsets))
+    
+    def _count_messages_on_disk(self, user_email: str, chat_session_id: str) -> int:
+        """Count a session's flushed messages from its offset index, repairing the index if needed"""
+        with self._user_lock(user_email, shared=True):
+            valid = self._offsets_valid(user_email, chat_session_id)
+        
+        if not valid:
+            with self._user_lock(user_email):
+                if not self._offsets_valid(user_email, chat_session_id):
+                    self._rebuild_offsets(user_email, chat_session_id)
+        
+        offsets_path = self.get_session_offsets_path(user_email, chat_session_id)
+        if not os.path.exists(offsets_path):
+            return 0
+        return os.path.getsize(offsets_path) // self.OFFSET.size
+    
+    def _read_message_range(self, user_email: str, chat_session_id: str, start: int, end: int) -> List[Dict]:
+        """Read the flushed messages at positions ``start`` to ``end`` (exclusive) via the offset index"""
+        if end <= start:
+            return []
         
+        log_path = self.get_session_log_path(user_email, chat_session_id)
+        offsets_path = self.get_session_offsets_path(user_email, chat_session_id)
+        
+        messages = []
+        with self._user_lock(user_email, shared=True):
+            try:
+                with open(offsets_path, 'rb') as f:
+                    f.seek(start * self.OFFSET.size)
+                    raw = f.read((end - start + 1) * self.OFFSET.size)
+                offsets = [self.OFFSET.unpack_from(raw, i)[0] for i in range(0, len(raw) - len(raw) % self.OFFSET.size, self.OFFSET.size)]
+                
+                with open(log_path, 'rb') as f:
+                    f.seek(offsets[0])
+                    # The offset after the range marks where to stop, else read to the end
+                    data = f.read(offsets[end - start] - offsets[0]) if len(offsets) > end - start else f.read()
+            except (IOError, IndexError) as e:
+                self.logger.error(f"Error loading chat messages: {e}")
+                return []
+        
+        for line in data.splitlines()[:end - start]:
+            if not line.strip():
+                continue
+            try:
+                messages.append(json.loads(line))
+            except json.JSONDecodeError:
+                self.logger.warning(f"Skipping corrupt line in {log_path}")
+        
+        return messages
+    
+    def _read_messages(self, user_email: str, chat_session_id: str) -> List[Dict]:
+        """Read every message from a chat session's log, callers must hold the user lock"""
+        log_path = self.get_session_log_path(user_email, chat_session_id)
+        if not os.path.exists(log_path):
+            return []
+        
+        messages = []
+        try:
+            with open(log_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        messages.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # A torn trailing line from an interrupted append
+                        self.logger.warning(f"Skipping corrupt line in {log_path}")
+        except IOError as e:
+            self.logger.error(f"Error loading chat messages: {e}")
+        
+        return messages
+    
+    def _list_session_ids(self, user_email: str) -> List[str]:
+        """List the ids of every chat session stored for a user"""
+        user_dir = self.get_user_dir(user_email)
+        if not os.path.isdir(user_dir):
+            return []
+        return [
+            file_name[:-len(self.META_SUFFIX)]
+            for file_name in os.listdir(user_dir)
+            if file_name.endswith(self.META_SUFFIX)
+        ]
+    
+    def _write_user_document(self, user_email: str, chat_data: Dict):
+        """Write a full ``{"user_email", "chats"}`` document in the per-session layout"""
+        user_dir = self.get_user_dir(user_email)
+        os.makedirs(user_dir, exist_ok=True)
+        
+        for chat in chat_data.get('chats', []):
+            messages = chat.get('messages', [])
+            meta = {k: v for k, v in chat.items() if k != 'messages'}
+            meta['message_count'] = len(messages)
+            
+            for path in (self.get_session_log_path(user_email, chat['id']),
+                         self.get_session_offsets_path(user_email, chat['id'])):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._append_messages(user_email, chat['id'], messages)
+            self._write_meta(user_email, meta)
+    
+    def _get_document(self, user_email: str) -> Dict:
+        """Get the cached document for a user, loading its index on a miss
+        
+        A document holds the session index, the metadata and messages of the
+        sessions touched so far, and the writes not yet flushed to disk.
+        Callers must hold ``self._lock`` while using it.
+        """
+        document = self._documents.get(user_email)
+        
+        # Another worker changed the user's files since we loaded them
+        if document is not None and document['signature'] != self._index_signature(user_email):
+            try:
+                self._flush_document(user_email, document)
+                self._documents.pop(user_email)
+                document = None
+            except IOError as e:
+                # Keep serving the cached document rather than drop its unwritten messages
+                self.logger.error(f"Error flushing chats for {user_email}: {e}")
+        
+        if document is None:
+            self._prepare_user(user_email)
+            sessions, signature = self._load_index(user_email)
+            document = {
+                'index': sessions,
+                'metas': {},
+                'messages': {},
+                'pending': {},
+                'appended': {},
+                'dirty': set(),
+                'signature': signature
+            }
+            self._documents.set(user_email, document)
+        return document
+    
+    @contextmanager
+    def _write_locked(self, user_email: str, document: Dict):
+        """Hold the exclusive user lock while writing, keeping the document's signature current
+        
+        If another worker wrote since the document was loaded, its signature is
+        cleared so the next access reloads it instead of serving stale data.
+        """
+        with self._user_lock(user_email):
+            stale = self._index_signature(user_email) != document['signature']
+            yield
+            document['signature'] = None if stale else self._index_signature(user_email)
+    
+    def _get_meta(self, document: Dict, user_email: str, chat_session_id: str) -> Optional[Dict]:
+        """Get a session's metadata from the document, reading it from disk once"""
+        meta = document['metas'].get(chat_session_id)
+        if meta is None:
+            meta = self._read_meta(user_email, chat_session_id)
+            if meta is not None:
+                document['metas'][chat_session_id] = meta
+        return meta
+    
+    def _get_messages(self, document: Dict, user_email: str, chat_session_id: str) -> List[Dict]:
+        """Get a session's messages from the document, reading its log from disk once"""
+        messages = document['messages'].get(chat_session_id)
+        if messages is None:
+            with self._user_lock(user_email, shared=True):
+                messages = self._read_messages(user_email, chat_session_id)
+            messages += document['pending'].get(chat_session_id, [])
+            document['messages'][chat_session_id] = messages
+        return messages
+    
+    def _mark_dirty(self, document: Dict, user_email: str, meta: Dict):
+        """Record a metadata change in the document and schedule it for flushing"""
+        document['metas'][meta['id']] = meta
+        document['index'][meta['id']] = self._index_entry(meta)
+        document['dirty'].add(meta['id'])
+        
+        if self.flush_interval <= 0:
+            self._flush_quietly(user_email, document)
+        else:
+            self._ensure_flusher()
+    
+    def _flush_document(self, user_email: str, document: Dict):
+        """Write a document's pending messages, metadata and index entries to disk
+        
+        Metadata is merged with the record on disk: the message count is
+        increased by the number of messages appended here, so concurrent
+        writers in other processes don't overwrite each other's counts.
+        
+        Sessions whose messages or metadata could not be written stay dirty,
+        with their messages still pending, and the last IOError is raised
+        once the other sessions are written.
+        """
+        with self._lock:
+            if not document['dirty']:
+                return
+            
+            index_entries = []
+            failed = set()
+            error = None
+            with self._write_locked(user_email, document):
+                for chat_id in document['dirty']:
+                    pending = document['pending'].pop(chat_id, [])
+                    meta = document['metas'].get(chat_id)
+                    on_disk = self._read_meta(user_email, chat_id)
+                    
+                    if meta is None or on_disk is None:
+                        # Deleted by another worker in the meantime
+                        document['index'].pop(chat_id, None)
+                        document['metas'].pop(chat_id, None)
+                        document['messages'].pop(chat_id, None)
+                        document['appended'].pop(chat_id, None)
+                        continue
+                    
+                    try:
+                        self._append_messages(user_email, chat_id, pending)
+                    except IOError as e:
+                        document['pending'][chat_id] = pending
+                        failed.add(chat_id)
+                        error = e
+                        continue
+                    
+                    # Messages appended by an earlier flush whose metadata write failed
+                    appended = document['appended'].pop(chat_id, 0) + len(pending)
+                    
+                    merged = dict(on_disk)
+                    merged['message_count'] = on_disk.get('message_count', 0) + appended
+                    merged['last_activity'] = max(meta['last_activity'], on_disk['last_activity'])
+                    merged['status'] = meta['status']
+                    if 'conversation_state' in meta:
+                        merged['conversation_state'] = meta['conversation_state']
+                    try:
+                        self._write_meta(user_email, merged, update_index=False)
+                    except IOError as e:
+                        document['appended'][chat_id] = appended
+                        failed.add(chat_id)
+                        error = e
+                        continue
+                    
+                    document['metas'][chat_id] = merged
+                    document['index'][chat_id] = self._index_entry(merged)
+                    index_entries.append(document['index'][chat_id])
+                
+                self._append_index(user_email, index_entries)
+            document['dirty'] = failed
+            if error is not None:
+                raise error
+    
+    def _flush_quietly(self, user_email: str, document: Dict):
+        """Flush a document, logging a failed write; its messages stay pending for the next flush"""
         try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(chat_data, f, indent=2, ensure_ascii=False)
+            self._flush_document(user_email, document)
         except IOError as e:
-            self.logger.error(f"Error saving user chats: {e}")
+            self.logger.error(f"Error flushing chats for {user_email}, will retry: {e}")
+    
+    def flush(self, user_email: Optional[str] = None):
+        """Flush pending writes for one user, or for every cached user"""
+        with self._lock:
+            if user_email is not None:
+                document = self._documents.peek(user_email)
+                if document is not None:
+                    self._flush_document(user_email, document)
+                return
+            
+            for cached_email, document in self._documents.items():
+                self._flush_quietly(cached_email, document)
+    
+    def _ensure_flusher(self):
+        """Start the background flusher thread if it isn't running in this process"""
+        if self._closed:
+            self.flush()
+            return
+        
+        # A forked worker inherits the object but not the thread
+        if self._flusher is not None and self._flusher_pid == os.getpid() and self._flusher.is_alive():
+            return
+        
+        self._flusher_pid = os.getpid()
+        self._flusher = threading.Thread(target=self._flush_loop, name='chat-storage-flusher', daemon=True)
+        self._flusher.start()
+    
+    def _flush_loop(self):
+        """Periodically flush pending writes and evict expired documents"""
+        while not self._closed:
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            try:
+                self._documents.expire()
+                self.flush()
+            except Exception as e:
+                self.logger.error(f"Error flushing chat storage: {e}")
+    
+    def close(self):
+        """Stop the background flusher and write everything still pending"""
+        self._closed = True
+        self._flush_event.set()
+        self.flush()
+    
+    def cache_stats(self) -> Dict:
+        """Statistics of the in-memory document cache"""
+        stats = self._documents.stats()
+        with self._lock:
+            stats['dirty_sessions'] = sum(len(document['dirty']) for _, document in self._documents.items())
+        return stats
+    
+    def load_user_chats(self, user_email: str) -> Dict:
+        """Load all chats for a user"""
+        chats = []
+        with self._lock:
+            document = self._get_document(user_email)
+            for chat_id in list(document['index']):
+                meta = self._get_meta(document, user_email, chat_id)
+                if meta is None:
+                    continue
+                chat = dict(meta)
+                chat['messages'] = list(self._get_messages(document, user_email, chat_id))
+                chats.append(chat)
+        
+        chats.sort(key=lambda x: x['started_at'])
+        return {"user_email": user_email, "chats": chats}
+    
+    def save_user_chats(self, user_email: str, chat_data: Dict):
+        """Save all chats for a user, replacing whatever is stored"""
+        with self._lock:
+            self.flush(user_email)
+            self._documents.pop(user_email)
+            self._prepare_user(user_email)
+            
+            with self._user_lock(user_email):
+                keep_ids = {chat['id'] for chat in chat_data.get('chats', [])}
+                for chat_id in self._list_session_ids(user_email):
+                    if chat_id not in keep_ids:
+                        self._remove_session_files(user_email, chat_id)
+                
+                self._write_user_document(user_email, chat_data)
     
     def create_chat_session(self, user_email: str, title: Optional[str] = None) -> str:
         """Create a new chat session"""
         chat_id = str(uuid.uuid4())
         session_title = title or f"Chat {datetime.now().strftime('%b %d, %Y at %I:%M %p')}"
         
-        user_data = self.load_user_chats(user_email)
-        
         new_chat = {
             'id': chat_id,
             'user_email': user_email,
@@ -61,12 +757,16 @@ class SimpleChatStorage:
             'started_at': datetime.now().isoformat(),
             'last_activity': datetime.now().isoformat(),
             'status': 'active',
-            'message_count': 0,
-            'messages': []
+            'message_count': 0
         }
         
-        user_data['chats'].append(new_chat)
-        self.save_user_chats(user_email, user_data)
+        # Session creation is rare, so it is written through immediately
+        with self._lock:
+            document = self._get_document(user_email)
+            with self._write_locked(user_email, document):
+                self._write_meta(user_email, new_chat)
+            document['metas'][chat_id] = new_chat
+            document['index'][chat_id] = self._index_entry(new_chat)
         
         self.logger.info(f"Created chat session {chat_id} for user {user_email}")
         return chat_id
@@ -75,128 +775,216 @@ class SimpleChatStorage:
         """Save a message to a chat session"""
         message_id = str(uuid.uuid4())
         
-        user_data = self.load_user_chats(user_email)
-        
-        # Find the chat session
-        chat_session = None
-        for chat in user_data['chats']:
-            if chat['id'] == chat_session_id:
-                chat_session = chat
-                break
-        
-        if not chat_session:
-            self.logger.error(f"Chat session {chat_session_id} not found")
-            return ""
-        
-        # Create message
-        message = {
-            'id': message_id,
-            'chat_session_id': chat_session_id,
-            'message_type': message_type,
-            'content': content,
-            'message_data': message_data or {},
-            'timestamp': datetime.now().isoformat()
-        }
+        with self._lock:
+            document = self._get_document(user_email)
+            
+            # Find the chat session
+            chat_session = self._get_meta(document, user_email, chat_session_id)
+            
+            if not chat_session:
+                self.logger.error(f"Chat session {chat_session_id} not found")
+                return ""
+            
+            # Create message
+            message = {
+                'id': message_id,
+                'chat_session_id': chat_session_id,
+                'message_type': message_type,
+                'content': content,
+                'message_data': message_data or {},
+                'timestamp': datetime.now().isoformat()
+            }
+            self._add_message(document, user_email, chat_session, message)
         
-        # Add message to chat
-        chat_session['messages'].append(message)
-        chat_session['message_count'] = len(chat_session['messages'])
-        chat_session['last_activity'] = datetime.now().isoformat()
-        chat_session['status'] = 'active'
+        return message_id
+    
+    def _add_message(self, document: Dict, user_email: str, chat_session: Dict, message: Dict):
+        """Queue a message for the session log and bump the metadata record"""
+        chat_session_id = chat_session['id']
+        document['pending'].setdefault(chat_session_id, []).append(message)
+        if chat_session_id in document['messages']:
+            document['messages'][chat_session_id].append(message)
         
-        # Save updated data
-        self.save_user_chats(user_email, user_data)
+        chat_session['message_count'] = chat_session.get('message_count', 0) + 1
+        chat_session['last_activity'] = max(chat_session.get('last_activity', ''), message['timestamp'])
+        chat_session['status'] = 'active'
+        self._mark_dirty(document, user_email, chat_session)
+    
+    def save_messages(self, messages: List[Dict]) -> int:
+        """Save a batch of queued messages and write them to disk, returns how many were new
         
-        return message_id
+        Messages are grouped per user so each session log gets one append.
+        If the disk write fails IOError is raised for the caller to retry the
+        batch. Messages already pending or at the end of the session log are
+        skipped, so a retried or replayed batch is not saved twice.
+        """
+        saved = 0
+        documents = {}
+        known = {}
+        with self._lock:
+            for message in messages:
+                user_email = message['user_email']
+                chat_session_id = message['chat_session_id']
+                document = self._get_document(user_email)
+                chat_session = self._get_meta(document, user_email, chat_session_id)
+                if not chat_session:
+                    self.logger.error(f"Chat session {chat_session_id} not found")
+                    continue
+                
+                # Held on to, as a later user in the batch may evict it from the cache,
+                # and flushed even if every message is skipped to finish a failed write
+                documents[user_email] = document
+                if chat_session_id not in known:
+                    known[chat_session_id] = self._recent_message_ids(document, user_email, chat_session_id, len(messages))
+                if message['id'] in known[chat_session_id]:
+                    continue
+                
+                fields = {key: message.get(key) for key in ('id', 'chat_session_id', 'message_type', 'content', 'message_data', 'timestamp')}
+                fields['message_data'] = fields['message_data'] or {}
+                self._add_message(document, user_email, chat_session, fields)
+                known[chat_session_id].add(message['id'])
+                saved += 1
+            
+            for user_email, document in documents.items():
+                self._flush_document(user_email, document)
+        return saved
+    
+    def _recent_message_ids(self, document: Dict, user_email: str, chat_session_id: str, count: int) -> set:
+        """Ids of a session's pending messages and of the last ``count`` messages in its log"""
+        ids = {message['id'] for message in document['pending'].get(chat_session_id, [])}
+        on_disk = self._count_messages_on_disk(user_email, chat_session_id)
+        ids.update(message.get('id') for message in self._read_message_range(user_email, chat_session_id, max(on_disk - count, 0), on_disk))
+        return ids
     
     def get_user_chat_sessions(self, user_email: str, limit: int = 50) -> List[Dict]:
         """Get all chat sessions for a user"""
-        user_data = self.load_user_chats(user_email)
+        with self._lock:
+            sessions = list(self._get_document(user_email)['index'].values())
         
         # Sort by last activity (most recent first)
-        chats = sorted(user_data['chats'], key=lambda x: x['last_activity'], reverse=True)
+        chats = sorted(sessions, key=lambda x: x['last_activity'], reverse=True)
         
-        # Remove messages from the list view for performance and add formatted timestamps
+        # Only the relative time depends on "now", the rest is stored in the index
+        now = datetime.now()
         chat_list = []
         for chat in chats[:limit]:
-            # Format timestamps for display
-            last_activity_dt = datetime.fromisoformat(chat['last_activity'])
-            now = datetime.now()
-            
-            # Calculate time differences
-            time_diff = now - last_activity_dt
-            
-            # Format relative time
-            if time_diff.days > 0:
-                if time_diff.days == 1:
-                    relative_time = "1 day ago"
-                else:
-                    relative_time = f"{time_diff.days} days ago"
-            elif time_diff.seconds > 3600:
-                hours = time_diff.seconds // 3600
-                if hours == 1:
-                    relative_time = "1 hour ago"
-                else:
-                    relative_time = f"{hours} hours ago"
-            elif time_diff.seconds > 60:
-                minutes = time_diff.seconds // 60
-                if minutes == 1:
-                    relative_time = "1 minute ago"
-                else:
-                    relative_time = f"{minutes} minutes ago"
-            else:
-                relative_time = "Just now"
-            
-            # Format date and time
-            date_str = last_activity_dt.strftime("%B %d, %Y")
-            time_str = last_activity_dt.strftime("%I:%M %p")
-            
-            chat_summary = {k: v for k, v in chat.items() if k != 'messages'}
-            chat_summary['formatted_date'] = date_str
-            chat_summary['formatted_time'] = time_str
-            chat_summary['relative_time'] = relative_time
+            chat_summary = dict(chat)
+            chat_summary['relative_time'] = format_relative_time(now - datetime.fromisoformat(chat['last_activity']))
             chat_list.append(chat_summary)
         
         return chat_list
     
-    def get_chat_messages(self, chat_session_id: str, user_email: str) -> List[Dict]:
-        """Get all messages for a chat session"""
-        user_data = self.load_user_chats(user_email)
+    def get_chat_messages(self, chat_session_id: str, user_email: str, limit: Optional[int] = None, before: Optional[str] = None) -> List[Dict]:
+        """Get the messages of a chat session, all of them unless a page is asked for"""
+        if limit is not None or before is not None:
+            return self.get_chat_messages_page(chat_session_id, user_email, limit or 20, before)['messages']
         
-        # Find the chat session
-        for chat in user_data['chats']:
-            if chat['id'] == chat_session_id:
-                return chat.get('messages', [])
+        with self._lock:
+            document = self._get_document(user_email)
+            if self._get_meta(document, user_email, chat_session_id) is None:
+                return []
+            return list(self._get_messages(document, user_email, chat_session_id))
+    
+    def get_chat_messages_page(self, chat_session_id: str, user_email: str, limit: int = 20, before: Optional[str] = None) -> Dict:
+        """Get up to ``limit`` messages before the ``before`` cursor (the latest ones without it)
         
-        return []
+        Messages are returned oldest first. ``next_cursor`` fetches the page
+        before this one and is None once the start of the chat is reached.
+        Only the requested messages are read, via the offset index.
+        """
+        with self._lock:
+            document = self._get_document(user_email)
+            if self._get_meta(document, user_email, chat_session_id) is None:
+                return {'messages': [], 'next_cursor': None, 'has_more': False}
+            
+            cached = document['messages'].get(chat_session_id)
+            pending = document['pending'].get(chat_session_id, [])
+            if cached is not None:
+                total = len(cached)
+            else:
+                on_disk = self._count_messages_on_disk(user_email, chat_session_id)
+                total = on_disk + len(pending)
+            
+            try:
+                end = total if before is None else max(0, min(int(before), total))
+            except ValueError:
+                end = total
+            start = max(0, end - limit)
+            
+            if cached is not None:
+                messages = cached[start:end]
+            else:
+                # Flushed messages come from the log, the rest are still pending in memory
+                messages = self._read_message_range(user_email, chat_session_id, start, min(end, on_disk))
+                messages += pending[max(start - on_disk, 0):max(end - on_disk, 0)]
+        
+        return {
+            'messages': messages,
+            'next_cursor': str(start) if start > 0 else None,
+            'has_more': start > 0
+        }
+    
+    def get_session_state(self, chat_session_id: str, user_email: str) -> Optional[Dict]:
+        """Get the conversation state stored with a chat session, None if it has none"""
+        with self._lock:
+            document = self._get_document(user_email)
+            chat_session = self._get_meta(document, user_email, chat_session_id)
+            return chat_session.get('conversation_state') if chat_session else None
+    
+    def set_session_state(self, chat_session_id: str, user_email: str, state: Dict) -> bool:
+        """Store the conversation state in a chat session's metadata record"""
+        with self._lock:
+            document = self._get_document(user_email)
+            chat_session = self._get_meta(document, user_email, chat_session_id)
+            if not chat_session:
+                return False
+            
+            chat_session['conversation_state'] = state
+            self._mark_dirty(document, user_email, chat_session)
+        return True
     
     def end_chat_session(self, chat_session_id: str, user_email: str) -> bool:
         """Mark a chat session as ended"""
-        user_data = self.load_user_chats(user_email)
-        
-        # Find and update the chat session
-        for chat in user_data['chats']:
-            if chat['id'] == chat_session_id:
-                chat['status'] = 'ended'
-                chat['last_activity'] = datetime.now().isoformat()
-                self.save_user_chats(user_email, user_data)
-                return True
+        with self._lock:
+            document = self._get_document(user_email)
+            chat = self._get_meta(document, user_email, chat_session_id)
+            
+            if not chat:
+                return False
+            
+            chat['status'] = 'ended'
+            chat['last_activity'] = datetime.now().isoformat()
+            self._mark_dirty(document, user_email, chat)
+        return True
+    
+    def _remove_session_files(self, user_email: str, chat_session_id: str) -> bool:
+        """Remove the log and metadata files of a chat session and drop it from the index"""
+        removed = False
+        for path in (self.get_session_meta_path(user_email, chat_session_id),
+                     self.get_session_log_path(user_email, chat_session_id),
+                     self.get_session_offsets_path(user_email, chat_session_id)):
+            if os.path.exists(path):
+                os.remove(path)
+                removed = True
         
-        return False
+        if removed:
+            self._append_index(user_email, [{'id': chat_session_id, 'deleted': True}])
+        return removed
     
     def delete_chat_session(self, chat_session_id: str, user_email: str) -> bool:
         """Delete a chat session"""
-        user_data = self.load_user_chats(user_email)
-        
-        # Remove the chat session
-        original_count = len(user_data['chats'])
-        user_data['chats'] = [chat for chat in user_data['chats'] if chat['id'] != chat_session_id]
-        
-        if len(user_data['chats']) < original_count:
-            self.save_user_chats(user_email, user_data)
-            return True
-        
-        return False
+        with self._lock:
+            document = self._get_document(user_email)
+            for key in ('index', 'metas', 'messages', 'pending'):
+                document[key].pop(chat_session_id, None)
+            document['dirty'].discard(chat_session_id)
+            
+            try:
+                with self._write_locked(user_email, document):
+                    return self._remove_session_files(user_email, chat_session_id)
+            except OSError as e:
+                self.logger.error(f"Error deleting chat session: {e}")
+                return False
     
     def format_message_for_display(self, message: Dict) -> Dict:
         """Convert stored message to display format"""
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+class _Call:
+    """One in-flight call and the callers waiting on it"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # Wake-ups for async waiters, which must not block on ``done``
+        self.callbacks = []
+    
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one
+    
+    The first caller for a key runs the function; callers arriving while it
+    runs wait and get the same result (or exception) instead of repeating
+    the work. Once the call finishes the key is free again, so this only
+    deduplicates concurrent work - caching is left to the caller. Threads
+    (``do``) and coroutines (``ado``) share the same in-flight calls.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executions = 0
+        self.collapsed = 0
+    
+    def _join(self, key: Hashable, callback: Optional[Callable[[], None]] = None):
+        """Get the in-flight call for a key, starting one if there is none; returns (call, leader)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+                return call, True
+            self.collapsed += 1
+            if callback is not None:
+                call.callbacks.append(callback)
+            return call, False
+    
+    def _finish(self, key: Hashable, call: _Call):
+        with self._lock:
+            del self._calls[key]
+        call.done.set()
+        for callback in call.callbacks:
+            callback()
+    
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """Run ``fn`` for ``key``, or wait up to ``timeout`` seconds for the run already in flight"""
+        call, leader = self._join(key)
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f"Timed out waiting for in-flight call {key!r}")
+            return call.outcome()
+        
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(key, call)
+    
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        """Async version of ``do``: ``fn`` returns an awaitable"""
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+        
+        def wake():
+            loop.call_soon_threadsafe(lambda: finished.done() or finished.set_result(None))
+        
+        call, leader = self._join(key, wake)
+        if not leader:
+            try:
+                await asyncio.wait_for(finished, timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Timed out waiting for in-flight call {key!r}")
+            return call.outcome()
+        
+        try:
+            call.result = await fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(key, call)
+    
+    def stats(self) -> Dict:
+        """How many calls ran and how many were collapsed into one already running"""
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'executions': self.executions,
+                'collapsed': self.collapsed
+            }
\ No newline at end of file
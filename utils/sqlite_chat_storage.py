@@ -0,0 +1,415 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import uuid
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Dict, Optional
+from .simple_chat_storage import format_relative_time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    id TEXT PRIMARY KEY,
+    user_email TEXT NOT NULL,
+    session_title TEXT,
+    started_at TEXT NOT NULL,
+    last_activity TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'active',
+    message_count INTEGER NOT NULL DEFAULT 0,
+    conversation_state TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_activity
+    ON chat_sessions (user_email, last_activity);
+
+CREATE TABLE IF NOT EXISTS chat_messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    chat_session_id TEXT NOT NULL REFERENCES chat_sessions (id) ON DELETE CASCADE,
+    message_type TEXT NOT NULL,
+    content TEXT NOT NULL,
+    message_data TEXT,
+    timestamp TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session_time
+    ON chat_messages (chat_session_id, timestamp);
+
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session_seq
+    ON chat_messages (chat_session_id, seq);
+"""
+
+class SQLiteChatStorage:
+    """SQLite chat storage with the same interface as SimpleChatStorage
+    
+    The database runs in WAL mode, so readers never block the writer and
+    several gunicorn workers can share one file. Sessions are looked up by
+    ``(user_email, last_activity)`` and messages by
+    ``(chat_session_id, timestamp)``, both backed by indexes. Message pages
+    use ``seq`` as a keyset cursor over ``(chat_session_id, seq)``.
+    
+    Each worker process keeps a small pool of connections
+    (``CHAT_SQLITE_POOL_SIZE``); a forked worker starts with a fresh pool.
+    """
+    
+    def __init__(self, db_path: Optional[str] = None, pool_size: Optional[int] = None):
+        self.logger = logging.getLogger(__name__)
+        self.db_path = db_path or os.environ.get('CHAT_SQLITE_PATH', os.path.join('chat_history', 'chats.db'))
+        self.pool_size = pool_size if pool_size is not None else int(os.environ.get('CHAT_SQLITE_POOL_SIZE', 8))
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+            # Databases created before sessions kept their conversation state
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(chat_sessions)')}
+            if 'conversation_state' not in columns:
+                conn.execute('ALTER TABLE chat_sessions ADD COLUMN conversation_state TEXT')
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection configured for concurrent use"""
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+    
+    def _get_pool(self) -> queue.LifoQueue:
+        """Get this process's connection pool, creating it after a fork"""
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = queue.LifoQueue(maxsize=self.pool_size)
+                self._pool_pid = os.getpid()
+            return self._pool
+    
+    @contextmanager
+    def _connection(self):
+        """Borrow a pooled connection, opening a new one if the pool is empty"""
+        pool = self._get_pool()
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+    
+    @contextmanager
+    def _transaction(self):
+        """Run a block in a write transaction"""
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+    
+    def close(self):
+        """Close every pooled connection"""
+        pool = self._get_pool()
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+    
+    def flush(self, user_email: Optional[str] = None):
+        """Writes are committed immediately, nothing to flush"""
+    
+    def create_chat_session(self, user_email: str, title: Optional[str] = None) -> str:
+        """Create a new chat session"""
+        chat_id = str(uuid.uuid4())
+        session_title = title or f"Chat {datetime.now().strftime('%b %d, %Y at %I:%M %p')}"
+        now = datetime.now().isoformat()
+        
+        try:
+            with self._transaction() as conn:
+                conn.execute(
+                    'INSERT INTO chat_sessions (id, user_email, session_title, started_at, last_activity, status, message_count) '
+                    'VALUES (?, ?, ?, ?, ?, ?, 0)',
+                    (chat_id, user_email, session_title, now, now, 'active')
+                )
+        except sqlite3.Error as e:
+            self.logger.error(f"Error creating chat session: {e}")
+            return ""
+        
+        self.logger.info(f"Created chat session {chat_id} for user {user_email}")
+        return chat_id
+    
+    def save_message(self, chat_session_id: str, user_email: str, message_type: str, content: str, message_data: Optional[Dict] = None) -> str:
+        """Save a message to a chat session"""
+        message_id = str(uuid.uuid4())
+        now = datetime.now().isoformat()
+        
+        try:
+            with self._transaction() as conn:
+                # Bump the session first, this also checks it belongs to the user
+                updated = conn.execute(
+                    "UPDATE chat_sessions SET message_count = message_count + 1, last_activity = ?, status = 'active' "
+                    'WHERE id = ? AND user_email = ?',
+                    (now, chat_session_id, user_email)
+                ).rowcount
+                
+                if not updated:
+                    self.logger.error(f"Chat session {chat_session_id} not found")
+                    return ""
+                
+                conn.execute(
+                    'INSERT INTO chat_messages (id, chat_session_id, message_type, content, message_data, timestamp) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (message_id, chat_session_id, message_type, content,
+                     json.dumps(message_data or {}, ensure_ascii=False), now)
+                )
+        except sqlite3.Error as e:
+            self.logger.error(f"Error saving message: {e}")
+            return ""
+        
+        return message_id
+    
+    def save_messages(self, messages: List[Dict]) -> int:
+        """Save a batch of queued messages in one transaction, returns how many were new
+        
+        Messages whose id is already stored, or whose session is gone, are
+        skipped, so a batch can be replayed safely. Database errors are
+        raised for the caller to retry.
+        """
+        sessions = {}
+        with self._transaction() as conn:
+            for message in messages:
+                inserted = conn.execute(
+                    'INSERT OR IGNORE INTO chat_messages (id, chat_session_id, message_type, content, message_data, timestamp) '
+                    'SELECT ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM chat_sessions WHERE id = ? AND user_email = ?)',
+                    (message['id'], message['chat_session_id'], message['message_type'], message['content'],
+                     json.dumps(message.get('message_data') or {}, ensure_ascii=False), message['timestamp'],
+                     message['chat_session_id'], message['user_email'])
+                ).rowcount
+                if inserted:
+                    count, latest = sessions.get(message['chat_session_id'], (0, message['timestamp']))
+                    sessions[message['chat_session_id']] = (count + 1, max(latest, message['timestamp']))
+            
+            conn.executemany(
+                "UPDATE chat_sessions SET message_count = message_count + ?, last_activity = MAX(last_activity, ?), "
+                "status = 'active' WHERE id = ?",
+                [(count, latest, chat_id) for chat_id, (count, latest) in sessions.items()]
+            )
+        return sum(count for count, _ in sessions.values())
+    
+    def get_user_chat_sessions(self, user_email: str, limit: int = 50) -> List[Dict]:
+        """Get all chat sessions for a user"""
+        try:
+            with self._connection() as conn:
+                rows = conn.execute(
+                    'SELECT id, session_title, last_activity, message_count, status FROM chat_sessions '
+                    'WHERE user_email = ? ORDER BY last_activity DESC LIMIT ?',
+                    (user_email, limit)
+                ).fetchall()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error fetching user chat sessions: {e}")
+            return []
+        
+        now = datetime.now()
+        chat_list = []
+        for row in rows:
+            last_activity_dt = datetime.fromisoformat(row['last_activity'])
+            chat_list.append({
+                'id': row['id'],
+                'title': row['session_title'],
+                'last_activity': row['last_activity'],
+                'message_count': row['message_count'],
+                'status': row['status'],
+                'formatted_date': last_activity_dt.strftime("%B %d, %Y"),
+                'formatted_time': last_activity_dt.strftime("%I:%M %p"),
+                'relative_time': format_relative_time(now - last_activity_dt)
+            })
+        
+        return chat_list
+    
+    def _row_to_message(self, row: sqlite3.Row) -> Dict:
+        """Convert a message row to the stored message format"""
+        return {
+            'id': row['id'],
+            'chat_session_id': row['chat_session_id'],
+            'message_type': row['message_type'],
+            'content': row['content'],
+            'message_data': json.loads(row['message_data']) if row['message_data'] else {},
+            'timestamp': row['timestamp']
+        }
+    
+    def get_chat_messages(self, chat_session_id: str, user_email: str, limit: Optional[int] = None, before: Optional[str] = None) -> List[Dict]:
+        """Get the messages of a chat session, all of them unless a page is asked for"""
+        if limit is not None or before is not None:
+            return self.get_chat_messages_page(chat_session_id, user_email, limit or 20, before)['messages']
+        
+        try:
+            with self._connection() as conn:
+                # Insertion order, the same order pages are read in
+                rows = conn.execute(
+                    'SELECT m.* FROM chat_messages m JOIN chat_sessions s ON s.id = m.chat_session_id '
+                    'WHERE m.chat_session_id = ? AND s.user_email = ? ORDER BY m.seq',
+                    (chat_session_id, user_email)
+                ).fetchall()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error fetching chat messages: {e}")
+            return []
+        
+        return [self._row_to_message(row) for row in rows]
+    
+    def get_chat_messages_page(self, chat_session_id: str, user_email: str, limit: int = 20, before: Optional[str] = None) -> Dict:
+        """Get up to ``limit`` messages before the ``before`` cursor (the latest ones without it)
+        
+        Messages are returned oldest first; ``next_cursor`` fetches the page
+        before this one and is None once the start of the chat is reached.
+        """
+        try:
+            before_seq = int(before) if before is not None else None
+        except ValueError:
+            before_seq = None
+        
+        try:
+            with self._connection() as conn:
+                owner = conn.execute(
+                    'SELECT 1 FROM chat_sessions WHERE id = ? AND user_email = ?',
+                    (chat_session_id, user_email)
+                ).fetchone()
+                if owner is None:
+                    return {'messages': [], 'next_cursor': None, 'has_more': False}
+                
+                # Fetch one extra row to learn whether an older page exists
+                if before_seq is None:
+                    rows = conn.execute(
+                        'SELECT * FROM chat_messages WHERE chat_session_id = ? ORDER BY seq DESC LIMIT ?',
+                        (chat_session_id, limit + 1)
+                    ).fetchall()
+                else:
+                    rows = conn.execute(
+                        'SELECT * FROM chat_messages WHERE chat_session_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?',
+                        (chat_session_id, before_seq, limit + 1)
+                    ).fetchall()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error fetching chat messages: {e}")
+            return {'messages': [], 'next_cursor': None, 'has_more': False}
+        
+        has_more = len(rows) > limit
+        rows = list(reversed(rows[:limit]))
+        return {
+            'messages': [self._row_to_message(row) for row in rows],
+            'next_cursor': str(rows[0]['seq']) if has_more else None,
+            'has_more': has_more
+        }
+    
+    def get_session_state(self, chat_session_id: str, user_email: str) -> Optional[Dict]:
+        """Get the conversation state stored with a chat session, None if it has none"""
+        try:
+            with self._connection() as conn:
+                row = conn.execute(
+                    'SELECT conversation_state FROM chat_sessions WHERE id = ? AND user_email = ?',
+                    (chat_session_id, user_email)
+                ).fetchone()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error loading conversation state: {e}")
+            return None
+        
+        return json.loads(row['conversation_state']) if row and row['conversation_state'] else None
+    
+    def set_session_state(self, chat_session_id: str, user_email: str, state: Dict) -> bool:
+        """Store the conversation state with a chat session"""
+        try:
+            with self._transaction() as conn:
+                updated = conn.execute(
+                    'UPDATE chat_sessions SET conversation_state = ? WHERE id = ? AND user_email = ?',
+                    (json.dumps(state, ensure_ascii=False), chat_session_id, user_email)
+                ).rowcount
+        except sqlite3.Error as e:
+            self.logger.error(f"Error saving conversation state: {e}")
+            return False
+        
+        return updated > 0
+    
+    def end_chat_session(self, chat_session_id: str, user_email: str) -> bool:
+        """Mark a chat session as ended"""
+        try:
+            with self._transaction() as conn:
+                updated = conn.execute(
+                    "UPDATE chat_sessions SET status = 'ended', last_activity = ? WHERE id = ? AND user_email = ?",
+                    (datetime.now().isoformat(), chat_session_id, user_email)
+                ).rowcount
+        except sqlite3.Error as e:
+            self.logger.error(f"Error ending chat session: {e}")
+            return False
+        
+        return updated > 0
+    
+    def delete_chat_session(self, chat_session_id: str, user_email: str) -> bool:
+        """Delete a chat session and its messages"""
+        try:
+            with self._transaction() as conn:
+                deleted = conn.execute(
+                    'DELETE FROM chat_sessions WHERE id = ? AND user_email = ?',
+                    (chat_session_id, user_email)
+                ).rowcount
+        except sqlite3.Error as e:
+            self.logger.error(f"Error deleting chat session: {e}")
+            return False
+        
+        return deleted > 0
+    
+    def import_user_chats(self, chat_data: Dict) -> int:
+        """Import a ``SimpleChatStorage.load_user_chats`` document, returns the number of chats imported"""
+        imported = 0
+        with self._transaction() as conn:
+            for chat in chat_data.get('chats', []):
+                messages = chat.get('messages', [])
+                inserted = conn.execute(
+                    'INSERT OR IGNORE INTO chat_sessions (id, user_email, session_title, started_at, last_activity, status, message_count) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (chat['id'], chat_data['user_email'], chat.get('session_title'), chat['started_at'],
+                     chat['last_activity'], chat.get('status', 'ended'), len(messages))
+                ).rowcount
+                if not inserted:
+                    continue
+                
+                conn.executemany(
+                    'INSERT OR IGNORE INTO chat_messages (id, chat_session_id, message_type, content, message_data, timestamp) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [
+                        (msg['id'], chat['id'], msg['message_type'], msg['content'],
+                         json.dumps(msg.get('message_data') or {}, ensure_ascii=False), msg['timestamp'])
+                        for msg in messages
+                    ]
+                )
+                imported += 1
+        
+        return imported
+    
+    def format_message_for_display(self, message: Dict) -> Dict:
+        """Convert stored message to display format"""
+        return {
+            'id': message['id'],
+            'type': message['message_type'],
+            'content': message['content'],
+            'timestamp': message['timestamp'],
+            'message_type': 'text',
+            'message_data': message.get('message_data', {})
+        }
+    
+    def convert_session_messages(self, messages: List[Dict]) -> List[Dict]:
+        """Convert stored messages to session format"""
+        return [self.format_message_for_display(msg) for msg in messages]
\ No newline at end of file
@@ -0,0 +1,298 @@
+import json
+import os
+import sqlite3
+import threading
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+from .file_locks import file_lock, atomic_write, atomic_write_json
+
+def normalize_email(email: str) -> str:
+    """Normalize an email for lookups, so Foo@Example.com and foo@example.com are one account"""
+    return (email or '').strip().casefold()
+
+class JsonUserDirectory:
+    """User accounts in ``users.json`` plus an append-only log, with an in-memory email index
+    
+    ``users.json`` is a snapshot. Signups and password changes are appended
+    to ``users.json.log``, one JSON record per line with the latest record
+    for an email winning, so a write costs the same however many accounts
+    there are. Every ``compact_after`` records the log is folded back into
+    the snapshot. Both are parsed once into a dict keyed by case-folded
+    email; when only the log has grown just the new lines are read, which
+    picks up signups made by other workers. Writes hold an exclusive
+    ``file_lock``, so two workers never lose each other's accounts, and the
+    snapshot is replaced atomically.
+    """
+    
+    def __init__(self, path: Optional[str] = None, compact_after: Optional[int] = None):
+        self.logger = logging.getLogger(__name__)
+        self.path = path or os.environ.get('USERS_FILE', 'users.json')
+        self.log_path = self.path + '.log'
+        self.lock_path = self.path + '.lock'
+        self.compact_after = compact_after if compact_after is not None else int(os.environ.get('USERS_LOG_COMPACT_AFTER', 1000))
+        self._lock = threading.Lock()
+        self._index = {}
+        self._snapshot_signature = None
+        self._log_inode = None
+        self._log_offset = 0
+        self._log_records = 0
+        self.reloads = 0
+        self.compactions = 0
+    
+    def _file_signature(self, path: str):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    
+    def _read(self):
+        """Read the accounts from the snapshot, an empty list if it is missing or unreadable"""
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f).get('users', [])
+        except FileNotFoundError:
+            return []
+        except (json.JSONDecodeError, AttributeError) as e:
+            self.logger.error(f"Error reading {self.path}: {e}")
+            return []
+    
+    def _read_log(self, offset: int):
+        """Read the complete log records after ``offset``, returns them and the offset after the last one"""
+        try:
+            with open(self.log_path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        
+        # A line still being appended is read on the next refresh
+        end = data.rfind(b'\n') + 1
+        records = []
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                self.logger.warning(f"Skipping corrupt line in {self.log_path}")
+        return records, offset + end
+    
+    def _refresh(self):
+        """Bring the index up to date with the files (call with ``_lock`` held)
+        
+        A grown log is read from where the last refresh stopped; a new
+        snapshot or a replaced log rebuilds the index.
+        """
+        snapshot_signature = self._file_signature(self.path)
+        log_signature = self._file_signature(self.log_path)
+        log_inode, log_size = (log_signature[0], log_signature[2]) if log_signature else (None, 0)
+        
+        if snapshot_signature != self._snapshot_signature or log_inode != self._log_inode or log_size < self._log_offset:
+            self._index = {normalize_email(user.get('email')): user for user in self._read()}
+            self._snapshot_signature = snapshot_signature
+            self._log_inode = log_inode
+            self._log_offset = 0
+            self._log_records = 0
+            self.reloads += 1
+        
+        if log_size > self._log_offset:
+            records, self._log_offset = self._read_log(self._log_offset)
+            for record in records:
+                self._index[normalize_email(record.get('email'))] = record
+            self._log_records += len(records)
+    
+    def _append(self, record: Dict):
+        """Append an account record to the log (call with the file lock and ``_lock`` held, after ``_refresh``)"""
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        if size > self._log_offset:
+            # Cut off the torn last line of a writer that died mid-append
+            line = b'\n' + line
+        
+        with open(self.log_path, 'ab') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        
+        self._index[normalize_email(record.get('email'))] = record
+        self._log_inode = os.stat(self.log_path).st_ino
+        self._log_offset = size + len(line)
+        self._log_records += 1
+        if self._log_records >= self.compact_after:
+            self._compact()
+    
+    def _compact(self):
+        """Fold the log into a new snapshot and start an empty log"""
+        atomic_write_json(self.path, {'users': list(self._index.values())}, indent=2)
+        # A fresh file rather than a truncate, so readers notice by its inode
+        atomic_write(self.log_path, b'')
+        self._snapshot_signature = self._file_signature(self.path)
+        self._log_inode = os.stat(self.log_path).st_ino
+        self._log_offset = 0
+        self._log_records = 0
+        self.compactions += 1
+    
+    def get(self, email: str) -> Optional[Dict]:
+        """Get an account by email, None if there is none"""
+        with self._lock:
+            self._refresh()
+            return self._index.get(normalize_email(email))
+    
+    def exists(self, email: str) -> bool:
+        return self.get(email) is not None
+    
+    def all_users(self) -> List[Dict]:
+        with self._lock:
+            self._refresh()
+            return list(self._index.values())
+    
+    def add(self, user: Dict) -> bool:
+        """Add an account, False if one with the same email already exists"""
+        key = normalize_email(user.get('email'))
+        with file_lock(self.lock_path), self._lock:
+            # Another worker may have signed someone up since our last refresh
+            self._refresh()
+            if key in self._index:
+                return False
+            
+            self._append(dict(user, created_at=user.get('created_at') or datetime.now().isoformat()))
+            return True
+    
+    def update_password(self, email: str, password: str) -> bool:
+        """Replace an account's stored password (e.g. with a stronger hash), False if there is no such account"""
+        key = normalize_email(email)
+        with file_lock(self.lock_path), self._lock:
+            self._refresh()
+            if key not in self._index:
+                return False
+            
+            self._append(dict(self._index[key], password=password))
+            return True
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'backend': 'json',
+                'users': len(self._index),
+                'reloads': self.reloads,
+                'log_records': self._log_records,
+                'compactions': self.compactions
+            }
+
+class SQLiteUserDirectory:
+    """User accounts in a SQLite table with a unique index on the normalized email
+    
+    Same interface as JsonUserDirectory. Uniqueness is enforced by the
+    index, so concurrent signups for one email cannot both succeed. On
+    first use an existing ``users.json`` is imported.
+    """
+    
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email_key TEXT NOT NULL,
+        email TEXT NOT NULL,
+        name TEXT NOT NULL,
+        password TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    );
+    
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_key ON users (email_key);
+    """
+    
+    def __init__(self, db_path: Optional[str] = None, import_path: Optional[str] = None):
+        self.logger = logging.getLogger(__name__)
+        self.db_path = db_path or os.environ.get('USERS_SQLITE_PATH', os.path.join('chat_history', 'users.db'))
+        self._local = threading.local()
+        
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._connection().executescript(self.SCHEMA)
+        self._import_json(import_path or os.environ.get('USERS_FILE', 'users.json'))
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use or after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+    
+    def _import_json(self, path: str):
+        """Copy accounts from a users.json file (and its log) into an empty table"""
+        conn = self._connection()
+        if conn.execute('SELECT 1 FROM users LIMIT 1').fetchone() or not (os.path.exists(path) or os.path.exists(path + '.log')):
+            return
+        
+        users = JsonUserDirectory(path).all_users()
+        now = datetime.now().isoformat()
+        conn.executemany(
+            'INSERT OR IGNORE INTO users (email_key, email, name, password, created_at) VALUES (?, ?, ?, ?, ?)',
+            [(normalize_email(user['email']), user['email'], user.get('name', ''), user.get('password', ''),
+              user.get('created_at') or now) for user in users if user.get('email')]
+        )
+        self.logger.info(f"Imported {len(users)} users from {path}")
+    
+    def get(self, email: str) -> Optional[Dict]:
+        """Get an account by email, None if there is none"""
+        try:
+            row = self._connection().execute(
+                'SELECT email, name, password, created_at FROM users WHERE email_key = ?', (normalize_email(email),)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.logger.error(f"Error loading user: {e}")
+            return None
+        return dict(row) if row else None
+    
+    def exists(self, email: str) -> bool:
+        return self.get(email) is not None
+    
+    def add(self, user: Dict) -> bool:
+        """Add an account, False if one with the same email already exists"""
+        try:
+            self._connection().execute(
+                'INSERT INTO users (email_key, email, name, password, created_at) VALUES (?, ?, ?, ?, ?)',
+                (normalize_email(user['email']), user['email'], user.get('name', ''), user.get('password', ''),
+                 user.get('created_at') or datetime.now().isoformat())
+            )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+    
+    def update_password(self, email: str, password: str) -> bool:
+        """Replace an account's stored password (e.g. with a stronger hash), False if there is no such account"""
+        try:
+            cursor = self._connection().execute(
+                'UPDATE users SET password = ? WHERE email_key = ?', (password, normalize_email(email))
+            )
+        except sqlite3.Error as e:
+            self.logger.error(f"Error updating password: {e}")
+            return False
+        return cursor.rowcount > 0
+    
+    def stats(self) -> Dict:
+        count = self._connection().execute('SELECT COUNT(*) FROM users').fetchone()[0]
+        return {'backend': 'sqlite', 'users': count}
+
+USER_DIRECTORIES = {
+    'json': JsonUserDirectory,
+    'sqlite': SQLiteUserDirectory
+}
+
+def create_user_directory(backend=None):
+    """Create the user directory selected by ``USER_DIRECTORY`` (json or sqlite)"""
+    backend = (backend or os.environ.get('USER_DIRECTORY', 'json')).lower()
+    
+    directory_class = USER_DIRECTORIES.get(backend)
+    if directory_class is None:
+        logging.warning(f"Unknown user directory '{backend}', falling back to json")
+        directory_class = JsonUserDirectory
+    
+    return directory_class()
\ No newline at end of file